@@ -0,0 +1,892 @@
+# apontamentos.py
+"""
+Regras de dados dos apontamentos que não dependem do Streamlit.
+
+merge_by_id() mescla um lote de linhas (novas ou alteradas) na versão lida
+do arquivo, com as mesmas regras da mescla original do app:
+  - linha com ID existente: atualiza só as colunas que existem nas duas
+    tabelas (a primeira linha do lote e a primeira do arquivo com esse ID);
+    valor vazio (NaN/NaT) vira None;
+  - ID novo: a linha inteira vai ao final (colunas novas são criadas);
+  - arquivo vazio: o resultado é o próprio lote.
+
+A mescla é feita por coluna sobre o índice de posições por ID, em vez de
+procurar cada ID e gravar célula a célula.
+
+IdAllocator distribui os IDs de apontamento (3 dígitos + 2 letras
+embaralhados, ex: "4K1P7") para todas as sessões do processo: cada sessão
+recebe um ID reservado (lease) ao abrir o formulário e o confirma (commit)
+ao salvar; só no commit um ID pode ser recusado (se apareceu no arquivo ou
+a reserva venceu e outra sessão o pegou).
+
+SharedSnapshot guarda uma única cópia dos apontamentos por processo,
+versionada pelo eTag do arquivo, lida por todas as sessões; cada sessão
+guarda só as suas edições ainda não salvas num Overlay. Cada versão da
+cópia pode ter um SnapshotIndex (valor -> posições das colunas de filtro e
+n-gramas dos IDs), atualizado só nas linhas que mudaram quando uma
+gravação é publicada.
+
+paginate() devolve uma página da tabela (ordenada por colunas à escolha)
+a partir de um cursor, o ID da primeira linha da página: a página fica
+presa à mesma linha mesmo que outras entrem ou saiam antes dela. Só as
+colunas de ordenação são lidas por inteiro; a cópia é só da página.
+
+SCHEMA fixa o tipo de cada coluna (categorias para as colunas de poucos
+valores, datetime64 para as datas, texto no resto); apply_schema() é
+aplicado uma vez na carga, e merge_by_id()/Overlay.apply() mantêm os tipos.
+
+    python apontamentos.py bench --rows 10000 50000 200000 --updates 200
+compara com a mescla célula a célula, e
+    python apontamentos.py bench-schema --rows 50000 200000
+compara memória e filtros da tabela tipada com a de colunas object.
+"""
+import argparse, itertools, random, re, sys, threading, time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (vem com o Streamlit)
+    _TEXTO = pd.StringDtype("pyarrow")
+except ImportError:
+    _TEXTO = pd.StringDtype()
+
+STATUS = ("REALIZADO DURANTE A CONDUÇÃO", "REALIZADO", "VERIFICANDO", "PENDENTE", "NÃO APLICÁVEL")
+
+# tipo de cada coluna: "categoria", "data" ou "texto" (colunas fora daqui ficam como vieram)
+SCHEMA = {
+    "ID": "texto",
+    "Código do Estudo": "categoria",
+    "Nome da Pesquisa": "texto",
+    "Data do Apontamento": "data",
+    "Responsável Pelo Apontamento": "texto",
+    "Origem Do Apontamento": "categoria",
+    "Documentos": "texto",
+    "Participante": "texto",
+    "Período": "categoria",
+    "Prazo Para Resolução": "data",
+    "Apontamento": "texto",
+    "Status": "categoria",
+    "Verificador": "texto",
+    "Disponibilizado para Verificação": "data",
+    "Justificativa": "texto",
+    "Responsável Pela Correção": "texto",
+    "Data Resolução": "data",
+    "Plantão": "categoria",
+    "Departamento": "categoria",
+    "Tempo de casa": "categoria",
+    "Responsável Indicado": "texto",
+    "Grau De Criticidade Do Apontamento": "categoria",
+    "Responsável Atualização": "texto",
+    "Data Atualização": "data",
+    "Data Início Verificação": "data",
+}
+# categorias que existem mesmo sem aparecer nos dados (ex: opções do editor de Status)
+_CATEGORIAS = {"Status": STATUS}
+
+
+def apply_schema(df: pd.DataFrame, schema: dict | None = None) -> pd.DataFrame:
+    """`df` com os tipos de `schema` (cópia só se alguma coluna precisou ser convertida)."""
+    conv = {}
+    for col, kind in (SCHEMA if schema is None else schema).items():
+        if col not in df.columns:
+            continue
+        s = df[col]
+        if kind == "categoria" and not isinstance(s.dtype, pd.CategoricalDtype):
+            conv[col] = _as_category(col, s)
+        elif kind == "data" and not pd.api.types.is_datetime64_any_dtype(s):
+            conv[col] = pd.to_datetime(s, errors="coerce")
+        elif kind == "texto" and not isinstance(s.dtype, pd.StringDtype):
+            conv[col] = _as_text(s)
+    if not conv:
+        return df
+    df = df.copy()
+    for col, s in conv.items():
+        df[col] = s
+    return df
+
+
+def _as_category(col: str, s: pd.Series) -> pd.Series:
+    if not _all_text(s):
+        s = _as_text(s).astype(object)
+    s = s.astype("category")
+    missing = [c for c in _CATEGORIAS.get(col, ()) if c not in s.cat.categories]
+    return s.cat.add_categories(missing) if missing else s
+
+
+def _as_text(s: pd.Series) -> pd.Series:
+    # número inteiro lido como float (coluna com vazios) não vira "12.0"
+    if pd.api.types.is_float_dtype(s) and (s.dropna() % 1 == 0).all():
+        s = s.astype("Int64")
+    return s.astype(_TEXTO)
+
+
+def _all_text(values: pd.Series) -> bool:
+    return pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty")
+
+
+def merge_by_id(base_df: pd.DataFrame, df_to_save: pd.DataFrame, key: str = "ID") -> pd.DataFrame:
+    """Mescla `df_to_save` em `base_df` pela coluna `key` (ver o docstring do módulo)."""
+    if base_df.empty:
+        # Se o arquivo está vazio, salva tudo
+        return df_to_save.copy()
+
+    base_df = base_df.copy()
+    ids = base_df[key]
+    base_df[key] = (ids if isinstance(ids.dtype, pd.StringDtype) else ids.astype(str)).str.strip()
+
+    # posição da primeira linha de cada ID no arquivo
+    first = ~base_df[key].duplicated()
+    pos_by_id = pd.Series(np.flatnonzero(first.to_numpy()), index=base_df[key][first].to_numpy())
+
+    is_update = df_to_save[key].isin(pos_by_id.index)
+    updates = df_to_save[is_update].drop_duplicates(subset=key, keep="first")
+    new_rows = df_to_save[~is_update]
+
+    # as novas entram antes: as colunas que elas criam também valem para as alteradas
+    if len(new_rows):
+        base_df = pd.concat([base_df, _like(new_rows, base_df)], ignore_index=True)
+
+    if len(updates):
+        pos = pos_by_id.loc[updates[key]].to_numpy()
+        for col in df_to_save.columns:
+            if col == key or col not in base_df.columns:
+                continue
+            _assign(base_df, col, pos, updates[col])
+    return base_df
+
+
+def _assign(df: pd.DataFrame, col: str, pos: np.ndarray, values: pd.Series):
+    """df[col] nas posições `pos` = values, mantendo o tipo da coluna quando os dois combinam."""
+    target = df[col]
+    j = df.columns.get_loc(col)
+    if _same_kind(target, values):
+        df.iloc[pos, j] = values.to_numpy()
+        return
+    if pd.api.types.is_datetime64_any_dtype(target):
+        dates = _as_dates(values, target.dtype)
+        if dates is not None:
+            df.iloc[pos, j] = dates.to_numpy()
+            return
+    if isinstance(target.dtype, pd.CategoricalDtype) or (isinstance(target.dtype, pd.StringDtype)
+                                                         and _all_text(values)):
+        df.isetitem(j, _widen(target, values))
+        df.iloc[pos, j] = values.astype(object).where(values.notna(), None).to_numpy()
+        return
+    if target.dtype != object:
+        df[col] = target.astype(object)
+    df.iloc[pos, j] = values.astype(object).where(values.notna(), None).to_numpy()
+
+
+def _like(rows: pd.DataFrame, base: pd.DataFrame) -> pd.DataFrame:
+    """`rows` com as colunas categóricas/texto no tipo de `base`, para o concat não voltar a object."""
+    conv = {}
+    for col in rows.columns.intersection(base.columns):
+        dt = base[col].dtype
+        if isinstance(dt, pd.CategoricalDtype) and _all_text(rows[col]):
+            base.isetitem(base.columns.get_loc(col), _widen(base[col], rows[col]))
+            conv[col] = rows[col].astype(base[col].dtype)
+        elif isinstance(dt, pd.StringDtype) and _all_text(rows[col]):
+            conv[col] = rows[col].astype(dt)
+        elif pd.api.types.is_datetime64_any_dtype(dt) and not pd.api.types.is_datetime64_any_dtype(rows[col]):
+            dates = _as_dates(rows[col], dt)
+            if dates is not None:
+                conv[col] = dates
+    if not conv:
+        return rows
+    rows = rows.copy()
+    for col, s in conv.items():
+        rows[col] = s
+    return rows
+
+
+def _as_dates(values: pd.Series, dtype) -> pd.Series | None:
+    """`values` (datas, textos de data ou vazios) no tipo de data `dtype`; None se algum não for data."""
+    if pd.api.types.infer_dtype(values, skipna=True) not in ("datetime64", "datetime", "date", "string", "empty"):
+        return None
+    empty = values.isna() | values.astype(str).str.strip().eq("")
+    dates = pd.to_datetime(values.where(~empty, None), errors="coerce")
+    if (dates.isna() & ~empty).any():
+        return None
+    try:
+        return dates.astype(dtype)
+    except (TypeError, ValueError):
+        return None
+
+
+def _widen(target: pd.Series, values: pd.Series) -> pd.Series:
+    """`target` com as categorias novas de `values` (texto e demais tipos ficam como estão)."""
+    if not isinstance(target.dtype, pd.CategoricalDtype):
+        return target
+    new = pd.Index(values.dropna().unique()).difference(target.cat.categories)
+    return target.cat.add_categories(new) if len(new) else target
+
+
+def _same_kind(a: pd.Series, b: pd.Series) -> bool:
+    types = pd.api.types
+    if types.is_datetime64_any_dtype(a) and types.is_datetime64_any_dtype(b):
+        return getattr(a.dtype, "tz", None) == getattr(b.dtype, "tz", None)
+    if types.is_bool_dtype(a) or types.is_bool_dtype(b):
+        return False
+    return types.is_numeric_dtype(a) and types.is_numeric_dtype(b)
+
+
+# -------- Cópia compartilhada --------
+class Snapshot(NamedTuple):
+    df: pd.DataFrame            # compartilhado entre as sessões: não alterar
+    version: str | None         # eTag do arquivo (None = publicada localmente, ainda sem eTag)
+    loaded_at: float
+    index: "SnapshotIndex | None" = None
+
+
+class SharedSnapshot:
+    """
+    Uma cópia imutável dos apontamentos para o processo inteiro.
+
+    `loader()` devolve (df, versão). Com `version_fn` (ex: eTag pelo
+    stat do driveItem), invalidate() só leva a uma nova leitura se a versão
+    mudou. publish() troca a cópia por uma versão mesclada localmente depois
+    de uma gravação, sem reler o arquivo; update(fn) faz a mescla sobre a
+    cópia atual sob o mesmo lock. Quem recebe o df não deve
+    alterá-lo: filtros e seleções já devolvem cópias das linhas usadas.
+
+    Com `index` (ex: SnapshotIndex), cada leitura monta index(df) e cada
+    publish() atualiza o índice anterior com .updated(df).
+    """
+
+    def __init__(self, loader, version_fn=None, index=None):
+        self._loader = loader
+        self._version_fn = version_fn
+        self._index = index
+        self._snap: Snapshot | None = None
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def current(self) -> Snapshot:
+        with self._lock:
+            return self._current()
+
+    def _current(self) -> Snapshot:
+        if self._stale or self._snap is None:
+            if (self._snap is not None and self._snap.version is not None and self._version_fn
+                    and self._version_fn() == self._snap.version):
+                self._snap = self._snap._replace(loaded_at=time.time())
+            else:
+                df, version = self._loader()
+                self._snap = Snapshot(df, version, time.time(), self._index(df) if self._index else None)
+            self._stale = False
+        return self._snap
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def publish(self, df: pd.DataFrame, version: str | None = None):
+        with self._lock:
+            self._publish(df, version)
+
+    def update(self, fn, version: str | None = None) -> pd.DataFrame:
+        """
+        Troca a cópia por fn(df atual) sem soltar o lock: duas sessões que
+        publicam ao mesmo tempo mesclam uma sobre a outra, em vez de cada uma
+        sobre a mesma base (e a última apagar as linhas da primeira).
+        """
+        with self._lock:
+            df = fn(self._current().df)
+            self._publish(df, version)
+            return df
+
+    def _publish(self, df: pd.DataFrame, version: str | None):
+        index = None
+        if self._index:
+            prev = self._snap.index if self._snap is not None else None
+            index = prev.updated(df) if prev is not None else self._index(df)
+        self._snap = Snapshot(df, version, time.time(), index)
+        self._stale = False
+
+    def index_for(self, df: pd.DataFrame) -> "SnapshotIndex | None":
+        """Índice da versão cujo DataFrame é `df` (None se a cópia já mudou ou não há índice)."""
+        snap = self._snap
+        return snap.index if snap is not None and snap.df is df else None
+
+    def memory(self) -> int:
+        snap = self._snap
+        return int(snap.df.memory_usage(deep=True).sum()) if snap is not None else 0
+
+
+class SnapshotIndex:
+    """
+    Índices de uma versão da cópia compartilhada para os filtros da Lista:
+
+      values(col)            -> valores presentes em `col`, ordenados (opções do filtro)
+      positions(col, valor)  -> posições (array ordenado) das linhas com esse valor
+      search_id(trecho)      -> posições dos IDs que contêm `trecho` (sem diferenciar maiúsculas)
+      select(filtros, trecho) -> interseção dos critérios (None = sem critério)
+
+    A busca no ID usa os n-gramas de 1 a 3 caracteres de cada ID; trechos
+    maiores cruzam os trigramas e conferem só os candidatos. Não alterar
+    depois de montado: updated(df) devolve o índice da versão seguinte.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns=("Código do Estudo", "Status"), key: str = "ID"):
+        self._wanted = tuple(columns)
+        self.columns = tuple(c for c in columns if c in df.columns)
+        self.key = key
+        self._n = len(df)
+        self._vals = {c: _as_objects(df[c]) for c in self.columns}
+        self._post = {c: _postings(self._vals[c]) for c in self.columns}
+        self._sorted = {c: sorted(self._post[c]) for c in self.columns}
+        self._ids = _upper_ids(df[key]) if key in df.columns else np.full(len(df), "", dtype=object)
+        self._grams = _gram_postings(self._ids)
+
+    def __len__(self):
+        return self._n
+
+    def values(self, col: str) -> list:
+        return self._sorted.get(col, [])
+
+    def positions(self, col: str, value) -> np.ndarray:
+        return self._post[col].get(value, _EMPTY)
+
+    def search_id(self, text: str) -> np.ndarray:
+        q = str(text).strip().upper()
+        if not q:
+            return np.arange(self._n)
+        if len(q) <= _GRAM_MAX:
+            return self._grams.get(q, _EMPTY)
+        cands = _intersect([self._grams.get(q[i:i + _GRAM_MAX], _EMPTY) for i in range(len(q) - _GRAM_MAX + 1)])
+        return cands[[q in i for i in self._ids[cands]]] if len(cands) else cands
+
+    def select(self, filters: dict | None = None, id_text: str | None = None) -> np.ndarray | None:
+        sets = [self.positions(c, v) for c, v in (filters or {}).items()]
+        if id_text and id_text.strip():
+            sets.append(self.search_id(id_text))
+        return _intersect(sets) if sets else None
+
+    def updated(self, df: pd.DataFrame) -> "SnapshotIndex":
+        """Índice de `df`, a versão seguinte (mesmas posições, linhas novas no fim)."""
+        if (not self._n or len(df) < self._n or self.key not in df.columns
+                or self.columns != tuple(c for c in self._wanted if c in df.columns)):
+            return SnapshotIndex(df, self._wanted, self.key)
+        new = object.__new__(SnapshotIndex)
+        new._wanted, new.columns, new.key, new._n = self._wanted, self.columns, self.key, len(df)
+        new._vals, new._post, new._sorted = {}, {}, {}
+        for c in self.columns:
+            vals = _as_objects(df[c])
+            post = dict(self._post[c])
+            _move(post, _changed(self._vals[c], vals), self._vals[c], vals)
+            new._vals[c], new._post[c] = vals, post
+            new._sorted[c] = self._sorted[c] if post.keys() == self._post[c].keys() else sorted(post)
+        new._ids = _upper_ids(df[self.key])
+        new._grams = dict(self._grams)
+        changed = _changed(self._ids, new._ids)
+        for p in changed:
+            old = self._ids[p] if p < self._n else ""
+            for g in _grams_of(old) - _grams_of(new._ids[p]):
+                new._grams[g] = _drop(new._grams[g], [p])
+            for g in _grams_of(new._ids[p]) - _grams_of(old):
+                new._grams[g] = _add(new._grams.get(g, _EMPTY), [p])
+        return new
+
+
+_EMPTY = np.empty(0, dtype=np.int64)
+_GRAM_MAX = 3
+
+
+def _as_objects(s: pd.Series) -> np.ndarray:
+    """Valores como object, com None para vazio (NaN/NA/NaT)."""
+    return s.astype(object).where(s.notna(), None).to_numpy()
+
+
+def _upper_ids(s: pd.Series) -> np.ndarray:
+    if not isinstance(s.dtype, pd.StringDtype):
+        s = s.astype(str).astype(_TEXTO)
+    return s.str.strip().str.upper().to_numpy(dtype=object, na_value="")
+
+
+def _postings(vals: np.ndarray) -> dict:
+    """{valor: posições ordenadas} (vazios ficam fora)."""
+    codes, uniques = pd.factorize(vals)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return {u: order[bounds[i]:bounds[i + 1]] for i, u in enumerate(uniques)}
+
+
+def _gram_postings(ids: np.ndarray) -> dict:
+    """{n-grama: posições ordenadas} para n = 1.._GRAM_MAX."""
+    if not len(ids):
+        return {}
+    chars = np.array(ids.tolist(), dtype=str)
+    width = chars.dtype.itemsize // 4
+    if width == 0:
+        return {}
+    cp = chars.view(np.uint32).reshape(len(ids), width).astype(np.int64)
+    out = {}
+    for k in range(1, min(_GRAM_MAX, width) + 1):
+        codes = np.zeros((len(ids), width - k + 1), dtype=np.int64)
+        valid = np.ones(codes.shape, dtype=bool)
+        for j in range(k):
+            col = cp[:, j:width - k + 1 + j]
+            codes = (codes << 21) | col
+            valid &= col > 0
+        pos = np.broadcast_to(np.arange(len(ids))[:, None], codes.shape)[valid]
+        codes = codes[valid]
+        order = np.lexsort((pos, codes))
+        codes, pos = codes[order], pos[order]
+        keep = np.ones(len(codes), dtype=bool)
+        keep[1:] = (codes[1:] != codes[:-1]) | (pos[1:] != pos[:-1])      # mesmo n-grama 2x no ID
+        codes, pos = codes[keep], pos[keep]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        for a, b in zip(starts, np.r_[starts[1:], len(codes)]):
+            out[_gram_str(int(codes[a]), k)] = pos[a:b]
+    return out
+
+
+def _gram_str(code: int, k: int) -> str:
+    return "".join(chr((code >> (21 * (k - 1 - j))) & 0x1FFFFF) for j in range(k))
+
+
+def _grams_of(id_: str) -> set:
+    return {id_[i:i + k] for k in range(1, _GRAM_MAX + 1) for i in range(len(id_) - k + 1)}
+
+
+def _changed(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+    """Posições alteradas entre duas versões (as que passam do fim de `old` são novas)."""
+    n = len(old)
+    diff = np.flatnonzero(old != new[:n]) if n else _EMPTY
+    return np.concatenate([diff, np.arange(n, len(new))])
+
+
+def _move(post: dict, changed: np.ndarray, old: np.ndarray, new: np.ndarray):
+    """Tira as posições `changed` do valor antigo e põe no novo, por grupo de valor."""
+    if not len(changed):
+        return
+    n = len(old)
+    was = changed[changed < n]
+    for v, ps in pd.Series(was).groupby(old[was], dropna=True):
+        post[v] = _drop(post[v], ps.to_numpy())
+        if not len(post[v]):
+            del post[v]
+    for v, ps in pd.Series(changed).groupby(new[changed], dropna=True):
+        post[v] = _add(post.get(v, _EMPTY), ps.to_numpy())
+
+
+# posições que sabidamente estão (_drop) ou não estão (_add) no array ordenado `a`
+def _drop(a: np.ndarray, ps) -> np.ndarray:
+    return np.delete(a, np.searchsorted(a, np.sort(ps)))
+
+
+def _add(a: np.ndarray, ps) -> np.ndarray:
+    ps = np.sort(np.asarray(ps, dtype=np.int64))
+    return np.insert(a, np.searchsorted(a, ps), ps)
+
+
+def _intersect(sets: list) -> np.ndarray:
+    sets = sorted(sets, key=len)                    # a menor primeiro: as seguintes só encolhem
+    out = sets[0]
+    for s in sets[1:]:
+        if not len(out):
+            break
+        out = np.intersect1d(out, s, assume_unique=True)
+    return out
+
+
+class Overlay:
+    """Edições de uma sessão ainda não salvas: {ID: {coluna: valor}} por cima da cópia compartilhada."""
+
+    def __init__(self):
+        self.cells: dict[str, dict] = {}
+
+    def set(self, id_, column: str, value):
+        self.cells.setdefault(str(id_), {})[column] = value
+
+    def get(self, id_, column: str, default=None):
+        return self.cells.get(str(id_), {}).get(column, default)
+
+    def clear(self, ids=None):
+        if ids is None:
+            self.cells.clear()
+        for i in ids or ():
+            self.cells.pop(str(i), None)
+
+    def apply(self, df: pd.DataFrame, key: str = "ID") -> pd.DataFrame:
+        """`df` com as edições aplicadas (cópia só quando alguma linha de `df` foi editada)."""
+        if not self.cells or df.empty:
+            return df
+        hit = df[key].astype(str).isin(self.cells)
+        if not hit.any():
+            return df
+        df = df.copy()
+        ids = df[key].astype(str)
+        for id_, vals in self.cells.items():
+            for col, v in vals.items():
+                if col in df.columns:
+                    dt = df[col].dtype
+                    if pd.api.types.is_datetime64_any_dtype(dt):
+                        v = pd.to_datetime(v, errors="coerce")
+                    elif isinstance(dt, pd.CategoricalDtype) and isinstance(v, str):
+                        df[col] = _widen(df[col], pd.Series([v]))
+                    elif isinstance(dt, pd.StringDtype) and (isinstance(v, str) or pd.isna(v)):
+                        pass
+                    elif dt != object:
+                        df[col] = df[col].astype(object)
+                    df.loc[ids == id_, col] = v
+        return df
+
+    def __len__(self):
+        return sum(len(v) for v in self.cells.values())
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.cells) + sum(
+            sys.getsizeof(k) + sys.getsizeof(v) + sum(sys.getsizeof(c) + sys.getsizeof(x) for c, x in v.items())
+            for k, v in self.cells.items())
+
+
+class SessionRegistry:
+    """Sessões ativas do processo (id -> dados de uso), compartilhado entre os threads das sessões."""
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions: dict[str, dict] = {}
+
+    def touch(self, session_id: str, info: dict, now: float | None = None):
+        """Anota `info` da sessão (com "Último acesso") e esquece as paradas há mais de `ttl`."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._sessions[session_id] = {**info, "Último acesso": now}
+            for k in [k for k, v in self._sessions.items() if now - v["Último acesso"] > self.ttl]:
+                del self._sessions[k]
+
+    def snapshot(self) -> list[dict]:
+        """Cópia das entradas (pode ser percorrida enquanto outras sessões se registram)."""
+        with self._lock:
+            return [dict(v) for v in self._sessions.values()]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+# -------- Paginação --------
+class Page(NamedTuple):
+    rows: pd.DataFrame          # cópia só das linhas (e colunas) da página
+    start: int                  # posição da primeira linha na ordem
+    total: int
+    cursor: str | None          # ID da primeira linha desta página
+    prev_cursor: str | None     # ... da página anterior (None = esta é a primeira)
+    next_cursor: str | None     # ... da próxima (None = esta é a última)
+
+
+def paginate(df: pd.DataFrame, size: int, cursor=None, sort_by=(), ascending=True,
+             positions=None, columns=None, key: str = "ID") -> Page:
+    """
+    Página de `size` linhas de `df` (ou só das posições `positions` dele) na
+    ordem de `sort_by`, começando na linha de ID `cursor` (sem cursor, ou se
+    ele saiu da seleção, a primeira página). Empates e "sem ordenação"
+    ficam na ordem do arquivo, então a ordem é a mesma a cada rerun.
+    """
+    pos = np.arange(len(df)) if positions is None else np.asarray(positions, dtype=np.int64)
+    if isinstance(ascending, bool):
+        ascending = [ascending] * len(sort_by)
+    if sort_by and len(pos):
+        ranks = [_sort_rank(df[c] if positions is None else df[c].iloc[pos], asc)
+                 for c, asc in zip(sort_by, ascending)]
+        pos = pos[np.lexsort(ranks[::-1])]          # lexsort é estável: empate = ordem do arquivo
+
+    ids = df[key]
+    start = 0
+    if cursor is not None and len(pos):
+        hit = np.flatnonzero(np.asarray(ids == cursor, dtype=bool))
+        if len(hit):
+            at = np.flatnonzero(pos == hit[0])
+            start = int(at[0]) if len(at) else 0
+    page_pos = pos[start:start + size]
+    cols = slice(None) if columns is None else [df.columns.get_loc(c) for c in columns]
+    rows = df.iloc[page_pos, cols]
+
+    def id_at(i):
+        return ids.iat[pos[i]] if 0 <= i < len(pos) else None
+    return Page(rows, start, len(pos), id_at(start),
+                id_at(max(start - size, 0)) if start > 0 else None,
+                id_at(start + size))
+
+
+def _sort_rank(s: pd.Series, ascending: bool = True) -> np.ndarray:
+    """Posto de cada valor de `s` (inteiros; vazios sempre por último)."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        cats = s.cat.categories
+        rank_of = np.empty(len(cats), dtype=np.int64)
+        rank_of[np.argsort(cats.astype(str))] = np.arange(len(cats))
+        codes = s.cat.codes.to_numpy()
+        ranks, n = np.where(codes < 0, -1, rank_of[np.maximum(codes, 0)]), len(cats)
+    else:
+        try:
+            ranks, uniques = pd.factorize(s, sort=True)
+        except TypeError:                           # tipos misturados numa coluna object
+            ranks, uniques = pd.factorize(s.astype(str), sort=True)
+        n = len(uniques)
+    empty = ranks < 0
+    if not ascending:
+        ranks = n - 1 - ranks
+    return np.where(empty, n, ranks)
+
+
+# -------- IDs --------
+_LETTER_SLOTS = list(itertools.combinations(range(5), 2))      # posições das 2 letras
+_ID_SPACE = len(_LETTER_SLOTS) * 1000 * 26 * 26                # 6.760.000 IDs
+_ID_RE = re.compile(r"^(?=(?:.*\d){3})(?=(?:.*[A-Z]){2})[0-9A-Z]{5}$")
+
+
+def _id_at(n: int) -> str:
+    """n-ésimo ID do espaço (bijeção índice <-> ID)."""
+    slots, rest = divmod(n, 1000 * 676)
+    digits, letters = divmod(rest, 676)
+    a, b = divmod(letters, 26)
+    out = list(f"{digits:03d}")
+    i, j = _LETTER_SLOTS[slots]
+    out.insert(i, chr(65 + a))
+    out.insert(j, chr(65 + b))
+    return "".join(out)
+
+
+class IdAllocator:
+    """
+    IDs únicos para todas as sessões do processo.
+
+      lease(owner)       -> ID reservado para a sessão `owner` por `ttl` segundos
+      commit(id, owner)  -> True e o ID passa a "usado"; False se não vale mais
+      release(id)        -> devolve um ID (ex: gravação que falhou)
+      allocate(n)        -> n IDs já marcados como usados (preenchimento em massa)
+      observe(ids)       -> IDs vistos no arquivo (de outras instâncias ou edição manual)
+
+    O sorteio escolhe uma posição aleatória do espaço e avança até a
+    primeira livre, então não degrada com o espaço ocupando.
+    """
+
+    def __init__(self, ttl: float = 2 * 3600, seed=None):
+        self.ttl = ttl
+        self._used: set[str] = set()
+        self._leases: dict[str, tuple[str, float]] = {}      # id -> (owner, vence em)
+        self._in_space = 0                                   # usados que são do espaço de IDs
+        self._lock = threading.Lock()
+        self._rand = random.Random(seed)
+
+    def observe(self, ids):
+        with self._lock:
+            for i in ids:
+                self._mark_used(_norm_id(i))
+
+    def lease(self, owner: str) -> str:
+        with self._lock:
+            now = time.monotonic()
+            # a sessão tem no máximo uma reserva: a nova substitui a anterior
+            for i, (o, _) in list(self._leases.items()):
+                if o == owner:
+                    del self._leases[i]
+            new_id = self._draw(now)
+            self._leases[new_id] = (owner, now + self.ttl)
+            return new_id
+
+    def commit(self, id_: str, owner: str) -> bool:
+        id_ = _norm_id(id_)
+        with self._lock:
+            if id_ in self._used:
+                return False
+            lease = self._leases.get(id_)
+            if lease and lease[0] != owner and lease[1] > time.monotonic():
+                return False
+            self._leases.pop(id_, None)
+            self._mark_used(id_)
+            return True
+
+    def release(self, id_: str):
+        id_ = _norm_id(id_)
+        with self._lock:
+            self._leases.pop(id_, None)
+            if id_ in self._used:
+                self._used.discard(id_)
+                self._in_space -= bool(_ID_RE.match(id_))
+
+    def allocate(self, n: int) -> list:
+        with self._lock:
+            now = time.monotonic()
+            out = []
+            for _ in range(n):
+                new_id = self._draw(now)
+                self._mark_used(new_id)
+                out.append(new_id)
+            return out
+
+    def free(self) -> int:
+        """IDs ainda disponíveis (fora os usados e as reservas vigentes)."""
+        with self._lock:
+            now = time.monotonic()
+            return _ID_SPACE - self._in_space - sum(1 for _, exp in self._leases.values() if exp > now)
+
+    def _draw(self, now: float) -> str:
+        start = self._rand.randrange(_ID_SPACE)
+        for k in range(_ID_SPACE):
+            cand = _id_at((start + k) % _ID_SPACE)
+            if cand in self._used:
+                continue
+            lease = self._leases.get(cand)
+            if lease and lease[1] > now:
+                continue
+            self._leases.pop(cand, None)        # reserva vencida: o ID volta ao sorteio
+            return cand
+        raise RuntimeError("Espaço de IDs esgotado")
+
+    def _mark_used(self, id_: str):
+        if id_ and id_ not in self._used:
+            self._used.add(id_)
+            self._in_space += bool(_ID_RE.match(id_))
+
+
+def _norm_id(v) -> str:
+    s = "" if v is None else str(v).strip()
+    return "" if s.lower() in ("nan", "none", "nat") else s
+
+
+# -------- Benchmark --------
+def _merge_loop(base_df: pd.DataFrame, df_to_save: pd.DataFrame) -> pd.DataFrame:
+    """A mescla célula a célula (referência do benchmark)."""
+    if base_df.empty:
+        return df_to_save.copy()
+    base_df = base_df.copy()
+    base_df["ID"] = base_df["ID"].astype(str).str.strip()
+    ids_to_save = set(df_to_save["ID"].tolist())
+    existing_ids = set(base_df["ID"].tolist())
+    new_ids = ids_to_save - existing_ids
+    update_ids = ids_to_save & existing_ids
+    if new_ids:
+        base_df = pd.concat([base_df, df_to_save[df_to_save["ID"].isin(new_ids)]], ignore_index=True)
+    for id_val in update_ids:
+        idx_base = base_df.index[base_df["ID"] == id_val].tolist()
+        idx_update = df_to_save.index[df_to_save["ID"] == id_val].tolist()
+        if idx_base and idx_update:
+            for col in df_to_save.columns:
+                if col in base_df.columns:
+                    v = df_to_save.at[idx_update[0], col]
+                    base_df.at[idx_base[0], col] = None if pd.isna(v) else v
+    return base_df
+
+
+def _bench_frames(rows: int, updates: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    base = pd.DataFrame({
+        "ID": [f"{i:06d}A" for i in range(rows)],
+        "Código do Estudo": [f"EST-{i % 40:03d}" for i in range(rows)],
+        "Status": "PENDENTE",
+        "Verificador": None,
+        "Prazo Para Resolução": pd.Timestamp("2025-01-01") + pd.to_timedelta(np.arange(rows) % 365, "D"),
+        "Data Resolução": pd.NaT,
+        "Justificativa": np.nan,
+        "Apontamento": "texto " * 8,
+    })
+    ids = rng.choice(rows, size=min(updates, rows), replace=False)
+    lote = pd.DataFrame({
+        "ID": [f"{i:06d}A" for i in ids] + [f"NOVO{i:03d}" for i in range(max(1, updates // 10))],
+        "Status": "REALIZADO",
+        "Verificador": "Fulano",
+        "Data Resolução": pd.Timestamp("2025-06-01"),
+        "Justificativa": None,
+    })
+    return base, lote
+
+
+def _bench(args):
+    print(f"{'linhas':>8} {'lote':>6} {'célula a célula':>16} {'vetorizada':>11} {'ganho':>7}  iguais")
+    for rows in args.rows:
+        base, lote = _bench_frames(rows, args.updates)
+        t0 = time.perf_counter()
+        ref = _merge_loop(base, lote)
+        t_loop = time.perf_counter() - t0
+        t_vec = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            out = merge_by_id(base, lote)
+            t_vec.append(time.perf_counter() - t0)
+        same = ref.astype(object).where(ref.notna(), None).equals(out.astype(object).where(out.notna(), None))
+        t = min(t_vec)
+        print(f"{rows:>8} {len(lote):>6} {t_loop * 1000:>14.1f}ms {t * 1000:>9.1f}ms {t_loop / t:>6.0f}x  {same}")
+
+
+def _bench_object_frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Tabela como vem hoje da lista/banco: tudo object, datas em texto ISO."""
+    rng = np.random.default_rng(seed)
+    pools = {"Código do Estudo": 40, "Origem Do Apontamento": 6, "Período": 12, "Plantão": 4,
+             "Departamento": 15, "Tempo de casa": 3, "Grau De Criticidade Do Apontamento": 3}
+    cols = {}
+    for col, kind in SCHEMA.items():
+        if col == "ID":
+            cols[col] = [_id_at(i * 7919 % _ID_SPACE) for i in range(rows)]
+        elif col == "Status":
+            cols[col] = np.array(STATUS, dtype=object)[rng.integers(0, len(STATUS), rows)]
+        elif kind == "categoria":
+            cols[col] = np.array([f"{col[:3].upper()}-{k:02d}" for k in range(pools[col])],
+                                 dtype=object)[rng.integers(0, pools[col], rows)]
+        elif kind == "data":
+            days = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 700, rows), "D")
+            vals = days.strftime("%Y-%m-%d").to_numpy(dtype=object)
+            vals[rng.random(rows) < 0.3] = None
+            cols[col] = vals
+        else:
+            cols[col] = [f"{col[:4]} {k}" for k in rng.integers(0, rows // 3 + 1, rows)]
+    return pd.DataFrame(cols)
+
+
+def _bench_schema(args):
+    datas = ["Data do Apontamento", "Prazo Para Resolução", "Data Resolução"]
+    print(f"{'linhas':>8} {'memória object':>15} {'tipada':>9} {'conversão':>10} "
+          f"{'filtro+datas object':>20} {'filtro tipada':>14} {'ganho':>7}")
+    for rows in args.rows:
+        obj = _bench_object_frame(rows)
+        t0 = time.perf_counter()
+        typed = apply_schema(obj)
+        t_conv = time.perf_counter() - t0
+        estudo, status = obj["Código do Estudo"].iloc[0], "PENDENTE"
+
+        def antes():
+            # o que a aba Lista fazia a cada rerun: filtra e converte as datas
+            f = obj[(obj["Código do Estudo"] == estudo) & (obj["Status"] == status)].copy()
+            for col in datas:
+                f[col] = pd.to_datetime(f[col], errors="coerce")
+            return f
+
+        def depois():
+            return typed[(typed["Código do Estudo"] == estudo) & (typed["Status"] == status)]
+
+        t_old = min(_timeit(antes) for _ in range(args.repeat))
+        t_new = min(_timeit(depois) for _ in range(args.repeat))
+        mem_old = obj.memory_usage(deep=True).sum() / 2**20
+        mem_new = typed.memory_usage(deep=True).sum() / 2**20
+        print(f"{rows:>8} {mem_old:>12.1f} MB {mem_new:>6.1f} MB {t_conv * 1000:>8.1f}ms "
+              f"{t_old * 1000:>18.1f}ms {t_new * 1000:>12.1f}ms {t_old / t_new:>6.1f}x")
+
+
+def _timeit(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks dos apontamentos.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("bench", help="compara merge_by_id com a mescla célula a célula")
+    p.add_argument("--rows", type=int, nargs="+", default=[10_000, 50_000, 200_000])
+    p.add_argument("--updates", type=int, default=200, help="linhas alteradas por lote (+10%% de novas)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(run=_bench)
+    p = sub.add_parser("bench-schema", help="memória e filtros da tabela tipada contra colunas object")
+    p.add_argument("--rows", type=int, nargs="+", default=[10_000, 50_000, 200_000])
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(run=_bench_schema)
+    args = ap.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,23 @@ import pandas as pd
 from datetime import datetime
 import io
 import time
-import random
-import string
+import uuid
+import logging
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
 
 # >>> usa o conector (precisa do arquivo sp_connector.py no repo)
-from sp_connector import SPConnector
+from sp_connector import SPConnector, PreconditionFailed
+from sp_metrics import PrometheusExporter
+from sp_retry import CircuitOpenError, RetryPolicy
+from sp_lists import ListExportJob
+from sp_verify import DeepVerifier
+from sp_workbook import RowIndexCache
+from storage import SQLiteStorage, WorkbookSync
+from journal import WriteBehindQueue, WriteJournal
+from gravacao import save_merged
+from apontamentos import (IdAllocator, Overlay, SessionRegistry, SharedSnapshot, SnapshotIndex, apply_schema,
+                          merge_by_id, paginate)
+from referencia import DOCUMENTOS, PARTICIPANTES, SEM_COLABORADOR, SEM_PROTOCOLO, ReferenceData
 
 
 from auth_microsoft import (
@@ -17,6 +29,7 @@ from auth_microsoft import (
     create_user_header,
 )
 
+logger = logging.getLogger(__name__)
 
 
 # === Configurações via secrets (SharePoint - site servicosclinicos) ===
@@ -30,14 +43,86 @@ LIBRARY   = st.secrets["graph"]["library_name"]
 APONTAMENTOS  = st.secrets["files"]["apontamentos"]
 ESTUDOS_CSV   = st.secrets["files"]["estudos_csv"]
 COLABORADORES = st.secrets["files"]["colaboradores"]  # 'SANDRA/PROJETO_DASHBOARD/base_cargo.xlsx'
+# Tabela do Excel com os apontamentos (novos apontamentos entram direto nela pela API de workbook)
+APONTAMENTOS_TABELA = st.secrets["files"].get("apontamentos_tabela", "Apontamentos")
+# Armazenamento dos apontamentos: "excel" (arquivo acima), "lista" (lista do SharePoint,
+# com filtro no servidor; o arquivo vira uma exportação periódica da lista) ou "sqlite"
+# (banco local; um thread sincroniza com o arquivo acima)
+APONTAMENTOS_BACKEND = st.secrets["files"].get("apontamentos_backend", "excel")
+APONTAMENTOS_LISTA = st.secrets["files"].get("apontamentos_lista", "Apontamentos")
+EXPORTACAO_INTERVALO = float(st.secrets["files"].get("exportacao_intervalo", 600))
+APONTAMENTOS_DB = st.secrets["files"].get("apontamentos_db", "apontamentos.db")
+SINCRONIZACAO_INTERVALO = float(st.secrets["files"].get("sincronizacao_intervalo", 15))
+# Fila de gravação do arquivo: diário local dos envios ainda não gravados, espera extra (s)
+# antes de gravar com a fila parada (0: grava na hora; os salvamentos que chegam durante
+# uma gravação saem juntos na seguinte) e quanto cada tela espera
+APONTAMENTOS_DIARIO = st.secrets["files"].get("apontamentos_diario", "apontamentos.journal")
+JANELA_GRAVACAO = float(st.secrets["files"].get("janela_gravacao", 0))
+TEMPO_MAX_GRAVACAO = float(st.secrets["files"].get("tempo_max_gravacao", 180))
+MAX_TENTATIVAS_GRAVACAO = 5
+# Fração das gravações que é baixada de novo, em segundo plano, para conferir os IDs (0 desliga)
+VERIFICACAO_AMOSTRA = float(st.secrets["files"].get("verificacao_amostra", 0.05))
+# Linhas por página na Lista de Apontamentos (só a página vai para o editor)
+TAMANHO_PAGINA = int(st.secrets["files"].get("tamanho_pagina", 50))
+USAR_LISTA = APONTAMENTOS_BACKEND == "lista"
+USAR_SQLITE = APONTAMENTOS_BACKEND == "sqlite"
+
+# Colunas do registro de apontamento (ordem da planilha)
+COLUNAS_APONTAMENTOS = [
+    "ID", "Código do Estudo", "Nome da Pesquisa", "Data do Apontamento",
+    "Responsável Pelo Apontamento", "Origem Do Apontamento", "Documentos",
+    "Participante", "Período", "Prazo Para Resolução", "Apontamento",
+    "Status", "Verificador", "Disponibilizado para Verificação",
+    "Justificativa", "Responsável Pela Correção", "Data Resolução",
+    "Plantão", "Departamento", "Tempo de casa", "Responsável Indicado",
+    "Grau De Criticidade Do Apontamento", "Responsável Atualização",
+    "Data Atualização", "Data Início Verificação"
+]
+
+# Pool HTTP do conector (opcional): conexões simultâneas por host e nº de hosts mantidos
+POOL_MAXSIZE     = int(st.secrets["graph"].get("pool_maxsize", 16))
+POOL_CONNECTIONS = int(st.secrets["graph"].get("pool_connections", 4))
+# Tamanho dos fragmentos do upload em sessão (arquivos > 4 MB), múltiplo de 320 KiB
+UPLOAD_CHUNK_SIZE = int(st.secrets["graph"].get("upload_chunk_size", 10 * 320 * 1024))
+# Novas tentativas do conector em 429/5xx/rede (respeita Retry-After do Graph)
+RETRY_MAX_ATTEMPTS = int(st.secrets["graph"].get("retry_max_attempts", 5))
+RETRY_BACKOFF_MAX  = float(st.secrets["graph"].get("retry_backoff_max", 30))
+# Intervalo (s) entre consultas ao feed delta do drive para invalidar caches
+DELTA_INTERVAL = float(st.secrets["graph"].get("delta_interval", 30))
+# Servidor Graph alternativo (ex: fake_graph.py em http://127.0.0.1:8765) para testes offline
+GRAPH_BASE_URL = st.secrets["graph"].get("base_url")
+# E-mails com acesso à aba de administração (memória por sessão etc.)
+ADMINS = {e.lower() for e in st.secrets.get("app", {}).get("admins", [])}
+# Fuso das datas do app (gravadas em UTC na lista do SharePoint)
+FUSO_HORARIO = st.secrets.get("app", {}).get("timezone", "America/Sao_Paulo")
+# Métricas Prometheus do conector (opcional): porta local do /metrics e/ou arquivo .prom
+METRICS_PORT = st.secrets["graph"].get("metrics_port")
+METRICS_FILE = st.secrets["graph"].get("metrics_file")
+
+# Exportador de métricas (um por processo, sobrevive aos reruns)
+@st.cache_resource
+def _metricas():
+    exporter = PrometheusExporter()
+    if METRICS_PORT:
+        exporter.serve(int(METRICS_PORT))
+    if METRICS_FILE:
+        exporter.write_every(METRICS_FILE)
+    return exporter
 
 # Instância única do conector (cacheada)
 @st.cache_resource
 def _sp():
-    return SPConnector(
+    sp = SPConnector(
         TENANT_ID, CLIENT_ID, CLIENT_SECRET,
-        hostname=HOSTNAME, site_path=SITE_PATH, library_name=LIBRARY
+        hostname=HOSTNAME, site_path=SITE_PATH, library_name=LIBRARY,
+        pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+        upload_chunk_size=UPLOAD_CHUNK_SIZE,
+        retry_policy=RetryPolicy(max_attempts=RETRY_MAX_ATTEMPTS, backoff_max=RETRY_BACKOFF_MAX),
+        base_url=GRAPH_BASE_URL,
     )
+    if METRICS_PORT or METRICS_FILE:
+        sp.add_hook(_metricas())
+    return sp
 
 
 # --------------------------------------------------------------------
@@ -166,19 +251,104 @@ def check_migration_notice():
     return False
 
 
-# Função para ler o arquivo Excel (Apontamentos) do SharePoint com cache
-@st.cache_data
-def get_sharepoint_file():
+def _ler_apontamentos() -> tuple[pd.DataFrame, str | None]:
     """
-    Lê o arquivo Excel do SharePoint (primeira sheet).
+    Lê o arquivo Excel do SharePoint (primeira sheet), ou a lista no modo
+    "lista", ou o banco local no modo "sqlite". Devolve (df, versão), com
+    os tipos de apontamentos.SCHEMA (datas, categorias e texto).
     """
+    if USAR_SQLITE:
+        df, versao = _sincronizacao().store.load(), None
+    elif USAR_LISTA:
+        df, versao = _lista_apontamentos().to_dataframe(columns=COLUNAS_APONTAMENTOS)[COLUNAS_APONTAMENTOS], None
+    else:
+        data, versao = _sp().download_with_etag(APONTAMENTOS)
+        df = pd.read_excel(io.BytesIO(data))
+    return apply_schema(_normalizar_ids(df, _alocador_ids())), versao
+
+
+def _normalizar_ids(df: pd.DataFrame, alocador: IdAllocator) -> pd.DataFrame:
+    """IDs como texto, vistos pelo alocador; linhas sem ID recebem um novo (altera `df`)."""
+    # Fill missing or invalid IDs to prevent NaN issues
+    if not df.empty:
+        if "ID" not in df.columns:
+            df["ID"] = alocador.allocate(len(df))
+        else:
+            df["ID"] = df["ID"].astype(str)
+            alocador.observe(df["ID"])
+            mask = df["ID"].str.lower().isin(["nan", "none", "", "nat"])
+            if mask.any():
+                df.loc[mask, "ID"] = alocador.allocate(int(mask.sum()))
+    return df
+
+
+@st.cache_resource
+def _apontamentos() -> SharedSnapshot:
+    """
+    Cópia única dos apontamentos para todas as sessões, versionada pelo eTag
+    do arquivo, com os índices dos filtros da Lista (estudo, status, trecho do ID).
+    """
+    versao = None if (USAR_SQLITE or USAR_LISTA) else (lambda: _sp().stat(APONTAMENTOS).get("eTag"))
+    return SharedSnapshot(_ler_apontamentos, version_fn=versao, index=SnapshotIndex)
+
+
+# Apontamentos (cópia compartilhada; não alterar o DataFrame devolvido)
+def get_sharepoint_file() -> pd.DataFrame:
     try:
-        data = _sp().download(APONTAMENTOS)
-        return pd.read_excel(io.BytesIO(data))
+        return _apontamentos().current().df
     except Exception as e:
         st.error(f"Erro ao acessar o arquivo no SharePoint (Graph): {e}")
         return pd.DataFrame()
 
+
+def _publicar(*partes: pd.DataFrame) -> pd.DataFrame:
+    """Depois de uma gravação: mescla as linhas gravadas na cópia compartilhada, sem reler o arquivo."""
+    def mesclar(df):
+        vazia = df.empty
+        for rows in partes:
+            df = merge_by_id(df, rows)
+        # a mescla mantém os tipos da cópia: o esquema só falta se ela estava vazia
+        return apply_schema(df) if vazia else df
+
+    return _apontamentos().update(mesclar)
+
+
+@st.cache_data(ttl=60)
+def consultar_apontamentos(filtro: tuple) -> pd.DataFrame:
+    """Apontamentos da lista com o filtro ((coluna, valor), ...) aplicado no servidor."""
+    df = _lista_apontamentos().to_dataframe(filter=dict(filtro), columns=COLUNAS_APONTAMENTOS)
+    return apply_schema(df[COLUNAS_APONTAMENTOS])
+
+
+@st.cache_resource
+def _lista_apontamentos():
+    return _sp().sharepoint_list(APONTAMENTOS_LISTA, tz=FUSO_HORARIO)
+
+
+@st.cache_resource
+def _exportacao_lista():
+    """Regrava o .xlsx dos apontamentos a partir da lista, para quem consome a planilha."""
+    return ListExportJob(_lista_apontamentos(), APONTAMENTOS, APONTAMENTOS_TABELA,
+                         interval=EXPORTACAO_INTERVALO, columns=COLUNAS_APONTAMENTOS).start()
+
+
+@st.cache_resource
+def _sincronizacao():
+    """
+    Banco local dos apontamentos e o thread que o sincroniza com o arquivo.
+    Na primeira execução (banco vazio) a carga inicial é feita aqui mesmo.
+    """
+    store = SQLiteStorage(APONTAMENTOS_DB, COLUNAS_APONTAMENTOS)
+    sync = WorkbookSync(store, _sp(), APONTAMENTOS, APONTAMENTOS_TABELA,
+                        interval=SINCRONIZACAO_INTERVALO, on_change=_apontamentos().invalidate)
+    if not len(store):
+        try:
+            sync.sync()
+        except Exception as e:
+            logger.warning("Carga inicial do banco local falhou (%s); o thread tenta de novo.", e)
+    return sync.start()
+
+
 # Função para ler o arquivo CSV (Estudos) do SharePoint com cache
 @st.cache_data
 def get_sharepoint_file_estudos_csv():
@@ -191,174 +361,346 @@ def get_sharepoint_file_estudos_csv():
 @st.cache_data
 def colaboradores_excel():
     try:
-        data = _sp().download(COLABORADORES)
-        xls = pd.ExcelFile(io.BytesIO(data))
-        colaboradores_df = pd.read_excel(xls, sheet_name="Colaboradores")
+        colaboradores_df = _sp().read_excel(COLABORADORES, sheet_name="Colaboradores")
         return colaboradores_df
     except Exception as e:
         st.error(f"Erro ao acessar o arquivo ou ler as planilhas no SharePoint (Graph): {e}")
         return pd.DataFrame()
-    
 
-def generate_custom_id(existing_ids: set[str]) -> str:
-    while True:
-        digits = random.choices(string.digits, k=3)
-        letters = random.choices(string.ascii_uppercase, k=2)
-        chars = digits + letters
-        random.shuffle(chars)
-        new_id = "".join(chars)
-        if new_id not in existing_ids:
-            return new_id
-        
+
+# Estudos e colaboradores indexados (uma vez por versão dos arquivos; ver referencia.py)
+@st.cache_resource
+def _referencia() -> ReferenceData:
+    return ReferenceData(get_sharepoint_file_estudos_csv(), colaboradores_excel())
+
+
+# Observador de mudanças: invalida só o cache do arquivo que mudou no SharePoint
+@st.cache_resource
+def _observador_sharepoint():
+    # métodos já resolvidos: on_change roda no thread do observador, fora do script
+    invalidar = {
+        # no modo "sqlite" o banco local traz a versão nova
+        APONTAMENTOS: _sincronizacao().poke if USAR_SQLITE else _apontamentos().invalidate,
+        ESTUDOS_CSV: lambda: (get_sharepoint_file_estudos_csv.clear(), _referencia.clear()),
+        COLABORADORES: lambda: (colaboradores_excel.clear(), _referencia.clear()),
+    }
+
+    def on_change(paths):
+        for p in paths:
+            logger.info("Arquivo alterado no SharePoint, invalidando cache: %s", p)
+            invalidar[p]()
+
+    return _sp().watch(list(invalidar), on_change, interval=DELTA_INTERVAL)
+
+
+def aquecer_cache_sharepoint():
+    """
+    Baixa os três arquivos de uma vez (em paralelo) para o cache do conector;
+    em seguida os loaders acima leem do cache sem nova ida ao Graph.
+    Erros ficam para cada loader reportar.
+    """
+    _sp().download_many([ESTUDOS_CSV, COLABORADORES, APONTAMENTOS], return_exceptions=True)
+
+
+@st.cache_resource
+def _alocador_ids() -> IdAllocator:
+    """IDs de apontamento reservados por sessão, únicos no processo (ver apontamentos.IdAllocator)."""
+    return IdAllocator()
+
+
+def _sessao() -> str:
+    """Dono das reservas de ID desta sessão."""
+    return st.session_state.setdefault("sessao_id", uuid.uuid4().hex)
+
+
+@st.cache_resource
+def _sessoes() -> SessionRegistry:
+    """Sessões ativas do processo (para a aba de administração): id -> uso de memória."""
+    return SessionRegistry(ttl=3600)
+
+
+def _registrar_sessao(edicoes: Overlay):
+    """Anota o que esta sessão guarda em memória (DataFrames próprios e edições pendentes)."""
+    proprios = sum(int(v.memory_usage(deep=True).sum()) for v in st.session_state.values()
+                   if isinstance(v, pd.DataFrame))
+    _sessoes().touch(_sessao(), {
+        "Usuário": st.session_state.get("user_email", ""),
+        "Edições pendentes": len(edicoes),
+        "Memória (KB)": round((proprios + edicoes.nbytes()) / 1024, 1),
+    })
+
+
+def _gravar_lote(dfs: list, sp: SPConnector, verificador: DeepVerifier, alocador: IdAllocator,
+                 snap: SharedSnapshot) -> tuple[pd.DataFrame, str | None]:
+    """
+    Grava no arquivo os envios da fila de gravação: baixa, mescla por ID e
+    salva com If-Match, remesclando só se o eTag mudou (ver gravacao.save_merged).
+    Publica a versão gravada na cópia compartilhada e devolve (df, eTag).
+
+    Roda no thread da fila, sem st.* nem caches do streamlit: os objetos vêm
+    prontos de _fila_gravacao. Levanta PreconditionFailed se o arquivo mudar
+    a cada tentativa.
+    """
+    res = save_merged(sp, APONTAMENTOS, dfs, table_name=APONTAMENTOS_TABELA,
+                      max_attempts=MAX_TENTATIVAS_GRAVACAO)
+    # reescrito pelo servidor (hash diferente, já no log de save_merged) fica com a amostra;
+    # só tamanho diferente do enviado força a conferência completa
+    ids = {str(i).strip() for df in dfs for i in df["ID"]}
+    verificador.submit(APONTAMENTOS, res.etag, lambda data: _ids_no_arquivo(data, ids),
+                       force=res.check.size_mismatch)
+    # o arquivo foi gravado com os valores lidos; a cópia publicada passa pelo mesmo
+    # tratamento da leitura (IDs e tipos do esquema) e fica na versão do upload
+    df = apply_schema(_normalizar_ids(res.df, alocador))
+    snap.publish(df, res.etag)
+    return df, res.etag
+
+
+def _ids_no_arquivo(data: bytes, ids: set) -> bool:
+    """Conferência completa: os IDs gravados estão no arquivo baixado."""
+    faltando = ids - set(pd.read_excel(io.BytesIO(data), usecols=["ID"])["ID"].astype(str).str.strip())
+    if faltando:
+        raise LookupError(f"IDs ausentes após a gravação: {', '.join(sorted(faltando))}")
+    return True
+
+
+@st.cache_resource
+def _verificacao_amostral() -> DeepVerifier:
+    """Baixa e confere uma amostra das gravações em segundo plano (ver sp_verify)."""
+    return DeepVerifier(_sp(), rate=VERIFICACAO_AMOSTRA).start()
+
+
+@st.cache_resource
+def _fila_gravacao() -> WriteBehindQueue:
+    """Fila única do processo: os salvamentos que chegam durante uma gravação saem juntos na próxima."""
+    # resolvidos aqui, no thread do script: o thread da fila não chama os caches do streamlit
+    sp, verificador, alocador, snap = _sp(), _verificacao_amostral(), _alocador_ids(), _apontamentos()
+    return WriteBehindQueue(WriteJournal(APONTAMENTOS_DIARIO),
+                            lambda dfs: _gravar_lote(dfs, sp, verificador, alocador, snap),
+                            window=JANELA_GRAVACAO).start()
+
 
 # Função para atualizar o arquivo Excel (Apontamentos) no SharePoint
-def update_sharepoint_file(df: pd.DataFrame) -> pd.DataFrame | None:
+def update_sharepoint_file(*dfs: pd.DataFrame) -> pd.DataFrame | Future | None:
     """
     Atualiza o arquivo Excel no SharePoint de forma segura.
 
-    Estratégia:
-    1. Carrega a versão mais recente do arquivo
-    2. Para linhas existentes: atualiza APENAS as colunas que foram modificadas
-    3. Para linhas novas: adiciona ao final
-    4. Salva arquivo (sheet padrão)
-    5. Tenta novamente em caso de conflito de versão
+    O envio entra no diário local (sobrevive a uma queda do processo) e na
+    fila de gravação; os envios de todas as sessões que chegam enquanto
+    outra gravação está em andamento viram uma única gravação (ver
+    _gravar_lote). Espera a
+    confirmação dessa gravação: devolve o DataFrame gravado, None se falhou
+    de vez, ou o Future do envio se ele ainda está na fila depois de
+    TEMPO_MAX_GRAVACAO ou se a gravação falhou por erro temporário e vai ser
+    repetida (vai ser gravado: quem chamou não pode liberar o ID nem pedir
+    novo envio).
+    Vários DataFrames (ex: linhas com colunas alteradas diferentes) formam um
+    único envio, mesclado na ordem.
     """
-    attempts = 0
-    max_attempts = 5
-    ids_being_saved = []  # Para log de debug
+    partes = []
+    for df in dfs:
+        df_to_save = df.copy()
+        if "ID" not in df_to_save.columns:
+            st.error("❌ ERRO CRÍTICO: DataFrame sem coluna ID! Os dados NÃO foram salvos.")
+            return None
+        # Normaliza IDs removendo espaços em branco
+        df_to_save["ID"] = df_to_save["ID"].astype(str).str.strip()
+        partes.append(df_to_save)
+    ids_being_saved = [i for p in partes for i in p["ID"]]  # Para log de debug
 
-    while True:
-        try:
-            # Carrega versão mais recente do arquivo
-            data = _sp().download(APONTAMENTOS)
-            base_df = pd.read_excel(io.BytesIO(data))
-
-            df_to_save = df.copy()
-            if "ID" not in df_to_save.columns:
-                st.error("❌ ERRO CRÍTICO: DataFrame sem coluna ID! Os dados NÃO foram salvos.")
-                return None
-
-            # Normaliza IDs removendo espaços em branco
-            df_to_save["ID"] = df_to_save["ID"].astype(str).str.strip()
-            ids_being_saved = df_to_save["ID"].tolist()  # Guarda para log
-
-            # Log para debug (só na primeira tentativa)
-            if attempts == 0:
-                with st.expander("🔍 Detalhes técnicos do salvamento (clique para ver)"):
-                    st.text(f"IDs sendo salvos: {', '.join(ids_being_saved)}")
-                    st.text(f"Total de registros no arquivo atual: {len(base_df)}")
-                    st.text(f"Registros a serem salvos: {len(df_to_save)}")
-
-            if not base_df.empty:
-                base_df["ID"] = base_df["ID"].astype(str).str.strip()
-
-                # Separa registros novos dos existentes
-                ids_to_save = set(df_to_save["ID"].tolist())
-                existing_ids = set(base_df["ID"].tolist())
-
-                new_ids = ids_to_save - existing_ids
-                update_ids = ids_to_save & existing_ids
-
-                # Adiciona registros completamente novos
-                if new_ids:
-                    new_rows = df_to_save[df_to_save["ID"].isin(new_ids)]
-                    base_df = pd.concat([base_df, new_rows], ignore_index=True)
-
-                # Atualiza registros existentes coluna por coluna
-                for id_val in update_ids:
-                    idx_base = base_df.index[base_df["ID"] == id_val].tolist()
-                    idx_update = df_to_save.index[df_to_save["ID"] == id_val].tolist()
-
-                    if idx_base and idx_update:
-                        idx_b = idx_base[0]
-                        idx_u = idx_update[0]
-
-                        # Atualiza apenas as colunas que existem em ambos
-                        for col in df_to_save.columns:
-                            if col in base_df.columns:
-                                try:
-                                    new_value = df_to_save.at[idx_u, col]
-                                    # Garante que valores vazios, None ou NaN sejam preservados corretamente
-                                    if pd.isna(new_value):
-                                        base_df.at[idx_b, col] = None
-                                    else:
-                                        base_df.at[idx_b, col] = new_value
-                                except Exception as col_error:
-                                    # Se houver erro ao atualizar uma coluna específica, loga mas continua
-                                    st.warning(f"⚠️ Erro ao atualizar coluna '{col}' para ID {id_val}: {str(col_error)}")
-                                    continue
-            else:
-                # Se o arquivo está vazio, salva tudo
-                base_df = df_to_save.copy()
+    with st.expander("🔍 Detalhes técnicos do salvamento (clique para ver)"):
+        st.text(f"IDs sendo salvos: {', '.join(ids_being_saved)}")
+        st.text(f"Registros a serem salvos: {len(ids_being_saved)}")
 
-            # === SALVA O ARQUIVO ===
-            output = io.BytesIO()
-            base_df.to_excel(output, index=False)
-            output.seek(0)
+    try:
+        fut = _fila_gravacao().submit(*partes)
+        with st.spinner("Salvando no SharePoint..."):
+            base_df, _ = _fila_gravacao().wait(fut, TEMPO_MAX_GRAVACAO)
+
+    except PreconditionFailed as e:
+        # Esgotou as tentativas: o arquivo mudou a cada releitura
+        st.error(f"❌ FALHA AO SALVAR: Máximo de tentativas atingido ({MAX_TENTATIVAS_GRAVACAO}). Os dados NÃO foram salvos no SharePoint!")
+        with st.expander("📋 Informações para o suporte técnico"):
+            st.text(f"Erro: {e}")
+            st.text(f"IDs tentados: {', '.join(ids_being_saved) if ids_being_saved else 'N/A'}")
+            st.text(f"Tentativas: {MAX_TENTATIVAS_GRAVACAO}")
+            st.text(f"Horário: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        return None
+
+    except FuturesTimeout:
+        # O envio continua no diário e na fila (a fila repete as falhas temporárias):
+        # será gravado assim que o SharePoint responder
+        st.warning("⚠️ O SharePoint está demorando ou indisponível no momento. Os dados estão na fila e serão gravados assim que ele responder; não é preciso enviar de novo.")
+        _acompanhar_gravacao(fut, ids_being_saved)
+        return fut
 
-            # Tenta fazer o upload
-            try:
-                _sp().upload_small(APONTAMENTOS, output.getvalue(), overwrite=True)
-            except Exception as upload_error:
-                # Se falhar no upload, não limpa cache e relança a exceção
-                raise upload_error
+    except Exception as e:
+        # Throttling, falhas de rede e circuito aberto são repetidos pelo conector e
+        # pela fila; aqui só chegam erros permanentes ou a desistência da fila.
+        msg = str(e)
+        if isinstance(e, CircuitOpenError):
+            st.error(f"❌ O SharePoint está limitando as requisições no momento. Tente novamente em {e.retry_in:.0f} segundos.")
+        else:
+            st.error(f"❌ ERRO AO SALVAR NO SHAREPOINT: {msg}\n\nOs dados NÃO foram salvos. Por favor, tente novamente ou contate o suporte.")
+        with st.expander("📋 Detalhes do erro"):
+            st.text(f"Tipo de erro: {type(e).__name__}")
+            st.text(f"Mensagem: {msg}")
+            st.text(f"IDs tentados: {', '.join(ids_being_saved) if ids_being_saved else 'N/A'}")
+        return None
+
+    # a cópia compartilhada já foi atualizada pela fila (só depois do upload bem-sucedido)
+    st.success("✅ Mudanças salvas com sucesso no SharePoint!")
+    return base_df
+
+
+def _acompanhar_gravacao(fut: Future, ids: list):
+    """Envio ainda na fila (a fila publica quando gravar): avisa esta sessão nos próximos reruns."""
+    st.session_state.setdefault("gravacoes_pendentes", []).append((ids, fut))
+
+
+def _avisar_gravacoes_pendentes():
+    """Situação dos envios desta sessão que ficaram na fila de gravação."""
+    pendentes = st.session_state.get("gravacoes_pendentes", [])
+    for ids, fut in list(pendentes):
+        if not fut.done():
+            st.info(f"⏳ IDs {', '.join(ids)} na fila de gravação do SharePoint. Não é preciso enviar de novo.")
+            continue
+        pendentes.remove((ids, fut))
+        if fut.exception() is not None:
+            st.error(f"❌ A gravação dos IDs {', '.join(ids)} falhou: {fut.exception()}\n\nOs dados NÃO foram salvos.")
+        else:
+            st.success(f"✅ IDs {', '.join(ids)} gravados no SharePoint.")
 
-            # === VALIDAÇÃO PÓS-SALVAMENTO ===
-            # Aguarda 2 segundos para garantir que o SharePoint processou o arquivo
-            time.sleep(2)
 
-            try:
-                # Tenta ler o arquivo novamente para confirmar que foi salvo
-                verification_data = _sp().download(APONTAMENTOS)
-                verification_df = pd.read_excel(io.BytesIO(verification_data))
+def append_apontamento(novo_df: pd.DataFrame) -> pd.DataFrame | Future | None:
+    """
+    Adiciona apontamentos novos direto na tabela do Excel (API de workbook):
+    só as linhas novas trafegam, independente do tamanho do histórico, e o
+    SharePoint serializa as inclusões concorrentes (sem eTag nem remescla).
+
+    Se o arquivo ainda não tem a tabela, ou a API falhar, cai na gravação
+    completa de update_sharepoint_file, que grava o arquivo já com a tabela.
+    Como ela mescla por ID, uma linha que tenha chegado a entrar não duplica.
+    No modo "lista", cada apontamento vira um item da lista; no modo
+    "sqlite", entra no banco local.
+    """
+    if USAR_LISTA:
+        return _gravar_na_lista(novo_df, incluir=True)
+    if USAR_SQLITE:
+        return _gravar_local(novo_df, incluir=True)
+    try:
+        with _sp().workbook(APONTAMENTOS) as wb:
+            wb.add_rows(APONTAMENTOS_TABELA, novo_df)
+    except Exception as e:
+        logger.warning("Inclusão pela API de workbook falhou (%s); gravando o arquivo completo.", e)
+        return update_sharepoint_file(novo_df)
 
-                # Verifica se os IDs que tentamos salvar existem no arquivo
-                verification_df["ID"] = verification_df["ID"].astype(str).str.strip()
-                saved_ids = set(verification_df["ID"].tolist())
-                expected_ids = set(df_to_save["ID"].tolist())
+    st.success("✅ Apontamento salvo com sucesso no SharePoint!")
+    return _publicar(novo_df)
 
-                missing_ids = expected_ids - saved_ids
-                if missing_ids:
-                    st.warning(f"⚠️ ATENÇÃO: Alguns IDs podem não ter sido salvos corretamente: {', '.join(missing_ids)}")
-                    st.info("Os dados foram enviados ao SharePoint, mas a verificação encontrou inconsistências. Por favor, recarregue a página e verifique.")
 
-            except Exception as verify_error:
-                # Se a verificação falhar, não bloqueia o sucesso (o upload já foi feito)
-                st.warning(f"⚠️ Dados enviados ao SharePoint, mas não foi possível verificar. Por favor, recarregue a página para confirmar.")
+# Colunas que a Lista de Apontamentos altera ao mudar um status
+CAMPOS_STATUS = ["Status", "Verificador", "Data Resolução", "Justificativa"]
 
-            # Limpa o cache SOMENTE após upload bem-sucedido
-            st.cache_data.clear()
 
-            st.success("✅ Mudanças salvas com sucesso no SharePoint!")
-            return base_df
+@st.cache_resource
+def _indices_planilha() -> RowIndexCache:
+    """Índices ID -> linha das tabelas (sp_workbook.RowIndex), compartilhados entre sessões."""
+    return RowIndexCache()
 
-        except Exception as e:
-            attempts += 1
-            msg = str(e)
-
-            # 409/412 = conflito de versão | 429 = throttling
-            if any(x in msg for x in ["409", "412", "429"]) and attempts < max_attempts:
-                tentativas_restantes = max_attempts - attempts
-                st.warning(f"⚠️ Conflito detectado (outra pessoa salvando ou limite de API). Tentativa {attempts}/{max_attempts}... Aguardando 5 segundos.")
-                time.sleep(5)
-                continue
-
-            # Se esgotou as tentativas ou é outro tipo de erro
-            if attempts >= max_attempts:
-                st.error(f"❌ FALHA AO SALVAR: Máximo de tentativas atingido ({max_attempts}). Os dados NÃO foram salvos no SharePoint!")
-                with st.expander("📋 Informações para o suporte técnico"):
-                    st.text(f"Erro: {msg}")
-                    st.text(f"IDs tentados: {', '.join(ids_being_saved) if ids_being_saved else 'N/A'}")
-                    st.text(f"Tentativas: {attempts}")
-                    st.text(f"Horário: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            else:
-                st.error(f"❌ ERRO AO SALVAR NO SHAREPOINT: {msg}\n\nOs dados NÃO foram salvos. Por favor, tente novamente ou contate o suporte.")
-                with st.expander("📋 Detalhes do erro"):
-                    st.text(f"Tipo de erro: {type(e).__name__}")
-                    st.text(f"Mensagem: {msg}")
-                    st.text(f"IDs tentados: {', '.join(ids_being_saved) if ids_being_saved else 'N/A'}")
 
-            return None
+def patch_apontamentos(alteracoes: dict, campos: list[str]) -> pd.DataFrame | Future | None:
+    """
+    Grava {ID: {coluna: valor}} (só as células editadas, com os valores
+    digitados; colunas fora de `campos` são ignoradas) com PATCH de
+    intervalo na tabela do Excel, todos os IDs num único /$batch. O índice
+    ID -> linha é conferido antes de gravar; se estiver velho (linhas
+    removidas ou reordenadas) ou a API falhar, cai na regravação completa de
+    update_sharepoint_file. No modo "lista", é um PATCH por item da lista;
+    no modo "sqlite", grava no banco local.
+
+    Nenhum caminho envia células não editadas: os valores da cópia
+    compartilhada já passaram pelo esquema (ex: texto numa coluna de data
+    vira NaT) e apagariam o que está no arquivo.
+    """
+    alteracoes = {str(i).strip(): {c: v for c, v in vals.items() if c in campos}
+                  for i, vals in alteracoes.items()}
+    alteracoes = {i: vals for i, vals in alteracoes.items() if vals}
+    partes = _partes(alteracoes)
+    if USAR_LISTA:
+        return _gravar_na_lista(*partes, incluir=False)
+    if USAR_SQLITE:
+        return _gravar_local(*partes, incluir=False)
+    indices, indice = _indices_planilha(), None
+    try:
+        with _sp().workbook(APONTAMENTOS) as wb:
+            indice = indices.get(wb, APONTAMENTOS_TABELA, "ID", alteracoes)
+            wb.patch_rows(indice, alteracoes)
+    except Exception as e:
+        if indice is not None:
+            indices.discard(APONTAMENTOS, APONTAMENTOS_TABELA, indice)
+        logger.warning("PATCH das células falhou (%s); gravando o arquivo completo.", e)
+        return update_sharepoint_file(*partes)
+
+    st.success("✅ Mudanças salvas com sucesso no SharePoint!")
+    return _publicar(*partes)
+
+
+def _partes(alteracoes: dict) -> list[pd.DataFrame]:
+    """{ID: {coluna: valor}} -> um DataFrame por conjunto de colunas alteradas (sem células vazias de enchimento)."""
+    grupos: dict = {}
+    for id_, vals in alteracoes.items():
+        grupos.setdefault(frozenset(vals), []).append({"ID": id_, **vals})
+    return [pd.DataFrame(linhas) for linhas in grupos.values()]
+
+
+def _gravar_na_lista(*partes: pd.DataFrame, incluir: bool) -> pd.DataFrame | None:
+    """Inclui (incluir=True) ou atualiza por ID os itens da lista de apontamentos."""
+    lista = _lista_apontamentos()
+    try:
+        if incluir:
+            for rows in partes:
+                lista.create_many(rows)
+        else:
+            ids = [str(i).strip() for rows in partes for i in rows["ID"]]
+            itens = lista.find_ids("ID", ids)
+            faltando = [i for i in ids if i not in itens]
+            if faltando:
+                raise LookupError(f"IDs não encontrados na lista: {', '.join(faltando)}")
+            lista.update_many({itens[str(r["ID"]).strip()]: r.drop(labels="ID").to_dict()
+                               for rows in partes for _, r in rows.iterrows()})
+    except Exception as e:
+        if isinstance(e, CircuitOpenError):
+            st.error(f"❌ O SharePoint está limitando as requisições no momento. Tente novamente em {e.retry_in:.0f} segundos.")
+        else:
+            st.error(f"❌ ERRO AO SALVAR NO SHAREPOINT: {e}\n\nOs dados NÃO foram salvos. Por favor, tente novamente ou contate o suporte.")
+        return None
+
+    consultar_apontamentos.clear()
+    st.success("✅ Mudanças salvas com sucesso no SharePoint!")
+    return _publicar(*partes)
+
+
+def _gravar_local(*partes: pd.DataFrame, incluir: bool) -> pd.DataFrame | None:
+    """
+    Grava no banco local (modo "sqlite") sem esperar o SharePoint: o thread
+    de sincronização leva a alteração para o arquivo logo em seguida. A cópia
+    compartilhada recebe só as linhas gravadas (sem reler o banco inteiro).
+    """
+    sync = _sincronizacao()
+    partes = [rows.assign(ID=rows["ID"].astype(str).str.strip()) for rows in partes]
+    try:
+        if incluir:
+            for rows in partes:
+                sync.store.add(rows)
+        else:
+            sync.store.update({r["ID"]: r.drop(labels="ID").to_dict() for rows in partes for _, r in rows.iterrows()})
+    except Exception as e:
+        st.error(f"❌ ERRO AO SALVAR: {e}\n\nOs dados NÃO foram salvos. Por favor, tente novamente ou contate o suporte.")
+        return None
+
+    sync.poke()
+    st.success("✅ Mudanças salvas! A sincronização com o SharePoint acontece em segundo plano.")
+    return _publicar(*partes)
 
 
 # -------------------------------------------------
@@ -387,35 +729,39 @@ st.session_state["user_email"] = user_email
 
 
 # Carregar dados iniciais
+try:
+    _observador_sharepoint()
+except Exception as e:
+    # sem o observador os caches só expiram pelo TTL/botão; o app segue funcionando
+    logger.warning("Observador de mudanças do SharePoint não iniciou: %s", e)
+if USAR_LISTA:
+    _exportacao_lista()
+if USAR_SQLITE:
+    _sincronizacao()
+else:
+    _fila_gravacao()    # regrava o que ficou no diário se o processo caiu no meio de um envio
+primeira_carga = "tempo_carga_inicial" not in st.session_state
+inicio_carga = time.perf_counter()
 with st.spinner("Carregando dados do SharePoint..."):
-    df_study = get_sharepoint_file_estudos_csv()
-    colaboradores_df = colaboradores_excel()
+    if primeira_carga:
+        aquecer_cache_sharepoint()
+    ref = _referencia()
 
 
-# Inicializar o DataFrame de apontamentos no session_state
-if "df_apontamentos" not in st.session_state:
-    with st.spinner("Carregando apontamentos..."):
-        df_loaded = get_sharepoint_file()
-    
-    # Fill missing or invalid IDs to prevent NaN issues
-    if not df_loaded.empty:
-        if "ID" not in df_loaded.columns:
-            dexisting = set()
-            df_loaded["ID"] = [generate_custom_id(existing) for _ in range(len(df_loaded))]
-        else:
-            df_loaded["ID"] = df_loaded["ID"].astype(str)
-            existing = set(df_loaded["ID"])
-            mask = df_loaded["ID"].str.lower().isin(["nan", "none", "", "nat"])
-            for idx in df_loaded.index[mask]:
-                new_id = generate_custom_id(existing)
-                df_loaded.at[idx, "ID"] = new_id
-                existing.add(new_id)
-    
-    st.session_state["df_apontamentos"] = df_loaded
+# Apontamentos: a cópia é do processo (compartilhada); a sessão guarda só as edições pendentes
+with st.spinner("Carregando apontamentos..."):
+    df_apontamentos = get_sharepoint_file()
+edicoes: Overlay = st.session_state.setdefault("edicoes", Overlay())
+_registrar_sessao(edicoes)
 
-    # Gerando o ID do apontamento atual
-    existing_ids = set(df_loaded["ID"].astype(str)) if not df_loaded.empty else set()
-    st.session_state["generated_id"] = generate_custom_id(existing_ids)
+if primeira_carga:
+    # Reserva o ID do apontamento atual
+    st.session_state["generated_id"] = _alocador_ids().lease(_sessao())
+
+    # Tempo até os dados estarem prontos para a primeira renderização
+    st.session_state["tempo_carga_inicial"] = time.perf_counter() - inicio_carga
+    logger.info("Carga inicial (estudos + colaboradores + apontamentos): %.2fs",
+                st.session_state["tempo_carga_inicial"])
 
 # Configurar session_state para campos condicionais
 if "status" not in st.session_state:
@@ -445,31 +791,15 @@ def update_status_fields():
         st.session_state["enable_data_resolucao"] = False
         st.session_state["enable_nao_aplicavel"] = False
 
-def pegar_dados_colab(nome_colab: str, df: pd.DataFrame, campos: list[str]):
-    """
-    Retorna os dados solicitados de um colaborador, baseado nos nomes dos campos.
-
-    Parâmetros:
-        nome_colab (str): Nome do colaborador.
-        df (pd.DataFrame): DataFrame contendo os dados.
-        campos (list[str]): Lista de nomes de colunas a serem retornadas.
-
-    Retorna:
-        tuple: Valores dos campos solicitados, na ordem da lista `campos`.
-    """
-    linha = df.loc[df["Nome Completo do Profissional"] == nome_colab]
-    if linha.empty:
-        return tuple("" for _ in campos)
-    
-    lin = linha.iloc[0]
-    return tuple(lin[campo] if campo in lin else "" for campo in campos)
-
-
 # Início da tela principal
 tab_names = ["Formulário", "Lista de Apontamentos"]
+if user_email in ADMINS:
+    tab_names.append("Administração")
 if "active_tab" not in st.session_state:
     st.session_state.active_tab = tab_names[0]
 
+_avisar_gravacoes_pendentes()
+
 tab_option = st.radio(
     label="",  
     options=tab_names,
@@ -480,23 +810,16 @@ tab_option = st.radio(
 if tab_option == "Formulário":
     st.title("Criar Apontamento")
     
-    if df_study.empty:
+    if ref.estudos.empty:
         st.error("Arquivo CSV de estudos não carregado. Verifique o caminho do arquivo.")
     else:
 
         if "generated_id" not in st.session_state:
-            df_ids = st.session_state.get("df_apontamentos", pd.DataFrame())
-            existing = set(df_ids["ID"].astype(str)) if not df_ids.empty else set()
-            st.session_state["generated_id"] = generate_custom_id(existing)
+            st.session_state["generated_id"] = _alocador_ids().lease(_sessao())
 
         st.text_input("ID do Apontamento", value=st.session_state["generated_id"], disabled=True)
-        protocol_options = ["Digite o codigo do estudo"] + df_study["NUMERO_DO_PROTOCOLO"].tolist()
-        selected_protocol = st.selectbox("Código do Estudo", options=protocol_options, key="selected_protocol")
-        
-        if selected_protocol != "Digite o codigo do estudo":
-            research_name = df_study.loc[df_study["NUMERO_DO_PROTOCOLO"] == selected_protocol, "NOME_DA_PESQUISA"].iloc[0]
-        else:
-            research_name = ""
+        selected_protocol = st.selectbox("Código do Estudo", options=ref.opcoes_protocolo, key="selected_protocol")
+        research_name = ref.nome_pesquisa(selected_protocol)
         st.text_input("Nome da Pesquisa", value=research_name, disabled=True)
         
         
@@ -508,19 +831,7 @@ if tab_option == "Formulário":
         )
         
         # Selectbox para documentos com opção "Outros"
-        doc = st.selectbox("Documentos", [
-            "Acompanhamento da Administração da Medicação", "Ajuste dos Relógios", "Anotação de enfermagem",
-            "Aplicação do TCLE", "Ausência de Período", "Avaliação Clínica Pré Internação", "Avaliação de Alta Clínica",
-            "Controle de Eliminações fisiológicas", "Controle de Glicemia", "Controle de Ausente de Período",
-            "Controle de DropOut", "Critérios de Inclusão e Exclusão", "Desvio de ambulação", "Dieta",
-            "Diretrizes do Protocolo", "Tabela de Controle de Preparo de Heparina", "TIME", "TCLE", "ECG",
-            "Escala de Enfermagem", "Evento Adverso", "Ficha de internação", "Formulário de conferência das amostras",
-            "Teste de HCG", "Teste de Drogas", "Teste de Álcool", "Término Prematuro",
-            "Medicação para tratamento dos Eventos Adversos", "Orientação por escrito", "Prescrição Médica",
-            "Registro de Temperatura da Enfermaria", "Relação dos Profissionais", "Sinais Vitais Pós Estudo",
-            "SAE", "SINEB", "FOR 104", "FOR 123", "FOR 166", "FOR 217", "FOR 233", "FOR 234", "FOR 235",
-            "FOR 236", "FOR 240", "FOR 241", "FOR 367", "Outros"
-        ], key="documento")
+        doc = st.selectbox("Documentos", DOCUMENTOS, key="documento")
 
         
         
@@ -542,9 +853,7 @@ if tab_option == "Formulário":
         # Obtém o valor final do documento usando a função
         documento_final = get_final_documento()
 
-        pp_options = ["N/A", "Outros"] + [f"PP{i:02d}" for i in range(1, 100)] + [f"PP{i}" for i in range(100, 1000)]
-
-        participante = st.selectbox("Participante", pp_options, key="participante")
+        participante = st.selectbox("Participante", PARTICIPANTES, key="participante")
         
 
 
@@ -571,10 +880,9 @@ if tab_option == "Formulário":
         apontamento = st.text_area("Apontamento", key="apontamento")
 
         
-        responsavel_options = ["Selecione um colaborador"] + colaboradores_df["Nome Completo do Profissional"].tolist()
-        correcao = st.selectbox("Responsável pela Correção", options=responsavel_options, key="responsavel")
+        correcao = st.selectbox("Responsável pela Correção", options=ref.opcoes_responsavel, key="responsavel")
 
-        plantao, status_prof, departamento = pegar_dados_colab(correcao, colaboradores_df, ["Plantão", "Tempo De Casa","Departamento"])
+        plantao, status_prof, departamento = ref.dados_colab(correcao, ["Plantão", "Tempo De Casa", "Departamento"])
 
 
 
@@ -625,7 +933,7 @@ if tab_option == "Formulário":
 
         if submit:
             # Validação dos campos obrigatórios
-            if selected_protocol == "Digite o codigo do estudo" or participante.strip() == "" or apontamento.strip() == "":
+            if selected_protocol == SEM_PROTOCOLO or participante.strip() == "" or apontamento.strip() == "":
                 st.error("Por favor, preencha os campos obrigatórios: Código do Estudo, Participante, Responsável e Apontamento.")
             elif status == "VERIFICANDO" and verificador_nome.strip() == "":
                 st.error("Somente o Guilherme Gonçalves pode usar esse status!.")
@@ -634,7 +942,7 @@ if tab_option == "Formulário":
             elif status == "NÃO APLICÁVEL" and justificativa.strip() == "":
                 st.error("Por favor, preencha o campo 'Justificativa'!")
                 st.stop()
-            elif correcao == "Selecione um colaborador":
+            elif correcao == SEM_COLABORADOR:
                 st.warning("Por favor, selecione o colaborador responsável pela correção antes de salvar.")
                 st.stop()
             else:
@@ -644,10 +952,15 @@ if tab_option == "Formulário":
                     if st.session_state["status"] == "REALIZADO DURANTE A CONDUÇÃO":
                         resolucao = data_atual
                     
-                    df = st.session_state["df_apontamentos"]
-    
-                    # Usa o ID gerado previamente para este apontamento
+                    # Usa o ID reservado para este apontamento; se a reserva não vale
+                    # mais (o ID apareceu no arquivo ou venceu e foi para outra sessão), troca
+                    alocador = _alocador_ids()
                     next_id = st.session_state.get("generated_id")
+                    if not next_id or not alocador.commit(next_id, _sessao()):
+                        antigo, next_id = next_id, alocador.lease(_sessao())
+                        alocador.commit(next_id, _sessao())
+                        st.session_state["generated_id"] = next_id
+                        st.info(f"ℹ️ O ID {antigo} já estava em uso; este apontamento será salvo como {next_id}.")
     
                     responsavel_nome = st.session_state.get("display_name")
                     
@@ -685,18 +998,21 @@ if tab_option == "Formulário":
     
     
                     novo_df = pd.DataFrame([novo_apontamento])
-                    df_atualizado = update_sharepoint_file(novo_df)
+                    df_atualizado = append_apontamento(novo_df)
 
-                    if df_atualizado is not None:
+                    if isinstance(df_atualizado, Future):
+                        # Ainda na fila: o ID já pertence a esse envio (não libera) e o
+                        # formulário passa para o próximo, para não ser enviado de novo
+                        st.session_state["generated_id"] = alocador.lease(_sessao())
+                        st.rerun()
+                    elif df_atualizado is not None:
                         # Salvamento bem-sucedido
-                        st.session_state["df_apontamentos"] = df_atualizado
-                        st.session_state["generated_id"] = generate_custom_id(
-                            set(df_atualizado["ID"].astype(str))
-                        )
+                        st.session_state["generated_id"] = alocador.lease(_sessao())
                         # Força recarregamento para exibir os dados atualizados
                         st.rerun()
                     else:
-                        # Salvamento falhou
+                        # Salvamento falhou: o ID volta a ficar livre para o próximo envio
+                        alocador.release(next_id)
                         st.error("⚠️ O apontamento NÃO foi salvo no SharePoint. Por favor, tente novamente.")
                         st.info("💡 Seus dados ainda estão preenchidos no formulário. Você pode clicar em 'Enviar' novamente.")
                 
@@ -705,19 +1021,9 @@ if tab_option == "Formulário":
 
 if tab_option == "Lista de Apontamentos":
     # ─────────────────────────────────────────────────────────────
-    # 1️⃣  Garante índice interno e coluna visível de ID
+    # 1️⃣  Cópia compartilhada (só leitura; IDs já garantidos na carga)
     # ─────────────────────────────────────────────────────────────
-    df = st.session_state["df_apontamentos"]
-
-    # Cria coluna/índice inicial na primeira execução
-    if "orig_idx" not in df.columns:
-        df.insert(0, "orig_idx", range(len(df)))  # índice técnico permanente
-        df.set_index("orig_idx", inplace=True)
-
-    # Cria a coluna ID visível caso não exista
-    if "ID" not in df.columns:
-        existing = set()
-        df["ID"] = [generate_custom_id(existing) for _ in range(len(df))]
+    df = df_apontamentos
 
     # ─────────────────────────────────────────────────────────────
     # 2️⃣  Estado da interface
@@ -731,9 +1037,13 @@ if tab_option == "Lista de Apontamentos":
     col_btn1, *_ = st.columns(6)
     with col_btn1:
         if st.button("🔄 Atualizar"):
-            st.cache_data.clear()      
-            st.cache_resource.clear()
-            st.rerun()  
+            # Consulta o delta agora: só os arquivos alterados são recarregados
+            try:
+                _observador_sharepoint().poll()
+            except Exception as e:
+                st.error(f"Não foi possível consultar as mudanças no SharePoint (Graph): {e}")
+            else:
+                st.rerun()
 
     # ─────────────────────────────────────────────────────────────
     # 3️⃣  Filtros rápidos / seletor de estudo
@@ -742,7 +1052,12 @@ if tab_option == "Lista de Apontamentos":
         st.info("Nenhum apontamento encontrado!")
         st.stop()
 
-    df_filtrado = df.copy()
+    df_filtrado = df        # os filtros abaixo viram posições; a paginação copia só a página
+    posicoes = None         # None = todas as linhas de df_filtrado
+    # índices da cópia compartilhada (montados uma vez por versão, atualizados a cada gravação)
+    indice = _apontamentos().index_for(df)
+    if indice is None:
+        indice = SnapshotIndex(df)
 
     st.markdown("")
 
@@ -753,11 +1068,6 @@ if tab_option == "Lista de Apontamentos":
         placeholder="Digite o ID",
     )
 
-    if id_busca:
-        df_filtrado = df_filtrado[
-            df_filtrado["ID"].astype(str).str.contains(id_busca, case=False, na=False)
-        ]
-
     # Linha com 2 colunas: Estudo (esquerda) e Status (direita)
     col_filtro_estudo, col_filtro_status = st.columns(2)
 
@@ -765,23 +1075,34 @@ if tab_option == "Lista de Apontamentos":
     col_filtro_estudo, col_filtro_status = st.columns(2)
 
     with col_filtro_estudo:
-        opcoes_estudos = ["Todos"] + sorted(
-            df["Código do Estudo"].dropna().unique().tolist()
-        )
+        opcoes_estudos = ["Todos"] + indice.values("Código do Estudo")
         estudo_sel = st.selectbox("Selecione o Estudo", options=opcoes_estudos)
 
     with col_filtro_status:
-        opcoes_status = ["Todos"] + sorted(
-            df["Status"].dropna().unique().tolist()
-        )
+        opcoes_status = ["Todos"] + indice.values("Status")
         status_sel = st.selectbox("Filtrar por Status", options=opcoes_status)
 
     # Aplica filtros
+    filtro = {}
     if estudo_sel != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Código do Estudo"] == estudo_sel]
-
+        filtro["Código do Estudo"] = estudo_sel
     if status_sel != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Status"] == status_sel]
+        filtro["Status"] = status_sel
+
+    if (USAR_LISTA or USAR_SQLITE) and filtro:
+        # Modo lista: o filtro roda no servidor ($filter) e traz a versão atual dos itens;
+        # modo sqlite: consulta indexada no banco local
+        if USAR_SQLITE:
+            df_filtrado = apply_schema(_sincronizacao().store.query(filtro))
+        else:
+            df_filtrado = consultar_apontamentos(tuple(filtro.items()))
+        if id_busca:
+            df_filtrado = df_filtrado[
+                df_filtrado["ID"].astype(str).str.contains(id_busca.strip(), case=False, na=False, regex=False)
+            ]
+    else:
+        # interseção das posições de cada critério nos índices (sem varrer a tabela)
+        posicoes = indice.select(filtro, id_busca)
 
 
     # Colunas visíveis (ID primeiro)
@@ -791,13 +1112,33 @@ if tab_option == "Lista de Apontamentos":
         "Prazo Para Resolução", "Data Resolução", "Justificativa",
         "Responsável Pelo Apontamento", "Origem Do Apontamento",
     ]
-    df_filtrado = df_filtrado[cols_display]
-
-    # Converte colunas de data
+    # Colunas de data (já em datetime64 desde a carga)
     colunas_data = ["Data do Apontamento", "Prazo Para Resolução", "Data Resolução"]
-    for col in colunas_data:
-        if col in df_filtrado.columns:
-            df_filtrado[col] = pd.to_datetime(df_filtrado[col], errors="coerce")
+
+    # Paginação: só a página vai para o editor; o cursor é o ID da primeira linha
+    col_ordem, col_sentido, col_tamanho = st.columns([2, 1, 1])
+    with col_ordem:
+        ordenar_por = st.selectbox("Ordenar por", ["Ordem do arquivo"] + cols_display, key="lista_ordem")
+    with col_sentido:
+        decrescente = st.toggle("Decrescente", key="lista_decrescente")
+    with col_tamanho:
+        opcoes_tamanho = sorted({25, 50, 100, 200, TAMANHO_PAGINA})
+        tamanho = st.selectbox("Linhas por página", opcoes_tamanho,
+                               index=opcoes_tamanho.index(TAMANHO_PAGINA), key="lista_tamanho")
+
+    # filtro ou ordenação nova: volta à primeira página
+    consulta = (id_busca, estudo_sel, status_sel, ordenar_por, decrescente, tamanho)
+    if st.session_state.get("lista_consulta") != consulta:
+        st.session_state["lista_consulta"] = consulta
+        st.session_state["lista_cursor"] = None
+
+    pagina = paginate(
+        df_filtrado, tamanho, cursor=st.session_state["lista_cursor"],
+        sort_by=[] if ordenar_por == "Ordem do arquivo" else [ordenar_por],
+        ascending=not decrescente, positions=posicoes, columns=cols_display,
+    )
+    # edições desta sessão ainda não salvas por cima da cópia compartilhada
+    df_pagina = edicoes.apply(pagina.rows)
 
     # ─────────────────────────────────────────────────────────────
     # 4️⃣  Config do editor (ID bloqueado, Status editável)
@@ -806,7 +1147,7 @@ if tab_option == "Lista de Apontamentos":
         "ID": st.column_config.TextColumn("ID", disabled=True)
     }
 
-    for col in df_filtrado.columns:
+    for col in df_pagina.columns:
         if col == "Status":
             columns_config[col] = st.column_config.SelectboxColumn(
                 "Status",
@@ -822,33 +1163,42 @@ if tab_option == "Lista de Apontamentos":
             columns_config[col] = st.column_config.TextColumn(col, disabled=True)
 
     df_editado = st.data_editor(
-        df_filtrado,
+        df_pagina,
         column_config=columns_config,
         num_rows="fixed",
-        key="data_editor",
+        key=f"data_editor_{pagina.cursor}",     # um estado de editor por página
         hide_index=True,  # esconde orig_idx e numeração lateral
     )
 
+    # Status alterados nesta página vão já para as edições da sessão (por ID):
+    # continuam valendo ao trocar de página e voltar
+    for id_val, status_original, status_novo in zip(df_pagina["ID"], df_pagina["Status"], df_editado["Status"]):
+        if status_novo != status_original and not (pd.isna(status_novo) and pd.isna(status_original)):
+            edicoes.set(id_val, "Status", status_novo)
+
+    col_ant, col_info, col_prox = st.columns([1, 2, 1])
+    with col_ant:
+        if st.button("◀ Anterior", disabled=pagina.prev_cursor is None):
+            st.session_state["lista_cursor"] = pagina.prev_cursor
+            st.rerun()
+    with col_info:
+        if pagina.total:
+            st.caption(f"Linhas {pagina.start + 1}–{pagina.start + len(pagina.rows)} de {pagina.total}")
+    with col_prox:
+        if st.button("Próxima ▶", disabled=pagina.next_cursor is None):
+            st.session_state["lista_cursor"] = pagina.next_cursor
+            st.rerun()
+
     # ─────────────────────────────────────────────────────────────
     # 5️⃣  Detecta alterações de Status usando a coluna ID
     # ─────────────────────────────────────────────────────────────
     if not st.session_state.mostrar_campos_finais:
         if st.button("Status modificados"):
-            alterado = False
-            indices_alterados = []
-            df_atualizado = df.copy()
-
-            for i in range(len(df_filtrado)):
-                status_original = df_filtrado.iloc[i]["Status"]
-                status_novo = df_editado.iloc[i]["Status"]
-
-                if status_novo != status_original:
-                    alterado = True
-                    id_val = df_filtrado.iloc[i]["ID"]    # pega o ID visível
-
-                    # Atualiza no DataFrame base usando a coluna ID
-                    df.loc[df["ID"] == id_val, "Status"] = status_novo
-                    indices_alterados.append(id_val)
+            # Todas as páginas: Status nas edições da sessão diferente da cópia compartilhada
+            editados = [i for i, v in edicoes.cells.items() if "Status" in v]
+            atuais = df.loc[df["ID"].isin(editados)].drop_duplicates("ID").set_index("ID")["Status"]
+            indices_alterados = [i for i in editados if edicoes.get(i, "Status") != atuais.get(i)]
+            alterado = bool(indices_alterados)
 
             if not alterado:
                 st.warning("Nenhuma alteração de status detectada.")
@@ -861,14 +1211,13 @@ if tab_option == "Lista de Apontamentos":
     # 6️⃣  Campos finais obrigatórios + submissão
     # ─────────────────────────────────────────────────────────────
     if st.session_state.mostrar_campos_finais:
-        df = st.session_state["df_apontamentos"]
         indices_alterados = st.session_state.indices_alterados
         linhas_faltando = []
 
         st.markdown("### Preencha os campos obrigatórios")
 
         for id_val in indices_alterados:
-            status_novo = df.loc[df["ID"] == id_val, "Status"].iloc[0]
+            status_novo = edicoes.get(id_val, "Status")
             st.markdown(f"#### Apontamento ID {id_val}")
 
             if status_novo in ["REALIZADO", "NÃO APLICÁVEL"]:
@@ -877,7 +1226,7 @@ if tab_option == "Lista de Apontamentos":
                 if not data_concl:
                     linhas_faltando.append(f"[ID {id_val}] Data de Resolução")
                 else:
-                    df.loc[df["ID"] == id_val, "Data Resolução"] = data_concl
+                    edicoes.set(id_val, "Data Resolução", data_concl)
 
             if status_novo == "NÃO APLICÁVEL":
                 key_just = f"justificativa_{id_val}"
@@ -885,13 +1234,12 @@ if tab_option == "Lista de Apontamentos":
                 if not justificativa.strip():
                     linhas_faltando.append(f"[ID {id_val}] Justificativa")
                 else:
-                    df.loc[df["ID"] == id_val, "Justificativa"] = justificativa
+                    edicoes.set(id_val, "Justificativa", justificativa)
 
             st.markdown("---")
 
         # Responsável pela atualização
-        colaboradores_eo = colaboradores_df[colaboradores_df["Departamento"] == "Excelência Operacional"]
-        resp_opts = ["Selecione um Colaborador"] + colaboradores_eo["Nome Completo do Profissional"].tolist()
+        resp_opts = ["Selecione um Colaborador"] + ref.nomes_departamento("Excelência Operacional")
         responsavel = st.selectbox("Responsável pela Atualização", options=resp_opts, key="responsavel_final")
 
         if st.button("Submeter mudanças"):
@@ -901,46 +1249,17 @@ if tab_option == "Lista de Apontamentos":
                 st.warning("Por favor, selecione um responsável!")
             else:
                 with st.spinner("Salvando mudanças..."):
-                    df.loc[df["ID"].isin(indices_alterados), "Verificador"] = responsavel
-
-                    # Salva apenas as linhas alteradas (a função faz merge com o arquivo existente)
-                    rows_to_save = df[df["ID"].isin(indices_alterados)].copy()
-
-                    # Garante que todas as colunas necessárias existam
-                    colunas_necessarias = [
-                        "ID", "Código do Estudo", "Nome da Pesquisa", "Data do Apontamento",
-                        "Responsável Pelo Apontamento", "Origem Do Apontamento", "Documentos",
-                        "Participante", "Período", "Prazo Para Resolução", "Apontamento",
-                        "Status", "Verificador", "Disponibilizado para Verificação",
-                        "Justificativa", "Responsável Pela Correção", "Data Resolução",
-                        "Plantão", "Departamento", "Tempo de casa", "Responsável Indicado",
-                        "Grau De Criticidade Do Apontamento", "Responsável Atualização",
-                        "Data Atualização", "Data Início Verificação"
-                    ]
-
-                    # Busca dados completos do DataFrame base para as linhas alteradas
-                    df_base = st.session_state["df_apontamentos"]
-                    rows_completas = df_base[df_base["ID"].isin(indices_alterados)].copy()
-
-                    # Atualiza apenas os campos modificados
                     for id_val in indices_alterados:
-                        mask = rows_completas["ID"] == id_val
-                        rows_completas.loc[mask, "Status"] = df.loc[df["ID"] == id_val, "Status"].iloc[0]
-                        rows_completas.loc[mask, "Verificador"] = responsavel
-                        if "Data Resolução" in df.columns:
-                            val = df.loc[df["ID"] == id_val, "Data Resolução"].iloc[0]
-                            if pd.notna(val):
-                                rows_completas.loc[mask, "Data Resolução"] = val
-                        if "Justificativa" in df.columns:
-                            val = df.loc[df["ID"] == id_val, "Justificativa"].iloc[0]
-                            if pd.notna(val) and str(val).strip():
-                                rows_completas.loc[mask, "Justificativa"] = val
-
-                    df_atualizado = update_sharepoint_file(rows_completas)
+                        edicoes.set(id_val, "Verificador", responsavel)
+
+                    # Só as células editadas nesta sessão, com os valores digitados
+                    alteracoes = {i: edicoes.cells.get(str(i), {}) for i in indices_alterados}
+                    df_atualizado = patch_apontamentos(alteracoes, CAMPOS_STATUS)
 
                     if df_atualizado is not None:
-                        # Salvamento bem-sucedido
-                        st.session_state["df_apontamentos"] = df_atualizado
+                        # Salvamento bem-sucedido (ou na fila, publicado ao gravar; ver
+                        # _avisar_gravacoes_pendentes): as edições saem desta sessão
+                        edicoes.clear(indices_alterados)
 
                         # Limpa estados
                         st.session_state.mostrar_campos_finais = False
@@ -953,3 +1272,21 @@ if tab_option == "Lista de Apontamentos":
                         # Salvamento falhou - mantém os estados para o usuário tentar novamente
                         st.error("⚠️ As alterações NÃO foram salvas. Por favor, revise os dados e tente novamente.")
                         st.info("💡 Dica: Clique no botão '🔄 Atualizar' no topo da página para recarregar os dados originais.")
+
+
+if tab_option == "Administração":
+    st.title("Administração")
+
+    snap = _apontamentos().current()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Apontamentos (cópia compartilhada)", f"{len(snap.df):,}".replace(",", "."))
+    col2.metric("Memória da cópia", f"{_apontamentos().memory() / 1024 / 1024:.1f} MB")
+    col3.metric("Sessões ativas", len(_sessoes()))
+    st.caption(f"Versão: {snap.version or 'gravação local (aguardando o eTag)'} · "
+               f"carregada em {datetime.fromtimestamp(snap.loaded_at).strftime('%d/%m/%Y %H:%M:%S')}")
+
+    sessoes = pd.DataFrame(_sessoes().snapshot())
+    if not sessoes.empty:
+        sessoes["Último acesso"] = sessoes["Último acesso"].map(
+            lambda t: datetime.fromtimestamp(t).strftime("%d/%m/%Y %H:%M:%S"))
+        st.dataframe(sessoes.sort_values("Memória (KB)", ascending=False), hide_index=True)
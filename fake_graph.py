@@ -0,0 +1,680 @@
+# fake_graph.py
+"""
+Servidor local que imita os endpoints do Microsoft Graph usados pelo
+SPConnector, para testar e medir o pipeline de gravação sem rede e sem tocar
+o tenant real.
+
+Implementa:
+  - token client-credentials:  POST /{tenant}/oauth2/v2.0/token
+  - descoberta de site/drive:  GET /v1.0/sites/{host}:/{site}[:/drives]
+  - itens por caminho e por id (metadados, /content GET/PUT), com eTag/cTag
+    e file.hashes.quickXorHash,
+    If-None-Match (304), If-Match (412) e conflictBehavior=fail (409)
+  - upload sessions (createUploadSession + fragmentos em ordem)
+  - /$batch e /root/delta
+  - listas do SharePoint: colunas, itens com $filter (eq/and/or), $top e
+    @odata.nextLink, inclusão e PATCH de campos (create_list() para semear)
+  - API do Excel: createSession/closeSession, tables, tables/{t}/columns,
+    tables/{t}/rows/add, tables/{t}/range, .../columns/{c}/dataBodyRange e
+    worksheets/{p}/range(address=...) GET/PATCH (o .xlsx é alterado com openpyxl)
+  - latência injetada (latency + jitter aleatório por requisição HTTP) e
+    throttling (fração throttle_rate de respostas 429 com Retry-After), além
+    de falhas pontuais via inject()
+
+Uso:
+    python fake_graph.py serve --port 8765 --latency 0.08 --throttle-rate 0.05 \\
+        --file "Apontamentos/apontamentos.xlsx=./apontamentos.xlsx"
+    # e nos secrets:  [graph] base_url = "http://127.0.0.1:8765"
+
+    python fake_graph.py bench --writers 5 --saves 4 --rows 5000
+"""
+import argparse, json, random, re, threading, time, uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+
+SITE_ID = "fake.sharepoint.com,00000000-0000-0000-0000-000000000001,00000000-0000-0000-0000-000000000002"
+DRIVE_ID = "b!fakeDrive0000000000000000000000000000000000000000000000000000"
+
+
+class FakeItem:
+    def __init__(self, path: str, data: bytes):
+        self.id = "01" + uuid.uuid4().hex[:32].upper()
+        self.guid = str(uuid.uuid4()).upper()
+        self.path = path
+        self.data = data
+        self.version = 1
+        self.modified = time.time()
+        self._hash = None                   # (versão, quickXorHash)
+
+    @property
+    def etag(self) -> str:
+        return f'"{{{self.guid}}},{self.version}"'
+
+    @property
+    def ctag(self) -> str:
+        return f'"c:{{{self.guid}}},{self.version}"'
+
+    def meta(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.path.rsplit("/", 1)[-1],
+            "parentReference": {"driveId": DRIVE_ID,
+                                "path": f"/drives/{DRIVE_ID}/root:/{self.path.rpartition('/')[0]}".rstrip("/")},
+            "eTag": self.etag,
+            "cTag": self.ctag,
+            "size": len(self.data),
+            "lastModifiedDateTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.modified)),
+            "file": {"mimeType": "application/octet-stream", "hashes": {"quickXorHash": self.quick_xor_hash()}},
+        }
+
+    def quick_xor_hash(self) -> str:
+        if self._hash is None or self._hash[0] != self.version:
+            from sp_verify import quick_xor_hash
+            self._hash = (self.version, quick_xor_hash(self.data))
+        return self._hash[1]
+
+
+class FakeGraph:
+    """Estado e regras do servidor (sem HTTP): usado pelo handler e pelo $batch."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: float = 1.0, library_name: str = "Documentos", seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.library_name = library_name
+        self.base_url = ""                  # preenchido pelo FakeGraphServer (uploadUrl, deltaLink)
+        self._rand = random.Random(seed)
+        self._lock = threading.RLock()
+        self._files: dict[str, FakeItem] = {}
+        self._sessions: dict[str, dict] = {}
+        self._changes: list[dict] = []      # log para o delta
+        self._lists: dict[str, dict] = {}   # nome (minúsculo) -> {"name", "columns", "items", "modified"}
+        self._faults: list[tuple] = []      # (status, retry_after)
+        self.stats = {"requests": 0, "throttled": 0, "bytes_in": 0, "bytes_out": 0}
+
+    # -------- Arquivos (lado do teste) --------
+    def put_file(self, path: str, data: bytes) -> FakeItem:
+        with self._lock:
+            key = path.strip("/").lower()
+            item = self._files.get(key)
+            if item is None:
+                item = self._files[key] = FakeItem(path.strip("/"), data)
+            else:
+                item.data, item.version, item.modified = data, item.version + 1, time.time()
+            self._changes.append(item.meta())
+            return item
+
+    def get_file(self, path: str) -> bytes | None:
+        item = self._files.get(path.strip("/").lower())
+        return item.data if item else None
+
+    def create_list(self, name: str, columns: dict, items=()):
+        """
+        Lista com colunas {nome de exibição: "text" | "number" | "dateTime" | "boolean"}
+        (o nome interno segue a codificação do SharePoint: espaço -> _x0020_).
+        """
+        with self._lock:
+            cols = [{"name": _sp_internal_name(disp), "displayName": disp, "kind": kind}
+                    for disp, kind in columns.items()]
+            self._lists[name.lower()] = {"id": str(uuid.uuid4()), "name": name, "columns": cols,
+                                         "items": [], "next_id": 1, "modified": time.time()}
+            for it in items:
+                self._list_create(self._lists[name.lower()],
+                                  {_sp_internal_name(k): v for k, v in it.items()})
+
+    def list_items(self, name: str) -> list:
+        """Campos (nomes de exibição) de todos os itens da lista."""
+        lst = self._lists[name.lower()]
+        by_internal = {c["name"]: c["displayName"] for c in lst["columns"]}
+        return [{by_internal[k]: v for k, v in it["fields"].items() if k in by_internal} for it in lst["items"]]
+
+    def inject(self, status: int, count: int = 1, retry_after: float | None = None):
+        """As próximas `count` requisições ao Graph respondem `status`."""
+        with self._lock:
+            self._faults.extend([(status, retry_after)] * count)
+
+    # -------- Despacho --------
+    def handle(self, method: str, raw_path: str, headers: dict, body: bytes):
+        """Devolve (status, headers, corpo: dict | bytes | None)."""
+        parts = urlsplit(raw_path)
+        path = unquote(parts.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        headers = {k.lower(): v for k, v in headers.items()}
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_in"] += len(body or b"")
+
+        m = re.fullmatch(r"/([^/]+)/oauth2/v2\.0/token", path)
+        if m and method == "POST":
+            return 200, {}, {"access_token": f"fake-{uuid.uuid4().hex}", "expires_in": 3600, "token_type": "Bearer"}
+
+        m = re.fullmatch(r"/_upload/([0-9a-f]+)", path)
+        if m:
+            return self._upload_fragment(method, m.group(1), headers, body)
+
+        if not path.startswith("/v1.0/"):
+            return _err(404, "itemNotFound", "rota desconhecida")
+        if not headers.get("authorization", "").startswith("Bearer fake-"):
+            return _err(401, "InvalidAuthenticationToken", "token ausente ou inválido")
+
+        fault = self._next_fault()
+        if fault is not None:
+            return fault
+        return self._route(method, path[len("/v1.0"):], query, headers, body)
+
+    def _next_fault(self):
+        with self._lock:
+            if self._faults:
+                status, ra = self._faults.pop(0)
+            elif self.throttle_rate and self._rand.random() < self.throttle_rate:
+                status, ra = 429, self.retry_after
+            else:
+                return None
+            if status == 429:
+                self.stats["throttled"] += 1
+        hdrs = {"Retry-After": str(ra if ra is not None else self.retry_after)} if status in (429, 503) else {}
+        return status, hdrs, {"error": {"code": "TooManyRequests" if status == 429 else "serviceNotAvailable",
+                                        "message": "falha injetada"}}
+
+    def _route(self, method, path, query, headers, body):
+        if path == "/$batch" and method == "POST":
+            return self._batch(json.loads(body or b"{}"))
+
+        m = re.fullmatch(r"/sites/([^/:]+):/(.+?)(:/drives)?", path)
+        if m and method == "GET":
+            if m.group(3):
+                return 200, {}, {"value": [self._drive()]}
+            return 200, {}, {"id": SITE_ID, "name": m.group(2).rsplit("/", 1)[-1]}
+        if re.fullmatch(r"/sites/[^/]+/drives", path) and method == "GET":
+            return 200, {}, {"value": [self._drive()]}
+        m = re.fullmatch(r"/sites/[^/]+/lists/([^/]+)(/.*)?", path)
+        if m:
+            return self._list_route(method, m.group(1), m.group(2) or "", query, headers, body)
+
+        m = re.fullmatch(r"/(?:drives/([^/]+)|users/[^/]+/drive)(/.*)", path)
+        if not m:
+            return _err(404, "itemNotFound", "rota desconhecida")
+        if m.group(1) and m.group(1) != DRIVE_ID:
+            return _err(404, "itemNotFound", "drive inexistente")
+        return self._drive_route(method, m.group(2), query, headers, body)
+
+    def _drive(self) -> dict:
+        return {"id": DRIVE_ID, "name": self.library_name, "driveType": "documentLibrary"}
+
+    def _drive_route(self, method, rest, query, headers, body):
+        if rest == "/root/delta" and method == "GET":
+            return self._delta(query)
+
+        m = re.fullmatch(r"/root:/(.+?):(/content|/createUploadSession|/workbook/.+)?", rest)
+        if m:
+            path, op = m.group(1), m.group(2) or ""
+            item = self._files.get(path.lower())
+        else:
+            m = re.fullmatch(r"/items/([^/]+)(/content|/workbook/.+)?", rest)
+            if not m:
+                return _err(404, "itemNotFound", "rota desconhecida")
+            op = m.group(2) or ""
+            item = next((i for i in self._files.values() if i.id == m.group(1)), None)
+            path = item.path if item else None
+            if item is None:
+                return _err(404, "itemNotFound", "item inexistente")
+
+        if op.startswith("/workbook/"):
+            if item is None:
+                return _err(404, "itemNotFound", "arquivo inexistente")
+            return self._workbook(method, item, op[len("/workbook/"):], body)
+        if method == "GET" and op == "":
+            if item is None:
+                return _err(404, "itemNotFound", "arquivo inexistente")
+            if headers.get("if-none-match") in (item.etag, item.ctag):
+                return 304, {}, None
+            return 200, {"ETag": item.etag}, item.meta()
+        if method == "GET" and op == "/content":
+            if item is None:
+                return _err(404, "itemNotFound", "arquivo inexistente")
+            return 200, {"ETag": item.etag, "Content-Type": "application/octet-stream"}, item.data
+        if method == "PUT" and op == "/content":
+            pre = self._preconditions(item, headers, query)
+            if pre:
+                return pre
+            with self._lock:
+                created = item is None
+                item = self.put_file(path, body or b"")
+            return (201 if created else 200), {"ETag": item.etag}, item.meta()
+        if method == "POST" and op == "/createUploadSession":
+            spec = (json.loads(body or b"{}").get("item") or {})
+            pre = self._preconditions(item, headers, {"@microsoft.graph.conflictBehavior":
+                                                      spec.get("@microsoft.graph.conflictBehavior", "replace")})
+            if pre:
+                return pre
+            sid = uuid.uuid4().hex
+            with self._lock:
+                self._sessions[sid] = {"path": path, "buf": bytearray(), "if_match": headers.get("if-match"),
+                                       "expires": time.time() + 900}
+            return 200, {}, {"uploadUrl": f"{self.base_url}/_upload/{sid}",
+                             "expirationDateTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 900)),
+                             "nextExpectedRanges": ["0-"]}
+        return _err(405, "invalidRequest", f"{method} não suportado aqui")
+
+    def _workbook(self, method, item, op, body):
+        """Subconjunto da API do Excel: sessões e tabelas (colunas, rows/add)."""
+        if method == "POST" and op == "createSession":
+            return 201, {}, {"id": uuid.uuid4().hex, "persistChanges": True}
+        if method == "POST" and op == "closeSession":
+            return 204, {}, None
+
+        import io, openpyxl
+        from openpyxl.utils import get_column_letter, range_boundaries
+
+        with self._lock:
+            try:
+                wb = openpyxl.load_workbook(io.BytesIO(item.data))
+            except Exception:
+                return _err(400, "invalidRequest", "arquivo não é um .xlsx")
+            tables = {t.displayName.lower(): (ws, t) for ws in wb.worksheets for t in ws.tables.values()}
+            if method == "GET" and op == "tables":
+                return 200, {}, {"value": [{"id": t.id, "name": t.displayName} for _, t in tables.values()]}
+
+            m = re.fullmatch(r"worksheets/([^/]+)/range\(address='([^']+)'\)", op)
+            if m:
+                if m.group(1) not in wb.sheetnames:
+                    return _err(404, "itemNotFound", "planilha inexistente")
+                ws = wb[m.group(1)]
+                c0, r0, c1, r1 = range_boundaries(m.group(2))
+                if method == "PATCH":
+                    values = json.loads(body or b"{}").get("values") or []
+                    for i, row in enumerate(values):
+                        for j, v in enumerate(row):
+                            if v is not None:           # null deixa a célula como está
+                                ws.cell(r0 + i, c0 + j).value = _excel_value(v)
+                    out = io.BytesIO()
+                    wb.save(out)
+                    self.put_file(item.path, out.getvalue())
+                grid = [[_json_value(ws.cell(r, c).value) for c in range(c0, c1 + 1)] for r in range(r0, r1 + 1)]
+                return 200, {}, {"address": f"{ws.title}!{m.group(2)}", "values": grid}
+
+            m = re.fullmatch(r"tables/([^/]+)/(columns|rows/add|range|columns/([^/]+)/dataBodyRange)", op)
+            if not m:
+                return _err(404, "itemNotFound", "rota desconhecida")
+            if m.group(1).lower() not in tables:
+                return _err(404, "itemNotFound", "tabela inexistente")
+            ws, t = tables[m.group(1).lower()]
+            c0, r0, c1, r1 = range_boundaries(t.ref)
+            names = [ws.cell(r0, c).value for c in range(c0, c1 + 1)]
+            if method == "GET" and m.group(2) == "columns":
+                return 200, {}, {"value": [{"id": str(i + 1), "index": i, "name": n} for i, n in enumerate(names)]}
+            if method == "GET" and m.group(2) == "range":
+                quoted = f"'{ws.title}'" if " " in ws.title else ws.title
+                return 200, {}, {"address": f"{quoted}!{t.ref}"}
+            if method == "GET" and m.group(3):
+                if m.group(3) not in names:
+                    return _err(404, "itemNotFound", "coluna inexistente")
+                c = c0 + names.index(m.group(3))
+                return 200, {}, {"values": [[_json_value(ws.cell(r, c).value)] for r in range(r0 + 1, r1 + 1)]}
+            if method != "POST" or m.group(2) != "rows/add":
+                return _err(405, "invalidRequest", f"{method} não suportado aqui")
+
+            values = json.loads(body or b"{}").get("values") or []
+            if any(len(row) != len(names) for row in values):
+                return _err(400, "invalidArgument", "número de colunas diferente da tabela")
+            for i, row in enumerate(values, start=r1 + 1):
+                for j, v in enumerate(row):
+                    ws.cell(i, c0 + j).value = _excel_value(v)
+            t.ref = f"{get_column_letter(c0)}{r0}:{get_column_letter(c1)}{r1 + len(values)}"
+            out = io.BytesIO()
+            wb.save(out)
+            self.put_file(item.path, out.getvalue())
+        return 201, {}, {"index": r1 - r0, "values": values}
+
+    def _list_route(self, method, name, rest, query, headers, body):
+        """Subconjunto de /lists: colunas, itens ($filter, $top, paginação), inclusão e PATCH."""
+        with self._lock:
+            lst = self._lists.get(name.lower()) or next(
+                (l for l in self._lists.values() if l["id"] == name), None)
+            if lst is None:
+                return _err(404, "itemNotFound", "lista inexistente")
+            if method == "GET" and rest == "":
+                return 200, {}, {"id": lst["id"], "name": lst["name"], "displayName": lst["name"],
+                                 "lastModifiedDateTime": _iso(lst["modified"])}
+            if method == "GET" and rest == "/columns":
+                return 200, {}, {"value": [{"name": c["name"], "displayName": c["displayName"],
+                                            **({c["kind"]: {}} if c["kind"] != "text" else {"text": {}})}
+                                           for c in lst["columns"]]}
+            if rest == "/items" and method == "POST":
+                fields = (json.loads(body or b"{}").get("fields") or {})
+                return 201, {}, self._list_item_json(self._list_create(lst, fields))
+            if rest == "/items" and method == "GET":
+                items = [it for it in lst["items"] if _odata_match(query.get("$filter"), it["fields"])]
+                skip = int(query.get("$skiptoken", 0))
+                top = int(query.get("$top", 200))
+                page = items[skip:skip + top]
+                out = {"value": [self._list_item_json(it) for it in page]}
+                if skip + top < len(items):
+                    q = {k: v for k, v in query.items() if k != "$skiptoken"}
+                    q["$skiptoken"] = str(skip + top)
+                    out["@odata.nextLink"] = (f"{self.base_url}/v1.0/sites/{SITE_ID}/lists/{lst['id']}/items?"
+                                              + urlencode(q))
+                return 200, {}, out
+            m = re.fullmatch(r"/items/(\d+)(/fields)?", rest)
+            it = next((i for i in lst["items"] if m and i["id"] == m.group(1)), None)
+            if it is None:
+                return _err(404, "itemNotFound", "item inexistente")
+            if method == "GET" and not m.group(2):
+                return 200, {}, self._list_item_json(it)
+            if method == "PATCH" and m.group(2):
+                if headers.get("if-match") not in (None, "*", self._list_item_json(it)["eTag"]):
+                    return _err(412, "preconditionFailed", "item alterado")
+                it["fields"].update(json.loads(body or b"{}"))
+                it["version"] += 1
+                lst["modified"] = time.time()
+                return 200, {}, dict(it["fields"])
+        return _err(405, "invalidRequest", f"{method} não suportado aqui")
+
+    def _list_create(self, lst, fields):
+        it = {"id": str(lst["next_id"]), "fields": dict(fields), "version": 1}
+        lst["next_id"] += 1
+        lst["items"].append(it)
+        lst["modified"] = time.time()
+        return it
+
+    @staticmethod
+    def _list_item_json(it):
+        return {"id": it["id"], "eTag": f'"{it["id"]},{it["version"]}"', "fields": {"id": it["id"], **it["fields"]}}
+
+    def _preconditions(self, item, headers, query):
+        if_match = headers.get("if-match")
+        if if_match and (item is None or if_match not in (item.etag, item.ctag, "*")):
+            return _err(412, "preconditionFailed", "eTag não confere")
+        if item is not None and query.get("@microsoft.graph.conflictBehavior") == "fail":
+            return _err(409, "nameAlreadyExists", "arquivo já existe")
+        return None
+
+    def _upload_fragment(self, method, sid, headers, body):
+        with self._lock:
+            sess = self._sessions.get(sid)
+            if sess is None or sess["expires"] < time.time():
+                self._sessions.pop(sid, None)
+                return _err(404, "itemNotFound", "sessão expirada")
+            if method == "DELETE":
+                del self._sessions[sid]
+                return 204, {}, None
+            if method == "GET":
+                return 200, {}, {"nextExpectedRanges": [f"{len(sess['buf'])}-"]}
+            m = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", headers.get("content-range", ""))
+            if method != "PUT" or not m:
+                return _err(400, "invalidRequest", "Content-Range ausente")
+            start, end, total = map(int, m.groups())
+            if start != len(sess["buf"]) or end - start + 1 != len(body or b""):
+                return _err(416, "invalidRange", "fragmento fora de ordem")
+            sess["buf"] += body
+            if len(sess["buf"]) < total:
+                return 202, {}, {"nextExpectedRanges": [f"{len(sess['buf'])}-"]}
+            del self._sessions[sid]
+            item = self._files.get(sess["path"].lower())
+            if sess["if_match"] and (item is None or sess["if_match"] not in (item.etag, item.ctag)):
+                return _err(412, "preconditionFailed", "eTag mudou durante o upload")
+            created = item is None
+            item = self.put_file(sess["path"], bytes(sess["buf"]))
+            return (201 if created else 200), {}, item.meta()
+
+    def _delta(self, query):
+        token = query.get("token", "")
+        with self._lock:
+            end = len(self._changes)
+            if token == "latest":
+                start = end
+            elif token.isdigit() and int(token) <= end:
+                start = int(token)
+            else:
+                return _err(410, "resyncRequired", "token delta inválido")
+            items = self._changes[start:end]
+        link = f"{self.base_url}/v1.0/drives/{DRIVE_ID}/root/delta?token={end}"
+        return 200, {}, {"value": items, "@odata.deltaLink": link}
+
+    def _batch(self, payload):
+        reqs = payload.get("requests", [])
+        if len(reqs) > 20:
+            return _err(400, "invalidRequest", "máximo de 20 requisições por lote")
+        done, out = {}, []
+        for r in reqs:
+            deps = r.get("dependsOn") or []
+            if any(done.get(d, 500) >= 400 for d in deps):
+                status, hdrs, body = _err(424, "failedDependency", "dependência falhou")
+            else:
+                url = urlsplit(r["url"])
+                sub_body = json.dumps(r["body"]).encode("utf-8") if r.get("body") is not None else b""
+                status, hdrs, body = self._next_fault() or self._route(
+                    r["method"].upper(), unquote(url.path),
+                    {k: v[0] for k, v in parse_qs(url.query).items()},
+                    {k.lower(): v for k, v in (r.get("headers") or {}).items()}, sub_body)
+            done[r["id"]] = status
+            if isinstance(body, (bytes, bytearray)):
+                body = None                 # conteúdo binário não é usado em lotes
+            out.append({"id": r["id"], "status": status, "headers": hdrs, "body": body})
+        return 200, {}, {"responses": out}
+
+
+def _excel_value(v):
+    """Como o Excel trata um valor "digitado": vazio limpa, data/hora em texto vira data."""
+    if v == "":
+        return None
+    if isinstance(v, str):
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(v, fmt)
+            except ValueError:
+                pass
+    return v
+
+
+def _sp_internal_name(display: str) -> str:
+    """Nome interno de coluna do SharePoint: caracteres fora de [A-Za-z0-9_] viram _xHHHH_."""
+    return "".join(ch if ch.isascii() and (ch.isalnum() or ch == "_") else f"_x{ord(ch):04x}_" for ch in display)
+
+
+def _odata_match(expr, fields: dict) -> bool:
+    """Avalia filtros simples: fields/X eq 'v' combinados com and / or (entre parênteses)."""
+    if not expr:
+        return True
+    for part in re.split(r"\s+and\s+", expr.strip()):
+        ors = re.split(r"\s+or\s+", part.strip().strip("()"))
+        if not any(_odata_eq(o, fields) for o in ors):
+            return False
+    return True
+
+
+def _odata_eq(cond: str, fields: dict) -> bool:
+    m = re.fullmatch(r"fields/(\w+)\s+eq\s+('(?:[^']|'')*'|[\w.\-]+)", cond.strip())
+    if not m:
+        raise ValueError(f"filtro não suportado: {cond}")
+    raw = m.group(2)
+    value = raw[1:-1].replace("''", "'") if raw.startswith("'") else json.loads(raw)
+    return fields.get(m.group(1)) == value
+
+
+def _iso(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+def _json_value(v):
+    if v is None:
+        return ""
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ")
+    return v
+
+
+def _err(status: int, code: str, message: str):
+    return status, {}, {"error": {"code": code, "message": message}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True      # headers e corpo saem em writes separados
+    graph: FakeGraph = None
+
+    def log_message(self, *args):
+        pass
+
+    def _serve(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(n) if n else b""
+        g = self.graph
+        if g.latency or g.jitter:
+            time.sleep(g.latency + g._rand.uniform(0, g.jitter))
+        try:
+            status, headers, payload = g.handle(self.command, self.path, dict(self.headers.items()), body)
+        except Exception as e:              # bug do servidor falso: responde 500 em vez de derrubar a conexão
+            status, headers, payload = _err(500, "generalException", repr(e))
+        if isinstance(payload, (dict, list)):
+            data = json.dumps(payload).encode("utf-8")
+            headers = {"Content-Type": "application/json", **headers}
+        else:
+            data = bytes(payload or b"")
+        with g._lock:
+            g.stats["bytes_out"] += len(data)
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data and self.command != "HEAD":
+            self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_PATCH = _serve
+
+
+class FakeGraphServer:
+    """
+    Sobe o FakeGraph num thread:
+
+        with FakeGraphServer(latency=0.05) as srv:
+            srv.graph.put_file("Pasta/a.xlsx", dados)
+            sp = SPConnector("t", "c", "s", hostname="fake.sharepoint.com",
+                             site_path="sites/fake", library_name="Documentos",
+                             base_url=srv.url)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **graph_kw):
+        self.graph = FakeGraph(**graph_kw)
+        handler = type("FakeGraphHandler", (_Handler,), {"graph": self.graph})
+        self._httpd = ThreadingHTTPServer((host, port), handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://{host}:{self._httpd.server_port}"
+        self.graph.base_url = self.url
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-graph", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# -------- CLI --------
+def _serve(args):
+    srv = FakeGraphServer(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                          throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    for spec in args.file or []:
+        remote, _, local = spec.partition("=")
+        with open(local, "rb") as f:
+            srv.graph.put_file(remote, f.read())
+    print(f"Fake Graph em {srv.url}  (secrets: [graph] base_url = \"{srv.url}\")")
+    srv.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.stop()
+
+
+def _bench(args):
+    """
+    Mede o pipeline de gravação do app (gravacao.save_merged: ler com eTag ->
+    mesclar por ID -> to_xlsx_bytes -> upload com If-Match -> conferir,
+    refazendo em PreconditionFailed) com vários gravadores concorrentes.
+    """
+    import io
+    import pandas as pd
+    from gravacao import save_merged
+    from sp_connector import SPConnector
+
+    path = "Apontamentos/apontamentos.xlsx"
+    with FakeGraphServer(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                         retry_after=args.retry_after, seed=42) as srv:
+        base = pd.DataFrame({
+            "ID": [f"{i:03d}AA" for i in range(args.rows)],
+            "Código do Estudo": [f"EST-{i % 40:03d}" for i in range(args.rows)],
+            "Status": ["PENDENTE"] * args.rows,
+            "Apontamento": ["texto " * 8] * args.rows,
+        })
+        bio = io.BytesIO()
+        base.to_excel(bio, index=False)
+        srv.graph.put_file(path, bio.getvalue())
+
+        sp = SPConnector("fake-tenant", "client", "secret", hostname="fake.sharepoint.com",
+                         site_path="sites/fake", library_name="Documentos",
+                         base_url=srv.url, cache_dir=None)
+        latencies, conflicts, lock = [], [0], threading.Lock()
+
+        def writer(w):
+            for n in range(args.saves):
+                t0 = time.perf_counter()
+                row = {"ID": f"W{w}-{n}", "Código do Estudo": "EST-999", "Status": "PENDENTE", "Apontamento": "novo"}
+                res = save_merged(sp, path, [pd.DataFrame([row])], table_name="Apontamentos",
+                                  max_attempts=args.writers * args.saves + 1)
+                with lock:
+                    conflicts[0] += res.attempts - 1
+                    latencies.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=writer, args=(w,)) for w in range(args.writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        total = time.perf_counter() - t0
+
+        final = pd.read_excel(io.BytesIO(srv.graph.get_file(path)))
+        lat = sorted(latencies)
+        q = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))]
+        print(f"gravações: {len(lat)} em {total:.2f}s  |  p50 {q(0.5) * 1000:.0f} ms  p95 {q(0.95) * 1000:.0f} ms")
+        print(f"conflitos (412) refeitos: {conflicts[0]}  |  linhas finais: {len(final)} "
+              f"(esperado {args.rows + args.writers * args.saves})")
+        print(f"servidor: {srv.graph.stats}")
+        print(f"pool: {sp.pool_stats()}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Servidor Graph/SharePoint falso para testes offline.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("serve", "bench"):
+        p = sub.add_parser(name)
+        p.add_argument("--latency", type=float, default=0.0, help="latência fixa por requisição (s)")
+        p.add_argument("--jitter", type=float, default=0.0, help="latência aleatória extra, até (s)")
+        p.add_argument("--throttle-rate", type=float, default=0.0, help="fração de respostas 429")
+        p.add_argument("--retry-after", type=float, default=1.0, help="Retry-After dos 429 (s)")
+    sub.choices["serve"].add_argument("--host", default="127.0.0.1")
+    sub.choices["serve"].add_argument("--port", type=int, default=8765)
+    sub.choices["serve"].add_argument("--file", action="append", help="caminho/remoto=arquivo/local (repetível)")
+    sub.choices["bench"].add_argument("--writers", type=int, default=4)
+    sub.choices["bench"].add_argument("--saves", type=int, default=3)
+    sub.choices["bench"].add_argument("--rows", type=int, default=2000)
+    args = ap.parse_args(argv)
+    (_serve if args.cmd == "serve" else _bench)(args)
+
+
+if __name__ == "__main__":
+    main()
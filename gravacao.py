@@ -0,0 +1,70 @@
+# gravacao.py
+"""
+Gravação completa do arquivo de apontamentos com concorrência otimista.
+
+    res = save_merged(sp, "Pasta/apontamentos.xlsx", [df1, df2], table_name="Apontamentos")
+    res.df, res.etag        # o que foi gravado e a versão nova do arquivo
+
+1. Lê a versão atual do arquivo e guarda o eTag dela
+2. Mescla cada envio em sequência (apontamentos.merge_by_id): linhas
+   existentes atualizam APENAS as colunas do envio; linhas novas vão ao final
+3. Salva com If-Match = eTag lido: o SharePoint recusa se alguém gravou no meio
+4. Só nesse caso (eTag mudou) relê o arquivo e refaz a mescla
+5. Confere o driveItem devolvido pelo upload (sp_verify.verify_upload)
+
+É o mesmo caminho do app (fila de gravação) e do `python fake_graph.py bench`.
+Não usa streamlit: roda em qualquer thread.
+"""
+import io, logging
+from typing import NamedTuple
+
+import pandas as pd
+
+from apontamentos import merge_by_id
+from sp_errors import PreconditionFailed
+from sp_verify import UploadCheck, verify_upload
+from sp_workbook import to_xlsx_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class SaveResult(NamedTuple):
+    df: pd.DataFrame        # arquivo gravado, com os valores lidos (sem o esquema aplicado)
+    item: dict              # driveItem devolvido pelo upload
+    check: UploadCheck
+    attempts: int           # 1 = gravou sem conflito
+
+    @property
+    def etag(self) -> str | None:
+        return self.item.get("eTag")
+
+
+def save_merged(sp, path: str, dfs: list, table_name: str | None = None, max_attempts: int = 5) -> SaveResult:
+    """
+    Mescla `dfs` (na ordem) na versão atual de `path` e grava com If-Match.
+    Levanta PreconditionFailed se o arquivo mudar a cada uma das tentativas.
+    """
+    etag = None
+    for tentativa in range(max_attempts):
+        # revalida o eTag; só baixa se mudou
+        data, etag = sp.download_with_etag(path, max_age=0)
+        base_df = pd.read_excel(io.BytesIO(data))
+        for df in dfs:
+            base_df = merge_by_id(base_df, df)
+
+        # (com a tabela do Excel, para a inclusão pela API de workbook continuar funcionando)
+        payload = to_xlsx_bytes(base_df, table_name=table_name)
+        try:
+            item = sp.upload_small(path, payload, overwrite=True, if_match=etag)
+        except PreconditionFailed:
+            # outra pessoa salvou depois da nossa leitura: relê e mescla de novo
+            logger.info("Arquivo alterado durante a gravação; mesclando de novo (%d/%d)",
+                        tentativa + 1, max_attempts)
+            continue
+        # o If-Match garante que gravamos sobre a versão lida; o driveItem
+        # devolvido pelo PUT confirma o resto (eTag/cTag novos, tamanho e hash)
+        check = verify_upload(item, payload, previous_etag=etag)
+        if not check.ok:
+            logger.warning("Upload de %s não confere: %s", path, "; ".join(check.problems))
+        return SaveResult(base_df, item, check, tentativa + 1)
+    raise PreconditionFailed(path, etag)
@@ -0,0 +1,279 @@
+# journal.py
+"""
+Fila de gravação (write-behind) com diário local em disco.
+
+Quando várias pessoas salvam quase ao mesmo tempo, cada gravação completa
+do arquivo (baixar, mesclar, enviar) disputa o eTag com as outras. Aqui um
+único thread grava (group commit): com a fila parada, um envio é gravado na
+hora; os que chegam enquanto uma gravação está em andamento esperam por ela
+e saem juntos na gravação seguinte:
+
+    fila = WriteBehindQueue(WriteJournal("apontamentos.journal"), gravar_lote)
+    fut = fila.submit(df)            # já está no diário (fsync) ao retornar
+    base = fut.result(timeout=120)   # resultado de gravar_lote, ou a exceção dele
+    fila.submit(df1, df2)            # um envio em partes (ex: colunas diferentes por linha)
+
+`flush(lista_de_dfs)` recebe os DataFrames na ordem em que chegaram e deve
+aplicá-los em sequência (a mescla de um não pode apagar colunas que ele
+não trouxe); as partes de um envio chegam juntas, no mesmo lote. Cada envio é gravado no diário antes de entrar na fila; depois
+da gravação, um marcador "done" é anexado. Se o processo cair no meio, os
+envios sem marcador são regravados na próxima inicialização. Gravações que
+falham por erro temporário ficam no diário e são repetidas com espera.
+"""
+import json, logging, os, threading, time
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+from datetime import date, datetime
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class WriteJournal:
+    """Arquivo só de acréscimo: uma linha JSON por envio ou marcador, com fsync."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def append(self, *dfs: pd.DataFrame) -> int:
+        with self._lock:
+            self._seq += 1
+            if len(dfs) == 1:
+                self._write({"seq": self._seq, "rows": _encode(dfs[0])})
+            else:
+                self._write({"seq": self._seq, "parts": [_encode(df) for df in dfs]})
+            return self._seq
+
+    def done(self, seqs):
+        with self._lock:
+            self._write({"done": list(seqs)})
+
+    def pending(self) -> list:
+        """[(seq, [DataFrame, ...])] dos envios sem marcador "done", em ordem."""
+        entries, done = {}, set()
+        with self._lock:
+            if not os.path.exists(self.path):
+                return []
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line, object_hook=_decode)
+                    except ValueError:
+                        break                   # linha cortada por queda no meio da escrita
+                    if "done" in rec:
+                        done.update(rec["done"])
+                    else:
+                        entries[rec["seq"]] = [pd.DataFrame(p["data"], columns=p["columns"])
+                                               for p in (rec["parts"] if "parts" in rec else [rec["rows"]])]
+            self._seq = max([self._seq, *entries, *done])
+        return [(s, df) for s, df in sorted(entries.items()) if s not in done]
+
+    def compact(self):
+        """Esvazia o diário (chamar só sem envios pendentes)."""
+        with self._lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _write(self, rec: dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False, default=_default) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class WriteBehindQueue:
+    """
+    Um único gravador para o processo. submit() devolve um Future com o
+    retorno de `flush` para o lote em que o envio entrou. `window` > 0 faz o
+    gravador ocioso esperar mais envios antes de gravar (padrão: não espera).
+
+    Falha temporária (rede, 5xx, circuito aberto, arquivo mudando): o lote
+    volta para o início da fila e é repetido com espera exponencial
+    (retry_base * 2**n, até retry_max), sem sair do diário. Só sai com erro
+    permanente (`permanent(e)`, ex: 4xx de validação) ou depois de
+    `max_attempts` tentativas; aí o Future recebe a exceção. Um erro
+    permanente num lote de vários envios repete cada envio sozinho, para
+    que um envio ruim não derrube os outros.
+    """
+
+    def __init__(self, journal: WriteJournal, flush, window: float = 0.0, max_batch: int = 50,
+                 max_attempts: int = 8, retry_base: float = 2.0, retry_max: float = 300.0, permanent=None):
+        self.journal = journal
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.permanent = permanent or permanent_error
+        self._items: list[_Envio] = []
+        self._retry_at = 0.0                # monotonic: não grava antes disso (espera após falha)
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self.last_error = None
+        self.last_batch = 0
+        # envios de uma execução anterior que não chegaram ao SharePoint
+        for seq, dfs in journal.pending():
+            logger.info("Regravando envio %s do diário (%d linhas)", seq, sum(map(len, dfs)))
+            self._items.append(_Envio(seq, dfs, Future()))
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="sp-write-behind", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def submit(self, *dfs: pd.DataFrame) -> Future:
+        """Um envio (uma ou mais partes, aplicadas em ordem no mesmo lote)."""
+        fut = Future()
+        with self._cond:                # junto com a fila, para compact() não apagar o envio
+            seq = self.journal.append(*dfs)
+            self._items.append(_Envio(seq, list(dfs), fut))
+            self._cond.notify_all()
+        return fut
+
+    def wait(self, fut: Future, timeout: float):
+        """
+        Resultado de `fut`; levanta concurrent.futures.TimeoutError se não
+        terminar em `timeout` s ou se a primeira tentativa falhou e o envio
+        ficou na fila para ser repetido (não adianta esperar as próximas).
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not fut.done():
+                left = deadline - time.monotonic()
+                if left <= 0 or any(e.fut is fut and e.attempts for e in self._items):
+                    raise FuturesTimeout()
+                self._cond.wait(left)
+        return fut.result()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    if not self._items:
+                        self._cond.wait()
+                    elif time.monotonic() < self._retry_at:
+                        self._cond.wait(self._retry_at - time.monotonic())
+                    else:
+                        break
+                if self._stop:
+                    return
+                # sem janela: grava o que já está na fila (os que chegam durante
+                # a gravação formam o próximo lote)
+                deadline = time.monotonic() + self.window
+                while self.window > 0 and len(self._items) < self.max_batch and not self._stop:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                n = 1
+                if not self._items[0].solo:
+                    while n < min(self.max_batch, len(self._items)) and not self._items[n].solo:
+                        n += 1
+                batch, self._items = self._items[:n], self._items[n:]
+            self._flush(batch)
+
+    def _flush(self, batch):
+        self.last_batch = len(batch)
+        try:
+            result = self.flush([df for e in batch for df in e.dfs])
+        except Exception as e:
+            self.last_error = e
+            self._failed(batch, e)
+            return
+        self.last_error = None
+        self.journal.done(e.seq for e in batch)
+        with self._cond:
+            self._retry_at = 0.0
+            if not self._items:
+                self.journal.compact()
+            for e in batch:
+                e.fut.set_result(result)
+            self._cond.notify_all()
+
+    def _failed(self, batch, error: Exception):
+        for e in batch:
+            e.attempts += 1
+        permanent = self.permanent(error)
+        if permanent and len(batch) > 1:
+            # não se sabe qual envio causou o erro: cada um é repetido sozinho
+            for e in batch:
+                e.solo = True
+            keep, drop = batch, []
+        elif permanent:
+            keep, drop = [], batch
+        else:
+            keep = [e for e in batch if e.attempts < self.max_attempts]
+            drop = [e for e in batch if e.attempts >= self.max_attempts]
+        if drop:
+            # quem esperava recebe o erro (e a tela avisa que não salvou): o envio sai
+            # do diário para não ser regravado depois sem ninguém saber
+            logger.error("Gravação de %d envio(s) desistida (%s): %s", len(drop),
+                         "erro permanente" if permanent else f"{self.max_attempts} tentativas", error)
+            self.journal.done(e.seq for e in drop)
+        with self._cond:
+            if keep:
+                attempts = max(e.attempts for e in keep)
+                delay = 0.0 if permanent else min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+                logger.warning("Gravação de %d envio(s) falhou (%s); nova tentativa em %.0fs",
+                               len(keep), error, delay)
+                self._items[:0] = keep          # continuam na frente: a ordem das mesclas importa
+                self._retry_at = time.monotonic() + delay
+            for e in drop:
+                e.fut.set_exception(error)
+            self._cond.notify_all()
+
+
+class _Envio:
+    __slots__ = ("seq", "dfs", "fut", "attempts", "solo")
+
+    def __init__(self, seq: int, dfs: list, fut: Future):
+        self.seq, self.dfs, self.fut = seq, dfs, fut
+        self.attempts = 0
+        self.solo = False           # gravar sozinho (o lote em que estava teve erro permanente)
+
+
+def permanent_error(e: Exception) -> bool:
+    """Erro que repetir não resolve: dados inválidos ou 4xx (exceto 408/409/412/423/429)."""
+    if isinstance(e, (ValueError, TypeError, KeyError)):
+        return True
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return status is not None and 400 <= status < 500 and status not in (408, 409, 412, 423, 429)
+
+
+def _encode(df: pd.DataFrame) -> dict:
+    df = df.astype(object).where(df.notna(), None)
+    return {"columns": [str(c) for c in df.columns], "data": df.values.tolist()}
+
+
+def _default(v):
+    if isinstance(v, datetime):         # inclui pd.Timestamp
+        return {"$dt": v.isoformat()}
+    if isinstance(v, date):
+        return {"$d": v.isoformat()}
+    if hasattr(v, "item"):
+        return v.item()                 # escalares numpy
+    raise TypeError(f"Valor não serializável no diário: {type(v).__name__}")
+
+
+def _decode(obj: dict):
+    if "$dt" in obj:
+        return pd.Timestamp(obj["$dt"])
+    if "$d" in obj:
+        return date.fromisoformat(obj["$d"])
+    return obj
@@ -0,0 +1,78 @@
+# referencia.py
+"""
+Dados de referência do formulário (estudos e colaboradores) já indexados.
+
+A cada rerun o formulário procurava o protocolo no CSV de estudos e o
+colaborador na planilha com filtros sobre o DataFrame inteiro, e montava
+de novo as listas de opções. ReferenceData faz isso uma vez por versão
+dos arquivos; o app o guarda em cache_resource e só o descarta quando o
+observador do SharePoint vê o CSV ou a planilha mudar:
+
+    ref = ReferenceData(df_estudos, df_colaboradores)
+    ref.nome_pesquisa("ABC-123")                                  # "" se não existir
+    ref.dados_colab("Fulano", ["Plantão", "Departamento"])       # ("", "") se não existir
+    ref.nomes_departamento("Excelência Operacional")
+"""
+import pandas as pd
+
+SEM_PROTOCOLO = "Digite o codigo do estudo"
+SEM_COLABORADOR = "Selecione um colaborador"
+
+DOCUMENTOS = (
+    "Acompanhamento da Administração da Medicação", "Ajuste dos Relógios", "Anotação de enfermagem",
+    "Aplicação do TCLE", "Ausência de Período", "Avaliação Clínica Pré Internação", "Avaliação de Alta Clínica",
+    "Controle de Eliminações fisiológicas", "Controle de Glicemia", "Controle de Ausente de Período",
+    "Controle de DropOut", "Critérios de Inclusão e Exclusão", "Desvio de ambulação", "Dieta",
+    "Diretrizes do Protocolo", "Tabela de Controle de Preparo de Heparina", "TIME", "TCLE", "ECG",
+    "Escala de Enfermagem", "Evento Adverso", "Ficha de internação", "Formulário de conferência das amostras",
+    "Teste de HCG", "Teste de Drogas", "Teste de Álcool", "Término Prematuro",
+    "Medicação para tratamento dos Eventos Adversos", "Orientação por escrito", "Prescrição Médica",
+    "Registro de Temperatura da Enfermaria", "Relação dos Profissionais", "Sinais Vitais Pós Estudo",
+    "SAE", "SINEB", "FOR 104", "FOR 123", "FOR 166", "FOR 217", "FOR 233", "FOR 234", "FOR 235",
+    "FOR 236", "FOR 240", "FOR 241", "FOR 367", "Outros",
+)
+
+PARTICIPANTES = ("N/A", "Outros", *(f"PP{i:02d}" for i in range(1, 100)), *(f"PP{i}" for i in range(100, 1000)))
+
+_PROTOCOLO = "NUMERO_DO_PROTOCOLO"
+_PESQUISA = "NOME_DA_PESQUISA"
+_NOME = "Nome Completo do Profissional"
+
+
+class ReferenceData:
+    """Índices e listas de opções de estudos e colaboradores (não alterar depois de montado)."""
+
+    def __init__(self, estudos: pd.DataFrame, colaboradores: pd.DataFrame):
+        self.estudos = estudos
+        self.colaboradores = colaboradores
+
+        protocolos = _col(estudos, _PROTOCOLO)
+        self._pesquisa: dict = {}
+        # a primeira linha de cada protocolo vale (como o .loc[...].iloc[0] fazia)
+        for p, nome in zip(protocolos, _col(estudos, _PESQUISA)):
+            self._pesquisa.setdefault(p, nome)
+        self.opcoes_protocolo = [SEM_PROTOCOLO, *protocolos]
+
+        nomes = _col(colaboradores, _NOME)
+        self._colab: dict = {}
+        for nome, linha in zip(nomes, colaboradores.to_dict("records")):
+            self._colab.setdefault(nome, linha)
+        self._departamento: dict = {}
+        for nome, depto in zip(nomes, _col(colaboradores, "Departamento")):
+            self._departamento.setdefault(depto, []).append(nome)
+        self.opcoes_responsavel = [SEM_COLABORADOR, *nomes]
+
+    def nome_pesquisa(self, protocolo) -> str:
+        return self._pesquisa.get(protocolo, "")
+
+    def dados_colab(self, nome, campos: list[str]) -> tuple:
+        """Valores de `campos` do colaborador, na ordem pedida ("" para campo ou colaborador ausente)."""
+        linha = self._colab.get(nome, {})
+        return tuple(linha.get(campo, "") for campo in campos)
+
+    def nomes_departamento(self, departamento) -> list:
+        return self._departamento.get(departamento, [])
+
+
+def _col(df: pd.DataFrame, col: str) -> list:
+    return df[col].tolist() if col in df.columns else [None] * len(df)
@@ -0,0 +1,186 @@
+# sp_batch.py
+"""
+Agrupamento de chamadas do Graph em /$batch (JSON batching).
+
+Cada add() devolve um Future; execute() envia tudo em lotes de até 20
+requisições e resolve cada Future com a resposta correspondente. Requisições
+ligadas por depends_on vão sempre no mesmo lote (exigência do Graph), na
+ordem das dependências.
+
+Respostas 429/503 dentro do lote (o Graph limita cada requisição do lote
+individualmente) são reenviadas conforme a RetryPolicy, respeitando o
+Retry-After; as que dependiam delas (424) vão junto.
+"""
+from concurrent.futures import Future
+from typing import Any, Callable, NamedTuple, Optional
+
+from sp_retry import RetryPolicy
+
+MAX_BATCH = 20
+
+
+class BatchResponse(NamedTuple):
+    status: int
+    headers: dict
+    body: Any
+
+
+class GraphBatchError(Exception):
+    """Resposta de erro (>= 400) de uma requisição dentro do lote."""
+
+    def __init__(self, status: int, body: Any, method: str = "", url: str = ""):
+        detail = body.get("error", {}).get("message") if isinstance(body, dict) else body
+        super().__init__(f"{status} em {method} {url}: {detail}")
+        self.status = status
+        self.body = body
+
+
+class _Item(NamedTuple):
+    id: str
+    request: dict
+    future: Future
+    depends_on: tuple
+
+
+class GraphBatch:
+    """
+    Uso:
+        b = sp.batch()
+        f_site = b.add("GET", f"/sites/{host}:/{path}")
+        f_item = b.add("GET", "/drives/{id}/root:/a.xlsx:", headers={"If-None-Match": etag})
+        b.execute()
+        f_site.result().body["id"]
+
+    Um 304 resolve o Future normalmente (status 304, body None); respostas
+    >= 400 (inclusive 424 de dependência que falhou) viram GraphBatchError.
+    """
+
+    def __init__(self, send: Callable[[list], list], base_url: str, retry_policy: Optional[RetryPolicy] = None):
+        self._send = send            # recebe a lista de requisições de um lote, devolve as respostas
+        self._base_url = base_url.rstrip("/")
+        self._policy = retry_policy
+        self._items: list[_Item] = []
+        self._by_future: dict[int, str] = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, method: str, url: str, headers: Optional[dict] = None, body: Any = None,
+            depends_on=()) -> Future:
+        if url.startswith(self._base_url):
+            url = url[len(self._base_url):]
+        rid = str(len(self._items) + 1)
+        req = {"id": rid, "method": method.upper(), "url": url if url.startswith("/") else f"/{url}"}
+        hdrs = dict(headers or {})
+        if body is not None:
+            req["body"] = body
+            hdrs.setdefault("Content-Type", "application/json")
+        if hdrs:
+            req["headers"] = hdrs
+        deps = tuple(self._by_future[id(f)] for f in depends_on)
+        if deps:
+            req["dependsOn"] = list(deps)
+        fut = Future()
+        self._items.append(_Item(rid, req, fut, deps))
+        self._by_future[id(fut)] = rid
+        return fut
+
+    def execute(self):
+        """Envia as requisições pendentes (quantos lotes forem necessários)."""
+        items, self._items, self._by_future = self._items, [], {}
+        for group in _pack(items):
+            for it in group:
+                it.future.set_running_or_notify_cancel()
+            self._execute_group(group)
+
+    def _execute_group(self, group: list):
+        attempt = 0
+        while group:
+            try:
+                responses = self._send([it.request for it in group])
+            except BaseException as e:
+                for it in group:
+                    it.future.set_exception(e)
+                return
+            by_id = {str(r.get("id")): r for r in responses}
+
+            throttled, waits = set(), []
+            if self._policy is not None and attempt + 1 < self._policy.max_attempts:
+                for it in group:
+                    r = by_id.get(it.id) or {}
+                    status = int(r.get("status", 0))
+                    if status in (429, 503):
+                        throttled.add(it.id)
+                        waits.append(_retry_after(r))
+                    elif status == 424 and any(d in throttled for d in it.depends_on):
+                        throttled.add(it.id)
+
+            for it in group:
+                if it.id in throttled:
+                    continue
+                r = by_id.get(it.id)
+                if r is None:
+                    it.future.set_exception(GraphBatchError(0, "sem resposta no lote", it.request["method"], it.request["url"]))
+                    continue
+                status = int(r.get("status", 0))
+                body = r.get("body")
+                if status >= 400:
+                    it.future.set_exception(GraphBatchError(status, body, it.request["method"], it.request["url"]))
+                else:
+                    it.future.set_result(BatchResponse(status, r.get("headers") or {}, body))
+
+            group = [it for it in group if it.id in throttled]
+            if group:
+                known = [w for w in waits if w is not None]
+                self._policy.sleep(self._policy.delay(attempt, max(known) if known else None))
+                # dependências já resolvidas saem do lote reenviado
+                keep = {it.id for it in group}
+                for it in group:
+                    deps = [d for d in it.depends_on if d in keep]
+                    if deps:
+                        it.request["dependsOn"] = deps
+                    else:
+                        it.request.pop("dependsOn", None)
+                attempt += 1
+
+
+def _retry_after(response: dict) -> Optional[float]:
+    headers = {k.lower(): v for k, v in (response.get("headers") or {}).items()}
+    try:
+        return float(headers["retry-after"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _pack(items: list) -> list:
+    """
+    Divide em lotes de até MAX_BATCH mantendo cada grupo de dependências
+    (componente conexo de depends_on) inteiro e na ordem de inserção.
+    """
+    parent = {it.id: it.id for it in items}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for it in items:
+        for d in it.depends_on:
+            parent[find(it.id)] = find(d)
+
+    components: dict[str, list] = {}
+    for it in items:
+        components.setdefault(find(it.id), []).append(it)
+
+    batches, current = [], []
+    for comp in components.values():
+        if len(comp) > MAX_BATCH:
+            raise ValueError(f"Cadeia de dependências com {len(comp)} requisições (máximo {MAX_BATCH} por lote).")
+        if len(current) + len(comp) > MAX_BATCH:
+            batches.append(current)
+            current = []
+        current.extend(comp)
+    if current:
+        batches.append(current)
+    return batches
@@ -0,0 +1,260 @@
+# sp_cache.py
+"""
+Cache de conteúdo em dois níveis usado pelo SPConnector.
+
+  - Memória: LRU limitado pelo total de bytes guardados.
+  - Disco: um arquivo por (caminho, eTag), sobrevive a reinícios do processo
+    e a st.cache_resource.clear(). Só a versão mais recente de cada caminho
+    é mantida.
+
+O cache não decide sozinho se um conteúdo ainda vale: quem usa (o conector)
+revalida o eTag com o Graph e chama touch() quando o servidor confirma que
+nada mudou.
+"""
+import hashlib, json, os, tempfile, threading, time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "sp_connector_cache")
+
+
+class CacheEntry(NamedTuple):
+    etag: str
+    data: bytes
+    validated_at: float   # time.monotonic() da última confirmação do eTag (0 = nunca neste processo)
+
+
+def _h(s: str) -> str:
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+
+class ContentCache:
+    def __init__(self, max_memory_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = DEFAULT_CACHE_DIR):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self._mem: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # -------- API --------
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            e = self._mem.get(key)
+            if e is not None:
+                self._mem.move_to_end(key)
+                return e
+        e = self._disk_get(key)
+        if e is not None:
+            with self._lock:
+                self._mem_put(key, e)
+        return e
+
+    def put(self, key: str, etag: str, data: bytes):
+        e = CacheEntry(etag, data, time.monotonic())
+        with self._lock:
+            self._mem_put(key, e)
+        self._disk_put(key, etag, data)
+
+    def touch(self, key: str):
+        """Marca a entrada como revalidada agora (eTag confirmado pelo servidor)."""
+        with self._lock:
+            e = self._mem.get(key)
+            if e is not None:
+                self._mem[key] = e._replace(validated_at=time.monotonic())
+
+    def mark_stale(self, key: str):
+        """Mantém o conteúdo, mas obriga a revalidar o eTag na próxima leitura."""
+        with self._lock:
+            e = self._mem.get(key)
+            if e is not None:
+                self._mem[key] = e._replace(validated_at=0.0)
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def is_fresh(self, key: str, max_age: float) -> bool:
+        with self._lock:
+            e = self._mem.get(key)
+        return e is not None and e.validated_at > 0 and time.monotonic() - e.validated_at < max_age
+
+    def invalidate(self, key: Optional[str] = None):
+        with self._lock:
+            keys = list(self._mem) if key is None else [key]
+            for k in keys:
+                e = self._mem.pop(k, None)
+                if e is not None:
+                    self._mem_bytes -= len(e.data)
+        if not self.disk_dir:
+            return
+        if key is None:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith((".json", ".bin")):
+                    _silent_remove(os.path.join(self.disk_dir, name))
+        else:
+            self._disk_remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._mem),
+                "memory_bytes": self._mem_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    # -------- Memória (chamar com o lock) --------
+    def _mem_put(self, key: str, e: CacheEntry):
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old.data)
+        if len(e.data) > self.max_memory_bytes:
+            return  # grande demais p/ memória: fica só no disco
+        self._mem[key] = e
+        self._mem_bytes += len(e.data)
+        while self._mem_bytes > self.max_memory_bytes and self._mem:
+            _, ev = self._mem.popitem(last=False)
+            self._mem_bytes -= len(ev.data)
+
+    # -------- Disco --------
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{_h(key)}.json")
+
+    def _body_path(self, key: str, etag: str) -> str:
+        return os.path.join(self.disk_dir, f"{_h(key)}-{_h(etag)}.bin")
+
+    def _disk_get(self, key: str) -> Optional[CacheEntry]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._meta_path(key), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("key") != key:
+                return None
+            with open(self._body_path(key, meta["etag"]), "rb") as f:
+                data = f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(data) != meta.get("size", len(data)):
+            return None
+        return CacheEntry(meta["etag"], data, 0.0)
+
+    def _disk_put(self, key: str, etag: str, data: bytes):
+        if not self.disk_dir:
+            return
+        try:
+            old = None
+            try:
+                with open(self._meta_path(key), encoding="utf-8") as f:
+                    old = json.load(f).get("etag")
+            except (OSError, ValueError):
+                pass
+            _atomic_write(self._body_path(key, etag), data)
+            meta = {"key": key, "etag": etag, "size": len(data)}
+            _atomic_write(self._meta_path(key), json.dumps(meta).encode("utf-8"))
+            if old and old != etag:
+                _silent_remove(self._body_path(key, old))
+        except OSError:
+            pass  # o disco é só uma otimização
+
+    def _disk_remove(self, key: str):
+        try:
+            with open(self._meta_path(key), encoding="utf-8") as f:
+                etag = json.load(f).get("etag")
+        except (OSError, ValueError):
+            return
+        _silent_remove(self._meta_path(key))
+        if etag:
+            _silent_remove(self._body_path(key, etag))
+
+
+def _atomic_write(path: str, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        _silent_remove(tmp)
+        raise
+
+
+def _silent_remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class IdStore:
+    """
+    IDs resolvidos no Graph (site, drive e caminho -> driveItem id) guardados
+    num JSON local com validade (ttl). Evita repetir a descoberta a cada
+    reinício do processo ou st.cache_resource.clear().
+
+    As chaves incluem tudo que identifica o recurso (tenant, host, site,
+    biblioteca, drive), então trocar os secrets nunca reaproveita um id de
+    outra configuração. Quem usa um id que o Graph recusar (404) deve chamar
+    forget() e resolver de novo.
+    """
+
+    def __init__(self, path: Optional[str], ttl: float = 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: dict = self._load()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            e = self._data.get(key)
+        if not e or time.time() - e.get("ts", 0) > self.ttl:
+            return None
+        return e.get("value")
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            e = self._data.get(key)
+            if e and e.get("value") == value and time.time() - e.get("ts", 0) < self.ttl / 2:
+                return  # já está gravado e longe de vencer
+            self._data[key] = {"value": value, "ts": time.time()}
+        self._save()
+
+    def forget(self, key: str):
+        with self._lock:
+            if self._data.pop(key, None) is None:
+                return
+        self._save(removed=key)
+
+    def _load(self) -> dict:
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, removed: Optional[str] = None):
+        if not self.path:
+            return
+        with self._lock:
+            # outro processo pode ter gravado: mescla antes de sobrescrever
+            merged = self._load()
+            for k, e in self._data.items():
+                if k not in merged or merged[k].get("ts", 0) <= e.get("ts", 0):
+                    merged[k] = e
+            if removed:
+                merged.pop(removed, None)
+            self._data = merged
+            try:
+                _atomic_write(self.path, json.dumps(merged).encode("utf-8"))
+            except OSError:
+                pass
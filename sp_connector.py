@@ -1,9 +1,25 @@
 # sp_connector.py
-import io, time, requests, msal, pandas as pd
+import hashlib, io, logging, os, tempfile, time, threading, requests, msal, pandas as pd
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+from sp_batch import GraphBatch, GraphBatchError
+from sp_cache import ContentCache, IdStore, DEFAULT_CACHE_DIR
+from sp_delta import DeltaWatcher
+from sp_errors import PreconditionFailed  # reexportada
+from sp_lists import SharePointList
+from sp_metrics import TimedHTTPAdapter, cache_event, request_event, reset_timing
+from sp_retry import CircuitBreaker, CircuitOpenError, RetryPolicy, endpoint_key, retry_after_seconds
+from sp_workbook import WorkbookSession, to_xlsx_bytes
 
 GRAPH = "https://graph.microsoft.com/v1.0"
 
+SIMPLE_UPLOAD_MAX = 4 * 1024 * 1024     # limite do PUT simples no Graph
+CHUNK_ALIGN = 320 * 1024                # fragmentos de upload session: múltiplos de 320 KiB
+
+logger = logging.getLogger(__name__)
+
+
 class SPConnector:
     """
     Conecta no SharePoint/OneDrive via Microsoft Graph (app-only).
@@ -15,10 +31,43 @@ class SPConnector:
         (aceita tb /personal/<upn>/Documents/... que será normalizado)
       - SharePoint: RELATIVO à biblioteca (ex: "Pasta/arquivo.xlsx")
         (aceita tb server-relative /sites/<site>/<lib>/... que será normalizado)
+    Conexões HTTP:
+      - Uma única requests.Session (keep-alive) compartilhada entre threads,
+        com pool configurável: pool_connections = nº de hosts mantidos,
+        pool_maxsize = conexões simultâneas por host, pool_block = espera
+        por conexão livre em vez de abrir conexões extras descartáveis.
+      - pool_stats() expõe o reaproveitamento de conexões.
+      - Toda chamada passa por retry_policy (429/5xx/rede, respeitando o
+        Retry-After do Graph, backoff exponencial com jitter) e por um
+        circuit_breaker por endpoint (ver sp_retry).
+    Métricas:
+      - add_hook(fn) registra fn(RequestEvent), chamado a cada requisição
+        (operação, caminho, status, bytes, tempos de dns/connect/ttfb/total,
+        retries) e a cada leitura resolvida ou não pelo cache (ver sp_metrics;
+        PrometheusExporter é um hook pronto).
+    Cache de conteúdo (download):
+      - LRU em memória limitado a cache_max_bytes + cópia em disco (cache_dir,
+        None desliga o disco), ambos chaveados por caminho + eTag.
+      - Um acerto só é devolvido depois de revalidar o eTag com o Graph
+        (If-None-Match no driveItem -> 304), exceto se a última validação
+        tiver menos de cache_max_age segundos.
+    Upload:
+      - Até 4 MB: PUT simples. Acima disso, upload_small() delega para
+        upload_large() (upload session em fragmentos de upload_chunk_size).
+      - workbook(path) abre uma sessão da API do Excel para alterar tabelas
+        no servidor (ex: adicionar linhas) sem reenviar o arquivo (ver sp_workbook).
+    Listas:
+      - sharepoint_list(nome) lê/grava itens de uma lista do site, com
+        $filter e paginação no servidor (ver sp_lists).
     """
 
     def __init__(self, tenant_id, client_id, client_secret,
-                 hostname=None, site_path=None, library_name=None, user_upn=None):
+                 hostname=None, site_path=None, library_name=None, user_upn=None,
+                 pool_connections=4, pool_maxsize=16, pool_block=False,
+                 cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=64 * 1024 * 1024, cache_max_age=5.0,
+                 upload_chunk_size=10 * CHUNK_ALIGN, id_ttl=24 * 3600,
+                 retry_policy: RetryPolicy | None = None, circuit_breaker: CircuitBreaker | None = None,
+                 base_url: str | None = None):
         self.tenant_id = tenant_id
         self.client_id = client_id
         self.client_secret = client_secret
@@ -28,66 +77,303 @@ class SPConnector:
         self.library_name = library_name or ""
         self.user_upn = user_upn or ""          # se presente, opera em OneDrive
 
-        self._app = msal.ConfidentialClientApplication(
-            client_id=self.client_id,
-            authority=f"https://login.microsoftonline.com/{self.tenant_id}",
-            client_credential=self.client_secret,
-        )
+        # base_url aponta o conector para outro servidor (ex: fake_graph.py local):
+        # Graph em {base_url}/v1.0 e token em {base_url}/{tenant}/oauth2/v2.0/token
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.graph = f"{self.base_url}/v1.0" if self.base_url else GRAPH
+
+        self._app = None                        # criado sob demanda (usa o pool HTTP)
         self._tok = None
         self._exp = 0
         self._site_id_cache = None
         self._drive_id_cache = None
 
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self._lock = threading.RLock()
+        self._session = None
+        self._n_requests = 0
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._hooks = []
+
+        self.cache_max_age = cache_max_age
+        self.cache_dir = cache_dir
+        self._cache = ContentCache(cache_max_bytes, cache_dir) if cache_max_bytes else None
+        self._watchers = []
+        self._ids = IdStore(os.path.join(cache_dir, "ids.json") if cache_dir else None, ttl=id_ttl)
+        self._drive_from_store = False       # drive id veio do disco e ainda não foi usado com sucesso
+
+        if upload_chunk_size <= 0 or upload_chunk_size % CHUNK_ALIGN:
+            raise ValueError(f"upload_chunk_size precisa ser múltiplo de {CHUNK_ALIGN} bytes.")
+        self.upload_chunk_size = upload_chunk_size
+
     # -------- Auth --------
     def _token(self):
         now = time.time()
         if self._tok and now < self._exp:
             return self._tok
-        res = self._app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
-        if "access_token" not in res:
-            raise RuntimeError(res.get("error_description") or res)
-        self._tok = res["access_token"]
-        self._exp = now + int(res.get("expires_in", 3600)) - 60
-        return self._tok
+        with self._lock:
+            # outra thread pode ter renovado enquanto esperávamos o lock
+            if self._tok and now < self._exp:
+                return self._tok
+            if self.base_url:
+                res = self._token_from_base_url()
+            else:
+                res = self._token_msal()
+            if "access_token" not in res:
+                raise RuntimeError(res.get("error_description") or res)
+            self._tok = res["access_token"]
+            self._exp = now + int(res.get("expires_in", 3600)) - 60
+            return self._tok
+
+    def _token_msal(self) -> dict:
+        if self._app is None:
+            self._app = msal.ConfidentialClientApplication(
+                client_id=self.client_id,
+                authority=f"https://login.microsoftonline.com/{self.tenant_id}",
+                client_credential=self.client_secret,
+                http_client=self._http(),
+            )
+        return self._app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+
+    def _token_from_base_url(self) -> dict:
+        # O MSAL só aceita autoridades https da Microsoft: com base_url o
+        # client-credentials vai direto no endpoint de token do servidor.
+        r = self._request("POST", f"{self.base_url}/{self.tenant_id}/oauth2/v2.0/token", op="token", data={
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "scope": "https://graph.microsoft.com/.default",
+        }, timeout=30)
+        return r.json() if r.content else {"error_description": f"token: HTTP {r.status_code}"}
 
     def _headers(self):
         return {"Authorization": f"Bearer {self._token()}"}
 
+    # -------- HTTP (sessão com pool keep-alive) --------
+    def _http(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    adapter = TimedHTTPAdapter(
+                        pool_connections=self.pool_connections,
+                        pool_maxsize=self.pool_maxsize,
+                        pool_block=self.pool_block,
+                    )
+                    s = requests.Session()
+                    s.mount("https://", adapter)
+                    s.mount("http://", adapter)
+                    self._session = s
+        return self._session
+
+    def _request(self, method: str, url: str, retry: bool = True,
+                 op: str = "graph", path: str | None = None, **kw) -> requests.Response:
+        """
+        Envia pela sessão compartilhada aplicando a política de retry e o
+        circuit breaker do endpoint. Devolve a última resposta (o chamador
+        decide com raise_for_status); CircuitOpenError se o circuito está aberto.
+        `op` e `path` só rotulam o RequestEvent entregue aos hooks.
+        """
+        endpoint = endpoint_key(method, url)
+        if not self._hooks:
+            return self._send(method, url, endpoint, retry, [0], **kw)
+
+        started_at, t0 = time.time(), time.perf_counter()
+        attempts = [0]
+        reset_timing()
+        try:
+            r = self._send(method, url, endpoint, retry, attempts, **kw)
+        except Exception as e:
+            self._emit(request_event(op, method, endpoint, path, None, started_at,
+                                     time.perf_counter() - t0, attempts[0], error=e))
+            raise
+        stream = kw.get("stream", False)
+        ev = request_event(op, method, endpoint, path, r, started_at, time.perf_counter() - t0,
+                           attempts[0], stream=stream)
+        if stream:
+            r.sp_event = ev                 # _stream_content completa bytes_in/total e emite
+        else:
+            self._emit(ev)
+        return r
+
+    def _send(self, method: str, url: str, endpoint: str, retry: bool, attempts: list, **kw) -> requests.Response:
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            attempts[0] = attempt
+            self.circuit_breaker.before(endpoint)
+            with self._lock:
+                self._n_requests += 1
+            try:
+                r = self._http().request(method, url, **kw)
+            except (requests.ConnectionError, requests.Timeout):
+                self.circuit_breaker.failure(endpoint)
+                if not (retry and policy.should_retry_error(method) and attempt + 1 < policy.max_attempts):
+                    raise
+                policy.sleep(policy.delay(attempt))
+                attempt += 1
+                continue
+            except requests.RequestException:
+                # ex: ChunkedEncodingError: falha do lado do servidor/rede, sem retry
+                self.circuit_breaker.failure(endpoint)
+                raise
+            except BaseException:
+                # qualquer outra exceção: a chamada de teste do meio-aberto não pode ficar presa
+                self.circuit_breaker.release(endpoint)
+                raise
+
+            if r.status_code in policy.retry_statuses:
+                wait = retry_after_seconds(r)
+                self.circuit_breaker.failure(endpoint, wait)
+                if retry and policy.should_retry_status(method, r.status_code) and attempt + 1 < policy.max_attempts:
+                    r.close()
+                    policy.sleep(policy.delay(attempt, wait))
+                    attempt += 1
+                    continue
+                return r
+
+            self.circuit_breaker.success(endpoint)
+            return r
+
+    # -------- Métricas --------
+    def add_hook(self, hook):
+        """Registra hook(RequestEvent); exceções do hook são registradas e ignoradas."""
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+        return hook
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    def _emit(self, ev):
+        for hook in self._hooks:
+            try:
+                hook(ev)
+            except Exception:
+                logger.exception("Hook de métricas falhou")
+
+    def _record_cache(self, path: str, hit: bool):
+        self._cache.record(hit)
+        if self._hooks:
+            self._emit(cache_event("download", self.normalize_path(path), hit))
+
+    def pool_stats(self) -> dict:
+        """
+        Métricas de reaproveitamento de conexões (por host e totais).
+          - connections: conexões TCP/TLS abertas
+          - requests: requisições feitas pelo pool
+          - reused: requisições que reaproveitaram uma conexão já aberta
+        """
+        hosts = {}
+        with self._lock:
+            total = self._n_requests
+            session = self._session
+        if session is not None:
+            for adapter in set(session.adapters.values()):
+                pools = getattr(adapter, "poolmanager", None)
+                if pools is None:
+                    continue
+                for key in list(pools.pools.keys()):
+                    pool = pools.pools.get(key)
+                    if pool is None:
+                        continue
+                    h = f"{pool.scheme}://{pool.host}:{pool.port}"
+                    st_ = hosts.setdefault(h, {"connections": 0, "requests": 0})
+                    st_["connections"] += pool.num_connections
+                    st_["requests"] += pool.num_requests
+        for st_ in hosts.values():
+            st_["reused"] = max(st_["requests"] - st_["connections"], 0)
+        conns = sum(h["connections"] for h in hosts.values())
+        reqs = sum(h["requests"] for h in hosts.values())
+        return {
+            "requests": total,
+            "connections": conns,
+            "reused": max(reqs - conns, 0),
+            "reuse_ratio": (reqs - conns) / reqs if reqs else 0.0,
+            "hosts": hosts,
+        }
+
+    def close(self):
+        for w in self._watchers:
+            w.stop()
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
     # -------- Modo --------
     @property
     def is_onedrive(self) -> bool:
         return bool(self.user_upn)
 
+    # -------- $batch --------
+    def batch(self) -> GraphBatch:
+        """Novo lote de requisições (até 20 por ida ao /$batch; ver sp_batch)."""
+        return GraphBatch(self._send_batch, self.graph, retry_policy=self.retry_policy)
+
+    def _send_batch(self, reqs: list) -> list:
+        r = self._request("POST", f"{self.graph}/$batch", op="batch", headers=self._headers(),
+                          json={"requests": reqs}, timeout=60)
+        r.raise_for_status()
+        return r.json().get("responses", [])
+
     # -------- Descoberta (apenas p/ SharePoint Site) --------
     def _site_id(self):
         if self.is_onedrive:
             return None
-        if self._site_id_cache:
-            return self._site_id_cache
-        url = f"{GRAPH}/sites/{self.hostname}:/{self.site_path}"
-        r = requests.get(url, headers=self._headers(), timeout=30)
-        r.raise_for_status()
-        self._site_id_cache = r.json()["id"]
+        if not self._site_id_cache:
+            self._discover()
         return self._site_id_cache
 
     def _drive_id(self):
         if self.is_onedrive:
             return None
-        if self._drive_id_cache:
-            return self._drive_id_cache
-        url = f"{GRAPH}/sites/{self._site_id()}/drives"
-        r = requests.get(url, headers=self._headers(), timeout=30)
-        r.raise_for_status()
-        drives = r.json().get("value", [])
-        for d in drives:
-            if d.get("name", "").lower() == self.library_name.lower():
-                self._drive_id_cache = d["id"]
-                return self._drive_id_cache
-        for d in drives:
-            if d.get("driveType") == "documentLibrary":
-                self._drive_id_cache = d["id"]
-                return self._drive_id_cache
-        raise RuntimeError(f"Biblioteca '{self.library_name}' não encontrada em {self.site_path}")
+        if not self._drive_id_cache:
+            self._discover()
+        return self._drive_id_cache
+
+    def _discover(self):
+        """
+        Site e bibliotecas numa única ida ao Graph: as bibliotecas são
+        endereçadas pelo caminho do site, sem esperar o id dele.
+        Os ids resolvidos ficam no IdStore para os próximos processos.
+        """
+        site_key = f"site|{self.tenant_id}|{self.hostname}|{self.site_path}"
+        drive_key = f"drive|{site_key}|{self.library_name.lower()}"
+        site_id, drive_id = self._ids.get(site_key), self._ids.get(drive_key)
+        if site_id and drive_id:
+            with self._lock:
+                self._site_id_cache, self._drive_id_cache = site_id, drive_id
+                self._drive_from_store = True
+            return
+
+        site_url = f"/sites/{self.hostname}:/{self.site_path}"
+        b = self.batch()
+        f_site = b.add("GET", site_url)
+        f_drives = b.add("GET", f"{site_url}:/drives")
+        b.execute()
+        site = f_site.result().body
+        drives = f_drives.result().body.get("value", [])
+        with self._lock:
+            self._site_id_cache = site["id"]
+            self._drive_id_cache = _pick_drive(drives, self.library_name)
+            self._drive_from_store = False
+        if not self._drive_id_cache:
+            raise RuntimeError(f"Biblioteca '{self.library_name}' não encontrada em {self.site_path}")
+        self._ids.put(site_key, self._site_id_cache)
+        self._ids.put(drive_key, self._drive_id_cache)
+
+    def _forget_discovery(self):
+        """Descarta site/drive vindos do disco (o Graph recusou) para redescobrir."""
+        site_key = f"site|{self.tenant_id}|{self.hostname}|{self.site_path}"
+        self._ids.forget(site_key)
+        self._ids.forget(f"drive|{site_key}|{self.library_name.lower()}")
+        with self._lock:
+            self._site_id_cache = self._drive_id_cache = None
+            self._drive_from_store = False
 
     # -------- Normalização de caminho --------
     def normalize_path(self, path: str) -> str:
@@ -122,38 +408,467 @@ class SPConnector:
                 return path[len(prefix):]
             return path
 
-    # -------- Download / Upload --------
-    def download(self, path: str) -> bytes:
-        rel = quote(self.normalize_path(path), safe="/")
+    # -------- URLs --------
+    def _drive_url(self) -> str:
         if self.is_onedrive:
-            url = f"{GRAPH}/users/{self.user_upn}/drive/root:/{rel}:/content"
-        else:
-            url = f"{GRAPH}/drives/{self._drive_id()}/root:/{rel}:/content"
-        r = requests.get(url, headers=self._headers(), timeout=180)
+            return f"{self.graph}/users/{self.user_upn}/drive"
+        return f"{self.graph}/drives/{self._drive_id()}"
+
+    def _item_url(self, path: str) -> str:
+        rel = quote(self.normalize_path(path), safe="/")
+        return f"{self._drive_url()}/root:/{rel}:"
+
+    def _item_key(self, path: str) -> str:
+        return f"item|{self._drive_url()}|{self.normalize_path(path)}"
+
+    def _item_ref(self, path: str) -> tuple[str, bool]:
+        """URL do item pelo id já conhecido (sem resolver caminho no servidor) ou pelo caminho."""
+        item_id = self._ids.get(self._item_key(path))
+        if item_id:
+            return f"{self._drive_url()}/items/{item_id}", True
+        return self._item_url(path), False
+
+    def _remember_item(self, path: str, item: dict):
+        if item and item.get("id"):
+            self._ids.put(self._item_key(path), item["id"])
+        self._drive_from_store = False
+
+    def _stale_ref(self, path: str, by_id: bool) -> bool:
+        """
+        Um 404 pode ser id guardado que não vale mais (arquivo substituído,
+        biblioteca recriada). Esquece o que veio do disco; True = vale tentar de novo.
+        """
+        retry = False
+        if by_id:
+            self._ids.forget(self._item_key(path))
+            retry = True
+        if self._drive_from_store and not self.is_onedrive:
+            self._forget_discovery()
+            retry = True
+        return retry
+
+    # -------- Metadados --------
+    _SELECT = "id,name,eTag,cTag,size,file,lastModifiedDateTime"
+
+    def stat(self, path: str, etag: str | None = None) -> dict | None:
+        """
+        Metadados do driveItem (id, eTag, cTag, size, file.hashes).
+        Com `etag`, faz GET condicional: devolve None se o arquivo não mudou (304).
+        """
+        for _ in range(2):
+            headers = self._headers()
+            if etag:
+                headers["If-None-Match"] = etag
+            url, by_id = self._item_ref(path)
+            r = self._request("GET", url, op="stat", path=path, headers=headers,
+                              params={"$select": self._SELECT}, timeout=30)
+            if r.status_code == 404 and self._stale_ref(path, by_id):
+                continue
+            break
+        if r.status_code == 304:
+            return None
+        if r.status_code == 404:
+            raise FileNotFoundError(path)
+        r.raise_for_status()
+        item = r.json()
+        self._remember_item(path, item)
+        return item
+
+    def stat_many(self, paths, etags: dict | None = None) -> dict:
+        """
+        Metadados de vários arquivos em uma ida ao /$batch (lotes de 20).
+        Devolve {caminho: driveItem | None (304, se etags[caminho] bateu) | exceção}.
+        """
+        etags = etags or {}
+        b = self.batch()
+        futures = {}
+        for p in dict.fromkeys(paths):
+            headers = {"If-None-Match": etags[p]} if etags.get(p) else None
+            url, by_id = self._item_ref(p)
+            futures[p] = (b.add("GET", f"{url}?$select={self._SELECT}", headers=headers), by_id)
+        b.execute()
+        out = {}
+        for p, (fut, by_id) in futures.items():
+            exc = fut.exception()
+            if isinstance(exc, GraphBatchError) and exc.status == 404:
+                if self._stale_ref(p, by_id):
+                    # id guardado não vale mais: resolve este pelo caminho
+                    try:
+                        out[p] = self.stat(p, etag=etags.get(p))
+                    except Exception as e:
+                        out[p] = e
+                    continue
+                exc = FileNotFoundError(p)
+            if exc is not None:
+                out[p] = exc
+            else:
+                res = fut.result()
+                out[p] = None if res.status == 304 else res.body
+                if res.status != 304:
+                    self._remember_item(p, res.body)
+        return out
+
+    # -------- Download / Upload --------
+    def download(self, path: str, use_cache: bool = True, max_age: float | None = None) -> bytes:
+        """
+        Conteúdo do arquivo. Com cache, só transfere o corpo se o eTag mudou.
+        max_age sobrepõe cache_max_age (0 = sempre revalida com o servidor).
+        """
+        if not use_cache or self._cache is None:
+            url, by_id = self._item_ref(path)
+            try:
+                return self._get_content(f"{url}/content", path)
+            except FileNotFoundError:
+                if not self._stale_ref(path, by_id):
+                    raise
+                return self._get_content(f"{self._item_url(path)}/content", path)
+        return self.download_with_etag(path, max_age=max_age)[0]
+
+    def download_with_etag(self, path: str, max_age: float | None = None) -> tuple[bytes, str]:
+        """
+        Como download(), mas devolve também o eTag da versão lida, para ser
+        usado depois como If-Match em upload_small().
+        """
+        hit, meta = self._revalidate(path, max_age)
+        if hit is not None:
+            return hit.data, hit.etag
+
+        # Baixa pelo id do item revalidado; se o arquivo mudar entre as duas
+        # chamadas, o eTag guardado fica "velho": a próxima leitura rebaixa e
+        # um If-Match com ele falha (PreconditionFailed) em vez de sobrescrever.
+        return self._fetch_body(path, meta), meta["eTag"]
+
+    def download_many(self, paths, max_workers: int | None = None,
+                      return_exceptions: bool = False) -> dict:
+        """
+        Baixa vários arquivos e devolve {caminho: bytes} na ordem recebida.
+          - Revalida todos os eTags do cache numa única ida ao /$batch.
+          - Só os corpos que mudaram são baixados, em paralelo (no máximo
+            `max_workers` por vez, padrão = pool_maxsize).
+        Com return_exceptions=True, a falha de um arquivo vira o valor dele
+        em vez de interromper os demais.
+        """
+        paths = list(dict.fromkeys(paths))
+        if not paths:
+            return {}
+
+        out, pending = {}, []
+        for p in paths:
+            hit = self._fresh_hit(p, self.cache_max_age)
+            if hit is not None:
+                out[p] = hit.data
+            else:
+                pending.append(p)
+
+        if pending:
+            hits = {p: self._cache.get(self.normalize_path(p)) if self._cache is not None else None for p in pending}
+            metas = self.stat_many(pending, {p: h.etag for p, h in hits.items() if h is not None})
+            to_fetch = []
+            for p in pending:
+                meta, hit = metas[p], hits[p]
+                if isinstance(meta, Exception):
+                    out[p] = meta
+                elif hit is not None and (meta is None or meta.get("eTag") == hit.etag):
+                    self._cache.touch(self.normalize_path(p))
+                    self._record_cache(p, True)
+                    out[p] = hit.data
+                else:
+                    to_fetch.append((p, meta))
+
+            if to_fetch:
+                workers = max(1, min(len(to_fetch), max_workers or self.pool_maxsize))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sp-download") as ex:
+                    futures = {p: ex.submit(self._fetch_body, p, meta) for p, meta in to_fetch}
+                for p, fut in futures.items():
+                    out[p] = fut.exception() or fut.result()
+
+        result = {}
+        for p in paths:
+            if isinstance(out[p], BaseException) and not return_exceptions:
+                raise out[p]
+            result[p] = out[p]
+        return result
+
+    def _fetch_body(self, path: str, meta: dict) -> bytes:
+        data = self._get_content(self._content_url(meta), path)
+        if self._cache is not None:
+            self._cache.put(self.normalize_path(path), meta["eTag"], data)
+            self._record_cache(path, False)
+        return data
+
+    def download_stream(self, path: str, chunk_size: int = 1024 * 1024):
+        """
+        Gerador com o conteúdo em blocos de até `chunk_size` bytes, para quem
+        só repassa os bytes (o corpo inteiro nunca fica em memória).
+        Acertos de cache são servidos do cache; downloads não o alimentam.
+        """
+        hit, meta = self._revalidate(path)
+        if hit is not None:
+            view = memoryview(hit.data)
+            for i in range(0, len(view), chunk_size):
+                yield view[i:i + chunk_size]
+            return
+        yield from self._stream_content(self._content_url(meta), path, chunk_size)
+
+    def open(self, path: str, spool_max_size: int = 8 * 1024 * 1024, chunk_size: int = 1024 * 1024):
+        """
+        Arquivo binário somente-leitura (posicionado no início) com o conteúdo.
+        O download é gravado em blocos num SpooledTemporaryFile: até
+        `spool_max_size` fica em memória (e alimenta o cache), acima disso vai
+        para disco. Use com `with`.
+        """
+        hit, meta = self._revalidate(path)
+        if hit is not None:
+            return io.BytesIO(hit.data)     # sem cópia: BytesIO compartilha o buffer
+
+        f = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+        try:
+            for chunk in self._stream_content(self._content_url(meta), path, chunk_size):
+                f.write(chunk)
+            size = f.tell()
+            f.seek(0)
+        except BaseException:
+            f.close()
+            raise
+        if self._cache is not None and size <= spool_max_size:
+            data = f.read()
+            f.close()
+            self._cache.put(self.normalize_path(path), meta["eTag"], data)
+            self._record_cache(path, False)
+            return io.BytesIO(data)
+        return f
+
+    def _revalidate(self, path: str, max_age: float | None = None):
+        """
+        (entrada, None) se o cache pode responder; (None, metadados) se o
+        corpo precisa ser baixado.
+        """
+        max_age = self.cache_max_age if max_age is None else max_age
+        fresh = self._fresh_hit(path, max_age)
+        if fresh is not None:
+            return fresh, None
+
+        key = self.normalize_path(path)
+        hit = self._cache.get(key) if self._cache is not None else None
+        meta = self.stat(path, etag=hit.etag if hit else None)
+        if hit is not None and (meta is None or meta.get("eTag") == hit.etag):
+            self._cache.touch(key)
+            self._record_cache(path, True)
+            return hit, None
+        return None, meta
+
+    def _fresh_hit(self, path: str, max_age: float):
+        """Entrada do cache validada há menos de max_age segundos (sem ir ao Graph)."""
+        if self._cache is None:
+            return None
+        key = self.normalize_path(path)
+        hit = self._cache.get(key)
+        if hit is not None and self._cache.is_fresh(key, max_age):
+            self._record_cache(path, True)
+            return hit
+        return None
+
+    def _content_url(self, meta: dict) -> str:
+        return f"{self._drive_url()}/items/{meta['id']}/content"
+
+    def _get_content(self, url: str, path: str) -> bytes:
+        r = self._request("GET", url, op="download", path=path, headers=self._headers(), timeout=180)
         if r.status_code == 404:
             raise FileNotFoundError(path)
         r.raise_for_status()
         return r.content
 
-    def upload_small(self, path: str, content: bytes, overwrite: bool = True):
-        rel = quote(self.normalize_path(path), safe="/")
+    def _stream_content(self, url: str, path: str, chunk_size: int):
+        r = self._request("GET", url, op="download", path=path, headers=self._headers(),
+                          timeout=180, stream=True)
+        received = 0
+        try:
+            if r.status_code == 404:
+                raise FileNotFoundError(path)
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size):
+                received += len(chunk)
+                yield chunk
+        finally:
+            r.close()
+            ev = getattr(r, "sp_event", None)
+            if ev is not None:
+                self._emit(ev._replace(bytes_in=received, total=time.time() - ev.started_at))
+
+    def upload_small(self, path: str, content: bytes, overwrite: bool = True, if_match: str | None = None):
+        """
+        PUT simples do conteúdo. Com `if_match` (eTag lido antes), o Graph só
+        aceita a gravação se o arquivo ainda estiver naquela versão; senão
+        levanta PreconditionFailed.
+        Conteúdos acima de 4 MB vão automaticamente por upload_large().
+        """
+        if len(content) > SIMPLE_UPLOAD_MAX:
+            return self.upload_large(path, content, overwrite=overwrite, if_match=if_match)
         params = {"@microsoft.graph.conflictBehavior": "replace" if overwrite else "fail"}
-        if self.is_onedrive:
-            url = f"{GRAPH}/users/{self.user_upn}/drive/root:/{rel}:/content"
-        else:
-            url = f"{GRAPH}/drives/{self._drive_id()}/root:/{rel}:/content"
-        r = requests.put(url, headers=self._headers(), params=params, data=content, timeout=300)
+        url = f"{self._item_url(path)}/content"
+        headers = self._headers()
+        if if_match:
+            headers["If-Match"] = if_match
+        r = self._request("PUT", url, op="upload", path=path, headers=headers, params=params,
+                          data=content, timeout=300)
+        if r.status_code == 412 or (if_match and r.status_code == 409):
+            raise PreconditionFailed(path, if_match)
         r.raise_for_status()
-        return r.json()
+        return self._uploaded(path, content, r.json())
+
+    def upload_large(self, path: str, content: bytes, overwrite: bool = True,
+                     if_match: str | None = None, chunk_size: int | None = None, max_resumes: int = 5):
+        """
+        Upload em fragmentos via upload session do Graph (sem limite de 4 MB).
+          - O If-Match vai na criação da sessão: mesma semântica de upload_small().
+          - Os fragmentos são enviados em ordem (exigência do Graph para
+            OneDrive/SharePoint: fora de ordem a sessão responde erro).
+          - Se um fragmento cair (rede/5xx), consulta nextExpectedRanges da
+            sessão e retoma dali; se a sessão expirou (404), abre outra.
+        """
+        chunk_size = chunk_size or self.upload_chunk_size
+        if chunk_size % CHUNK_ALIGN:
+            raise ValueError(f"chunk_size precisa ser múltiplo de {CHUNK_ALIGN} bytes.")
+        total = len(content)
+        resumes = 0
+        upload_url = self._create_upload_session(path, overwrite, if_match)
+        offset = 0
+        try:
+            while True:
+                end = min(offset + chunk_size, total) - 1
+                try:
+                    # sem retry genérico: a retomada abaixo já cobre fragmentos perdidos
+                    r = self._request(
+                        "PUT", upload_url, retry=False, op="upload_fragment", path=path,
+                        data=content[offset:end + 1], timeout=300,
+                        headers={
+                            "Content-Length": str(end - offset + 1),
+                            "Content-Range": f"bytes {offset}-{end}/{total}",
+                        },
+                    )
+                except (requests.ConnectionError, requests.Timeout):
+                    r = None
+
+                if r is not None and r.status_code in (200, 201):
+                    upload_url = None
+                    return self._uploaded(path, content, r.json())
+                if r is not None and r.status_code == 202:
+                    offset = _next_expected(r.json(), end + 1)
+                    continue
+                if r is not None and (r.status_code == 412 or (if_match and r.status_code == 409)):
+                    raise PreconditionFailed(path, if_match)
+                if r is not None and r.status_code < 500 and r.status_code not in (404, 416, 429):
+                    r.raise_for_status()
+
+                # Fragmento perdido: pergunta à sessão onde retomar
+                resumes += 1
+                if resumes > max_resumes:
+                    if r is not None:
+                        r.raise_for_status()
+                    raise RuntimeError(f"Upload de '{path}' interrompido após {max_resumes} retomadas.")
+                st_ = self._request("GET", upload_url, op="upload_session", path=path, timeout=30)
+                if st_.status_code == 404:
+                    upload_url = self._create_upload_session(path, overwrite, if_match)
+                    offset = 0
+                else:
+                    st_.raise_for_status()
+                    offset = _next_expected(st_.json(), offset)
+        finally:
+            if upload_url:
+                # Falhou de vez: descarta a sessão para não deixar fragmentos pendurados
+                try:
+                    self._request("DELETE", upload_url, retry=False, op="upload_session", path=path, timeout=30)
+                except requests.RequestException:
+                    pass
+
+    def _create_upload_session(self, path: str, overwrite: bool, if_match: str | None) -> str:
+        headers = self._headers()
+        if if_match:
+            headers["If-Match"] = if_match
+        body = {"item": {"@microsoft.graph.conflictBehavior": "replace" if overwrite else "fail"}}
+        r = self._request("POST", f"{self._item_url(path)}/createUploadSession",
+                          op="upload_session", path=path, headers=headers, json=body, timeout=30)
+        if r.status_code == 412 or (if_match and r.status_code == 409):
+            raise PreconditionFailed(path, if_match)
+        r.raise_for_status()
+        return r.json()["uploadUrl"]
+
+    def _uploaded(self, path: str, content: bytes, item: dict) -> dict:
+        self._remember_item(path, item)
+        if self._cache is not None and item.get("eTag"):
+            # o que acabamos de enviar é a versão atual: próxima leitura não baixa de novo
+            self._cache.put(self.normalize_path(path), item["eTag"], content)
+        return item
+
+    def mark_stale(self, path: str):
+        if self._cache is not None:
+            self._cache.mark_stale(self.normalize_path(path))
+
+    # -------- Excel (workbook) --------
+    def workbook(self, path: str, persist_changes: bool = True) -> WorkbookSession:
+        """Sessão da API de workbook sobre o arquivo (ver sp_workbook). Use com `with`."""
+        return WorkbookSession(self, path, persist_changes).open()
+
+    # -------- Listas do SharePoint --------
+    def sharepoint_list(self, name: str, page_size: int = 500, tz: str | None = None) -> SharePointList:
+        """Lista do site (pelo nome ou id) com filtro/paginação no servidor (ver sp_lists)."""
+        return SharePointList(self, name, page_size, tz=tz)
+
+    # -------- Mudanças remotas (delta) --------
+    def watch(self, paths, on_change, interval: float = 30.0) -> DeltaWatcher:
+        """
+        Inicia um thread que consulta o delta do drive a cada `interval`
+        segundos e chama on_change(caminhos_alterados) quando algum dos
+        `paths` muda. O token delta fica em cache_dir (se houver).
+        Não acessa a rede: a descoberta do drive fica para o thread.
+        """
+        token_file = None
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # nome pela configuração do drive (e não pelo id dele, que exigiria a descoberta)
+            drive = self.user_upn or f"{self.tenant_id}|{self.hostname}|{self.site_path}|{self.library_name.lower()}"
+            h = hashlib.sha1(f"{self.graph}|{drive}".encode("utf-8")).hexdigest()
+            token_file = os.path.join(self.cache_dir, f"delta-{h}.json")
+        w = DeltaWatcher(self, paths, on_change, interval=interval, token_file=token_file)
+        self._watchers.append(w)
+        return w.start()
+
+    def cache_stats(self) -> dict:
+        return self._cache.stats() if self._cache is not None else {}
+
+    def invalidate_cache(self, path: str | None = None):
+        if self._cache is not None:
+            self._cache.invalidate(self.normalize_path(path) if path else None)
 
     # -------- Conveniências DataFrame --------
     def read_excel(self, path: str, **kw) -> pd.DataFrame:
-        return pd.read_excel(io.BytesIO(self.download(path)), **kw)
+        with self.open(path) as f:
+            return pd.read_excel(f, **kw)
 
     def read_csv(self, path: str, **kw) -> pd.DataFrame:
-        return pd.read_csv(io.BytesIO(self.download(path)), **kw)
+        with self.open(path) as f:
+            return pd.read_csv(f, **kw)
+
+    def write_excel(self, df: pd.DataFrame, path: str, overwrite: bool = True, if_match: str | None = None,
+                    table_name: str | None = None):
+        """Grava o DataFrame como .xlsx; com table_name, os dados ficam numa tabela do Excel."""
+        return self.upload_small(path, to_xlsx_bytes(df, table_name), overwrite=overwrite, if_match=if_match)
+
+
+def _pick_drive(drives: list, library_name: str):
+    """Biblioteca pelo nome; senão, a primeira documentLibrary do site."""
+    for d in drives:
+        if d.get("name", "").lower() == library_name.lower():
+            return d["id"]
+    for d in drives:
+        if d.get("driveType") == "documentLibrary":
+            return d["id"]
+    return None
+
 
-    def write_excel(self, df: pd.DataFrame, path: str, overwrite: bool = True):
-        bio = io.BytesIO()
-        df.to_excel(bio, index=False)
-        return self.upload_small(path, bio.getvalue(), overwrite=overwrite)
+def _next_expected(session: dict, default: int) -> int:
+    """Primeiro byte pendente segundo nextExpectedRanges (ex: ["26-", "40-49"])."""
+    ranges = session.get("nextExpectedRanges") or []
+    if not ranges:
+        return default
+    return int(str(ranges[0]).split("-")[0])
@@ -0,0 +1,167 @@
+# sp_delta.py
+"""
+Observador de mudanças da biblioteca via /drive/root/delta.
+
+Em vez de invalidar todos os caches a cada gravação, um thread em segundo
+plano consulta o feed delta do drive (só o que mudou desde o último token) e
+avisa quais dos caminhos observados foram alterados. O deltaLink é persistido
+em disco para que um reinício do processo continue de onde parou.
+
+A correspondência é feita pelo id do driveItem. Um arquivo substituído
+ganha id novo; aí vale o nome, mas só na mesma pasta: pelo
+parentReference.path quando o delta traz, ou (SharePoint/OneDrive for
+Business não traz) conferindo o id atual do caminho observado.
+"""
+import json, logging, os, posixpath, threading
+from urllib.parse import unquote
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaWatcher:
+    def __init__(self, sp, paths, on_change, interval: float = 30.0, token_file: str | None = None):
+        self._sp = sp
+        self.paths = list(dict.fromkeys(paths))
+        self.on_change = on_change            # on_change(set_de_caminhos), chamado no thread do watcher
+        self.interval = interval
+        self.token_file = token_file
+        self._delta_link = self._load_token()
+        self._ids: dict[str, str] = {}        # driveItem id -> caminho observado
+        self._names: dict[str, list] = {}     # nome do arquivo -> [(pasta, caminho observado)]
+        for p in self.paths:
+            folder, name = posixpath.split(sp.normalize_path(p).strip("/").lower())
+            self._names.setdefault(name, []).append((folder, p))
+        self._stop = threading.Event()
+        self._poll_lock = threading.Lock()
+        self._thread = None
+        self.last_error = None
+
+    # -------- Ciclo de vida --------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sp-delta", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:          # o watcher nunca derruba o app
+                self.last_error = e
+                logger.warning("Falha ao consultar o delta do drive: %s", e)
+            self._stop.wait(self.interval)
+
+    # -------- Consulta --------
+    def poll(self) -> set:
+        """Consulta o delta agora; devolve (e notifica) os caminhos alterados."""
+        with self._poll_lock:
+            if not self._ids:
+                self._resolve_ids()
+            if self._delta_link is None:
+                # Primeira execução: só marca o ponto de partida
+                self._delta_link = self._fetch(f"{self._sp._drive_url()}/root/delta?token=latest")[1]
+                self._save_token()
+                return set()
+
+            try:
+                items, link = self._fetch(self._delta_link)
+            except _ResyncRequired:
+                # Token expirou (410): não dá para saber o que mudou -> tudo
+                self._delta_link = None
+                self._ids.clear()
+                changed = set(self.paths)
+            else:
+                self._delta_link = link
+                changed = self._match(items)
+            self._save_token()
+
+        if changed:
+            for p in changed:
+                self._sp.mark_stale(p)     # força revalidar o eTag na próxima leitura
+            self.on_change(changed)
+        return changed
+
+    def _fetch(self, url: str):
+        items = []
+        while True:
+            r = self._sp._request("GET", url, op="delta", headers=self._sp._headers(), timeout=60)
+            if r.status_code == 410:
+                raise _ResyncRequired()
+            r.raise_for_status()
+            data = r.json()
+            items.extend(data.get("value", []))
+            if "@odata.nextLink" in data:
+                url = data["@odata.nextLink"]
+                continue
+            return items, data.get("@odata.deltaLink")
+
+    def _match(self, items: list) -> set:
+        changed, renamed, unverified = set(), False, []
+        for it in items:
+            p = self._ids.get(it.get("id"))
+            if p is not None:
+                changed.add(p)
+                continue
+            same_name = self._names.get((it.get("name") or "").lower())
+            if not same_name:
+                continue
+            parent = _parent_path(it)
+            if parent is None:
+                unverified.append(it.get("id"))     # sem caminho no delta: confere pelo id
+                continue
+            hits = {p for folder, p in same_name if folder == parent}
+            changed |= hits
+            renamed = renamed or bool(hits)
+        if renamed or unverified:
+            self._resolve_ids()
+            changed.update(self._ids[i] for i in unverified if i in self._ids)
+        return changed
+
+    def _resolve_ids(self):
+        ids = {}
+        for p, meta in self._sp.stat_many(self.paths).items():
+            if isinstance(meta, dict) and meta.get("id"):
+                ids[meta["id"]] = p
+        self._ids = ids
+
+    # -------- Token persistido --------
+    def _load_token(self):
+        if not self.token_file:
+            return None
+        try:
+            with open(self.token_file, encoding="utf-8") as f:
+                return json.load(f).get("deltaLink")
+        except (OSError, ValueError):
+            return None
+
+    def _save_token(self):
+        if not self.token_file:
+            return
+        tmp = f"{self.token_file}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"deltaLink": self._delta_link}, f)
+            os.replace(tmp, self.token_file)
+        except OSError as e:
+            logger.warning("Não foi possível gravar o token delta: %s", e)
+
+
+def _parent_path(item: dict) -> str | None:
+    """Pasta do item (relativa à raiz do drive, minúscula) pelo parentReference.path, se houver."""
+    path = (item.get("parentReference") or {}).get("path")
+    if not path:
+        return None
+    _, sep, rest = path.partition("root:")
+    return unquote(rest).strip("/").lower() if sep else None
+
+
+class _ResyncRequired(requests.RequestException):
+    pass
@@ -0,0 +1,18 @@
+# sp_errors.py
+"""
+Exceções do conector compartilhadas entre os módulos sp_* e storage.py.
+
+Sem dependências: sp_connector importa sp_lists/sp_workbook, e estes (ou
+storage.py) precisam das mesmas exceções sem importar o conector de volta.
+sp_connector reexporta tudo daqui (from sp_connector import PreconditionFailed
+continua valendo).
+"""
+
+
+class PreconditionFailed(Exception):
+    """O arquivo mudou no servidor desde a leitura (If-Match não bateu: 412/409)."""
+
+    def __init__(self, path: str, etag: str | None):
+        super().__init__(f"'{path}' foi alterado por outra gravação (eTag esperado: {etag})")
+        self.path = path
+        self.etag = etag
@@ -0,0 +1,298 @@
+# sp_lists.py
+"""
+Listas do SharePoint via Graph (/sites/{site}/lists/{lista}/items).
+
+Alternativa ao .xlsx para dados que crescem: cada registro é um item da
+lista, o filtro roda no servidor ($filter), a leitura vem em páginas
+($top + @odata.nextLink) e uma alteração é um PATCH só nos campos do item.
+
+    lst = sp.sharepoint_list("Apontamentos")
+    df = lst.to_dataframe(filter={"Código do Estudo": "EST-001", "Status": "PENDENTE"})
+    lst.create({"ID": "1AB23", "Status": "PENDENTE"})
+    lst.update(item_id, {"Status": "REALIZADO"})
+
+Os campos são tratados pelo nome de exibição das colunas; o nome interno
+(ex: C_x00f3_digo_x0020_do_x0020_Estudo) é resolvido por columns(). As
+colunas usadas em filtro devem ser indexadas na lista: acima de 5.000 itens
+o SharePoint recusa filtro em coluna sem índice.
+
+ListExportJob regrava periodicamente a lista como .xlsx (com tabela), para
+quem consome a planilha.
+"""
+import logging, threading
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+from urllib.parse import quote
+
+import pandas as pd
+
+from sp_errors import PreconditionFailed
+from sp_workbook import _cell, to_xlsx_bytes
+
+logger = logging.getLogger(__name__)
+
+ITEM_ID = "_item_id"        # coluna com o id do item da lista nos DataFrames
+ITEM_ETAG = "_etag"
+
+
+class SharePointList:
+    def __init__(self, sp, name: str, page_size: int = 500, tz: str | None = None):
+        if sp.is_onedrive:
+            raise ValueError("Listas só existem em sites do SharePoint (não no OneDrive).")
+        self._sp = sp
+        self.name = name
+        self.page_size = page_size
+        # fuso das datas sem fuso do app (None = o da máquina); a lista guarda em UTC
+        self.tz = ZoneInfo(tz) if tz else None
+        self._columns = None
+
+    def _url(self) -> str:
+        return f"{self._sp.graph}/sites/{self._sp._site_id()}/lists/{quote(self.name)}"
+
+    def _get(self, url: str, **kw):
+        headers = self._sp._headers()
+        # sem isso o Graph recusa $filter em coluna não indexada (mesmo em listas pequenas)
+        headers["Prefer"] = "HonorNonIndexedQueriesWarningMayFailRandomly"
+        r = self._sp._request("GET", url, op="list", headers=headers, timeout=60, **kw)
+        if r.status_code == 404:
+            raise FileNotFoundError(f"Lista '{self.name}'")
+        r.raise_for_status()
+        return r.json()
+
+    # -------- Colunas --------
+    def columns(self) -> dict:
+        """{nome de exibição: {"name": nome interno, "type": "dateTime" | "number" | "boolean" | "text"}}."""
+        if self._columns is None:
+            data = self._get(f"{self._url()}/columns")
+            cols = {}
+            for c in data.get("value", []):
+                kind = next((k for k in ("dateTime", "number", "boolean") if k in c), "text")
+                cols[c.get("displayName") or c["name"]] = {"name": c["name"], "type": kind,
+                                                           "readOnly": c.get("readOnly", False)}
+            self._columns = cols
+        return self._columns
+
+    def _internal(self, field: str) -> str:
+        col = self.columns().get(field)
+        if col is None:
+            raise KeyError(f"Coluna '{field}' não existe na lista '{self.name}'")
+        return col["name"]
+
+    # -------- Leitura --------
+    def filter_expr(self, filter: dict | None) -> str | None:
+        """{"Status": "PENDENTE", "Código do Estudo": ["A", "B"]} -> expressão OData (igualdade / "ou")."""
+        if not filter:
+            return None
+        parts = []
+        for field, value in filter.items():
+            name = f"fields/{self._internal(field)}"
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            ors = [f"{name} eq {_literal(v)}" for v in values]
+            parts.append(ors[0] if len(ors) == 1 else "(" + " or ".join(ors) + ")")
+        return " and ".join(parts)
+
+    def page(self, filter: dict | None = None, select=None, page_size: int | None = None,
+             cursor: str | None = None, orderby: str | None = None) -> tuple[list, str | None]:
+        """
+        Uma página de itens e o cursor da próxima (o @odata.nextLink; None no fim).
+        Passe o cursor devolvido para continuar; os demais argumentos só valem
+        na primeira página.
+        """
+        if cursor:
+            data = self._get(cursor)
+        else:
+            params = {"$top": page_size or self.page_size}
+            fields = [self._internal(f) for f in select] if select else None
+            params["$expand"] = f"fields($select={','.join(fields)})" if fields else "fields"
+            expr = self.filter_expr(filter)
+            if expr:
+                params["$filter"] = expr
+            if orderby:
+                params["$orderby"] = orderby
+            data = self._get(f"{self._url()}/items", params=params)
+        return [self._record(it) for it in data.get("value", [])], data.get("@odata.nextLink")
+
+    def items(self, filter: dict | None = None, select=None, top: int | None = None, orderby: str | None = None):
+        """Gerador com todos os itens (segue o nextLink); `top` limita o total."""
+        n, cursor = 0, None
+        while True:
+            rows, cursor = self.page(filter, select, cursor=cursor, orderby=orderby,
+                                     page_size=min(self.page_size, top) if top else None)
+            for row in rows:
+                yield row
+                n += 1
+                if top and n >= top:
+                    return
+            if not cursor:
+                return
+
+    def to_dataframe(self, filter: dict | None = None, select=None, top: int | None = None,
+                     columns=None) -> pd.DataFrame:
+        """
+        Itens como DataFrame com os nomes de exibição (+ _item_id e _etag).
+        `columns` fixa as colunas (e a ordem) mesmo sem itens.
+        """
+        df = pd.DataFrame(list(self.items(filter, select, top)))
+        if columns is not None:
+            df = df.reindex(columns=list(columns) + [ITEM_ID, ITEM_ETAG])
+        for field, col in self.columns().items():
+            if col["type"] == "dateTime" and field in df.columns:
+                df[field] = (pd.to_datetime(df[field], errors="coerce", utc=True)
+                             .dt.tz_convert(self.tz or _local_tz()).dt.tz_localize(None))
+        return df
+
+    def _record(self, item: dict) -> dict:
+        by_internal = {c["name"]: disp for disp, c in self.columns().items()}
+        rec = {by_internal.get(k, k): v for k, v in (item.get("fields") or {}).items()
+               if k in by_internal and not k.startswith("@")}
+        rec[ITEM_ID] = item.get("id")
+        rec[ITEM_ETAG] = item.get("eTag")
+        return rec
+
+    def find_ids(self, field: str, values) -> dict:
+        """{valor: id do item} para os itens com field == valor (uma ida ao /$batch)."""
+        b = self._sp.batch()
+        name = self._internal(field)
+        headers = {"Prefer": "HonorNonIndexedQueriesWarningMayFailRandomly"}
+        futures = {v: b.add("GET", f"{self._url()}/items?$select=id&$expand=fields($select={name})"
+                                   f"&$filter={quote(f'fields/{name} eq {_literal(v)}')}", headers=headers)
+                   for v in dict.fromkeys(values)}
+        b.execute()
+        out = {}
+        for v, fut in futures.items():
+            found = fut.result().body.get("value", [])
+            if found:
+                out[v] = found[0]["id"]
+        return out
+
+    def last_modified(self) -> str | None:
+        """lastModifiedDateTime da lista (muda a cada item incluído/alterado)."""
+        return self._get(self._url(), params={"$select": "lastModifiedDateTime"}).get("lastModifiedDateTime")
+
+    # -------- Escrita --------
+    def _fields(self, values: dict) -> dict:
+        out = {}
+        for field, v in values.items():
+            if field in (ITEM_ID, ITEM_ETAG):
+                continue
+            col = self.columns().get(field)
+            if col is None:
+                raise KeyError(f"Coluna '{field}' não existe na lista '{self.name}'")
+            out[col["name"]] = _field_value(v, col["type"], self.tz)
+        return out
+
+    def create(self, values: dict) -> dict:
+        r = self._sp._request("POST", f"{self._url()}/items", op="list", headers=self._sp._headers(),
+                              json={"fields": self._fields(values)}, timeout=60)
+        r.raise_for_status()
+        return self._record(r.json())
+
+    def create_many(self, rows) -> list:
+        """Inclui vários itens num /$batch (lotes de 20). Levanta a primeira falha."""
+        records = rows.to_dict("records") if isinstance(rows, pd.DataFrame) else list(rows)
+        b = self._sp.batch()
+        futures = [b.add("POST", f"{self._url()}/items", body={"fields": self._fields(rec)}) for rec in records]
+        b.execute()
+        return [self._record(f.result().body) for f in futures]
+
+    def update(self, item_id: str, values: dict, etag: str | None = None) -> dict:
+        """PATCH só dos campos informados. Com `etag`, falha (PreconditionFailed) se o item mudou."""
+        headers = self._sp._headers()
+        if etag:
+            headers["If-Match"] = etag
+        r = self._sp._request("PATCH", f"{self._url()}/items/{item_id}/fields", op="list",
+                              headers=headers, json=self._fields(values), timeout=60)
+        if r.status_code == 412:
+            raise PreconditionFailed(f"{self.name}/{item_id}", etag)
+        r.raise_for_status()
+        return r.json()
+
+    def update_many(self, updates: dict):
+        """{id do item: {campo: valor}} -> um PATCH por item, todos num /$batch."""
+        b = self._sp.batch()
+        futures = [b.add("PATCH", f"{self._url()}/items/{item_id}/fields", body=self._fields(values))
+                   for item_id, values in updates.items()]
+        b.execute()
+        for f in futures:
+            f.result()
+
+
+class ListExportJob:
+    """
+    Regrava a lista como .xlsx em `path` (com a tabela `table_name`) a cada
+    `interval` segundos, só quando a lista mudou desde a última exportação.
+    """
+
+    def __init__(self, sp_list: SharePointList, path: str, table_name: str | None = None,
+                 interval: float = 600.0, columns=None):
+        self.list = sp_list
+        self.path = path
+        self.table_name = table_name
+        self.interval = interval
+        self.columns = columns
+        self._exported = None              # lastModifiedDateTime da última exportação
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sp-list-export", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:          # a exportação nunca derruba o app
+                self.last_error = e
+                logger.warning("Falha ao exportar a lista '%s': %s", self.list.name, e)
+            self._stop.wait(self.interval)
+
+    def run_once(self, force: bool = False) -> bool:
+        """Exporta se a lista mudou (ou se force); devolve se exportou."""
+        stamp = self.list.last_modified()
+        if not force and stamp is not None and stamp == self._exported:
+            return False
+        df = self.list.to_dataframe(columns=self.columns).drop(columns=[ITEM_ID, ITEM_ETAG], errors="ignore")
+        self.list._sp.upload_small(self.path, to_xlsx_bytes(df, self.table_name))
+        self._exported = stamp
+        return True
+
+
+def _literal(v) -> str:
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    if isinstance(v, (int, float)):
+        return str(v)
+    return "'" + str(v).replace("'", "''") + "'"
+
+
+def _field_value(v, kind: str, tz=None):
+    """
+    Valor Python/pandas -> JSON do campo (None limpa o campo). Data sem fuso
+    é horário local (`tz`, ou o da máquina) e vai convertida para UTC.
+    """
+    if kind == "dateTime" and isinstance(v, str) and v:
+        try:
+            v = datetime.fromisoformat(v)
+        except ValueError:
+            return v
+    if kind == "dateTime" and isinstance(v, date) and not pd.isna(v):
+        if not isinstance(v, datetime):
+            v = datetime(v.year, v.month, v.day)
+        if v.tzinfo is None:
+            v = v.replace(tzinfo=tz) if tz else v.astimezone()
+        return v.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    v = _cell(v)
+    return None if v == "" else v
+
+
+def _local_tz():
+    return datetime.now().astimezone().tzinfo
@@ -0,0 +1,330 @@
+# sp_metrics.py
+"""
+Instrumentação das chamadas do SPConnector.
+
+Cada requisição HTTP enviada pelo conector gera um RequestEvent, entregue aos
+hooks registrados com SPConnector.add_hook(). Leituras resolvidas pelo cache
+de conteúdo também geram evento (status None, cache "hit" ou "miss"), para a
+taxa de acerto aparecer junto da latência.
+
+Tempos (segundos):
+  - dns / connect: só quando a requisição abriu conexão nova (0 se
+    reaproveitou uma do pool); connect inclui o handshake TLS
+  - ttfb: do envio da última tentativa até os headers da resposta
+  - total: do início (todas as tentativas e esperas de retry) até o corpo
+    lido; em downloads em streaming, até o fim do stream
+
+PrometheusExporter é um hook pronto: agrega os eventos em contadores e
+histogramas no formato texto do Prometheus, servidos em http://host:porta/metrics
+ou gravados periodicamente num arquivo (textfile collector do node_exporter).
+Ex. de p95 do download: histogram_quantile(0.95, rate(sp_request_duration_seconds_bucket{op="download"}[5m]))
+"""
+import logging, os, socket, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class RequestEvent(NamedTuple):
+    op: str                     # download, upload, upload_fragment, upload_session, stat, batch, delta, token
+    method: str
+    path: Optional[str]         # caminho do arquivo, quando a chamada é sobre um
+    endpoint: str               # URL agrupada (sp_retry.endpoint_key)
+    status: Optional[int]       # None: não houve resposta (erro de rede, circuito aberto) ou evento de cache
+    bytes_in: int
+    bytes_out: int
+    dns: float
+    connect: float
+    ttfb: float
+    total: float
+    retries: int
+    cache: Optional[str]        # "hit" | "miss" nos eventos de cache
+    error: Optional[str]        # nome da exceção, se a chamada falhou sem resposta
+    started_at: float           # time.time() do início
+
+
+# -------- Tempos de conexão (por thread) --------
+_timing = threading.local()
+
+
+def reset_timing():
+    _timing.dns = 0.0
+    _timing.connect = 0.0
+
+
+def read_timing() -> tuple[float, float]:
+    return getattr(_timing, "dns", 0.0), getattr(_timing, "connect", 0.0)
+
+
+def _add(phase: str, seconds: float):
+    setattr(_timing, phase, getattr(_timing, phase, 0.0) + seconds)
+
+
+def urllib3_hooks_ok() -> bool:
+    """
+    A medição de dns usa API interna do urllib3 2.x (_new_conn e _dns_host, o
+    host que ele resolve); requirements.txt fixa a série e
+    tests/test_sp_metrics.py falha se ela mudar. Sem ela, as conexões ficam
+    sem instrumentação (dns/connect = 0), mas funcionam.
+    """
+    try:
+        return callable(HTTPConnection._new_conn) and HTTPConnection("localhost", 80)._dns_host == "localhost"
+    except Exception:
+        return False
+
+
+class _TimedConnection:
+    """Mede a resolução de nome e o estabelecimento de cada conexão nova."""
+
+    def _new_conn(self):
+        t0 = time.perf_counter()
+        try:
+            addrs = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except OSError:
+            addrs = []                  # o super() repete e levanta no formato do urllib3
+        _add("dns", time.perf_counter() - t0)
+        if not addrs:
+            return super()._new_conn()
+        # Conecta nos endereços já resolvidos (sem resolver de novo). O host
+        # original volta antes do TLS, que o usa no SNI e na verificação.
+        host, err = self._dns_host, None
+        try:
+            for *_, sockaddr in addrs:
+                self._dns_host = sockaddr[0]
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError) as e:
+                    err = e
+        finally:
+            self._dns_host = host
+        raise err
+
+    def connect(self):
+        t0 = time.perf_counter()
+        dns0 = read_timing()[0]
+        try:
+            super().connect()
+        finally:
+            _add("connect", time.perf_counter() - t0 - (read_timing()[0] - dns0))
+
+
+class _TimedHTTPConnection(_TimedConnection, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter cujas conexões registram dns/connect (ver read_timing)."""
+
+    def init_poolmanager(self, *args, **kw):
+        super().init_poolmanager(*args, **kw)
+        if not urllib3_hooks_ok():
+            logger.warning("urllib3 sem _new_conn/_dns_host: tempos de dns/connect desativados")
+            return
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPPool, "https": _TimedHTTPSPool}
+
+
+# -------- Construção dos eventos --------
+def request_event(op: str, method: str, endpoint: str, path: Optional[str], response,
+                  started_at: float, elapsed: float, retries: int, error: Optional[BaseException] = None,
+                  stream: bool = False) -> RequestEvent:
+    dns, connect = read_timing()
+    bytes_out = bytes_in = 0
+    ttfb = 0.0
+    status = None
+    if response is not None:
+        status = response.status_code
+        body = response.request.body if response.request is not None else None
+        bytes_out = len(body) if isinstance(body, (bytes, bytearray, str)) else 0
+        bytes_in = 0 if stream else len(response.content or b"")
+        ttfb = response.elapsed.total_seconds()
+    return RequestEvent(op, method.upper(), path, endpoint, status, bytes_in, bytes_out,
+                        dns, connect, ttfb, elapsed, retries, None,
+                        type(error).__name__ if error is not None else None, started_at)
+
+
+def cache_event(op: str, path: str, hit: bool) -> RequestEvent:
+    return RequestEvent(op, "GET", path, "cache", None, 0, 0, 0.0, 0.0, 0.0, 0.0, 0,
+                        "hit" if hit else "miss", None, time.time())
+
+
+# -------- Exportador Prometheus --------
+class PrometheusExporter:
+    """
+    Hook que agrega RequestEvents:
+      {prefix}_requests_total{op,method,status}      (status="error" sem resposta)
+      {prefix}_request_retries_total{op}
+      {prefix}_bytes_received_total{op} / _bytes_sent_total{op}
+      {prefix}_cache_lookups_total{op,result}
+      {prefix}_request_duration_seconds{op}          histograma do total
+      {prefix}_request_ttfb_seconds{op}              histograma do ttfb
+      {prefix}_dns_seconds{op} / _connect_seconds{op} histogramas (só conexões novas)
+
+        exp = PrometheusExporter()
+        sp.add_hook(exp)
+        exp.serve(9464)                          # e/ou exp.write_every("/var/lib/node_exporter/sp.prom")
+    """
+
+    _HELP = {
+        "requests_total": ("counter", "Requisições ao Graph por operação e status."),
+        "request_retries_total": ("counter", "Novas tentativas feitas pela política de retry."),
+        "bytes_received_total": ("counter", "Bytes recebidos (corpo das respostas)."),
+        "bytes_sent_total": ("counter", "Bytes enviados (corpo das requisições)."),
+        "cache_lookups_total": ("counter", "Leituras resolvidas pelo cache de conteúdo (hit) ou não (miss)."),
+        "request_duration_seconds": ("histogram", "Duração total da requisição, com retries."),
+        "request_ttfb_seconds": ("histogram", "Tempo até o primeiro byte da resposta."),
+        "dns_seconds": ("histogram", "Resolução de nome em conexões novas."),
+        "connect_seconds": ("histogram", "Conexão TCP + TLS em conexões novas."),
+    }
+
+    def __init__(self, prefix: str = "sp", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counters: dict[tuple, float] = {}          # (nome, labels) -> valor
+        self._hists: dict[tuple, list] = {}              # (nome, labels) -> [contagens..., soma, n]
+        self._stop = threading.Event()
+        self._server = None
+
+    def __call__(self, ev: RequestEvent):
+        op = (("op", ev.op),)
+        with self._lock:
+            if ev.cache is not None:
+                self._inc("cache_lookups_total", op + (("result", ev.cache),))
+                return
+            status = str(ev.status) if ev.status is not None else "error"
+            self._inc("requests_total", op + (("method", ev.method), ("status", status)))
+            if ev.retries:
+                self._inc("request_retries_total", op, ev.retries)
+            self._inc("bytes_received_total", op, ev.bytes_in)
+            self._inc("bytes_sent_total", op, ev.bytes_out)
+            self._observe("request_duration_seconds", op, ev.total)
+            if ev.status is not None:
+                self._observe("request_ttfb_seconds", op, ev.ttfb)
+            if ev.dns or ev.connect:
+                self._observe("dns_seconds", op, ev.dns)
+                self._observe("connect_seconds", op, ev.connect)
+
+    def _inc(self, name: str, labels: tuple, value: float = 1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name: str, labels: tuple, value: float):
+        h = self._hists.get((name, labels))
+        if h is None:
+            h = self._hists[(name, labels)] = [0] * (len(self.buckets) + 2)
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+    # -------- Saída --------
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            hists = {k: list(v) for k, v in self._hists.items()}
+        lines = []
+        for name, (kind, help_) in self._HELP.items():
+            full = f"{self.prefix}_{name}"
+            lines += [f"# HELP {full} {help_}", f"# TYPE {full} {kind}"]
+            if kind == "counter":
+                for (n, labels), v in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{full}{_labels(labels)} {_num(v)}")
+                continue
+            for (n, labels), h in sorted(hists.items()):
+                if n != name:
+                    continue
+                for b, c in zip(self.buckets, h):
+                    lines.append(f"{full}_bucket{_labels(labels + (('le', _num(b)),))} {c}")
+                lines.append(f"{full}_bucket{_labels(labels + (('le', '+Inf'),))} {h[-1]}")
+                lines.append(f"{full}_sum{_labels(labels)} {_num(h[-2])}")
+                lines.append(f"{full}_count{_labels(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Grava render() em `path` de forma atômica."""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def write_every(self, path: str, interval: float = 15.0):
+        """Thread que regrava o arquivo a cada `interval` segundos (até stop())."""
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.write(path)
+                except OSError:
+                    pass
+        threading.Thread(target=run, name="sp-metrics-file", daemon=True).start()
+        return self
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1"):
+        """Serve /metrics em http://host:port (thread daemon, até stop())."""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                data = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="sp-metrics-http", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
@@ -0,0 +1,145 @@
+# sp_retry.py
+"""
+Política de novas tentativas do SPConnector.
+
+  - RetryPolicy: quais respostas repetir (429/5xx, quedas de conexão), quanto
+    esperar (Retry-After do Graph quando vier; senão backoff exponencial com
+    jitter) e quantas vezes.
+  - CircuitBreaker: por endpoint. Depois de `failure_threshold` falhas
+    seguidas (throttling/5xx/rede) o circuito abre e as chamadas falham na hora
+    com CircuitOpenError até passar o tempo de espera (ou o Retry-After, se
+    maior). Aí uma única chamada de teste decide se fecha de novo. Como o
+    conector é compartilhado, um tenant limitado não é martelado por todas as
+    sessões ao mesmo tempo.
+
+`sleep`, `rand` e `clock` são injetáveis para simular falhas sem esperar de verdade.
+"""
+import random, re, threading, time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class CircuitOpenError(requests.RequestException):
+    """Endpoint com circuito aberto: a chamada nem foi enviada."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"SharePoint limitando requisições em {endpoint}; tente novamente em {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 5, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 retry_statuses=(429, 500, 502, 503, 504), max_retry_after: float = 120.0,
+                 retry_connection_errors: bool = True,
+                 sleep: Callable[[float], None] = time.sleep, rand: Callable[[], float] = random.random):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = frozenset(retry_statuses)
+        self.max_retry_after = max_retry_after
+        self.retry_connection_errors = retry_connection_errors
+        self.sleep = sleep
+        self.rand = rand
+
+    def should_retry_status(self, method: str, status: int) -> bool:
+        if status not in self.retry_statuses:
+            return False
+        # POST/PATCH só quando o Graph garante que não processou (throttling)
+        return method.upper() in IDEMPOTENT_METHODS or status in (429, 503)
+
+    def should_retry_error(self, method: str) -> bool:
+        return self.retry_connection_errors and method.upper() in IDEMPOTENT_METHODS
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Espera antes da tentativa `attempt + 1` (attempt começa em 0)."""
+        if retry_after is not None:
+            # respeita o servidor; o jitter só espalha as sessões que acordariam juntas
+            return min(retry_after, self.max_retry_after) + self.rand() * self.backoff_base
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return self.rand() * cap           # "full jitter"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state: dict[str, dict] = {}   # endpoint -> {"failures", "open_until", "probing"}
+
+    def before(self, endpoint: str):
+        with self._lock:
+            st = self._state.get(endpoint)
+            if st is None or st["open_until"] == 0:
+                return
+            now = self.clock()
+            if now < st["open_until"]:
+                raise CircuitOpenError(endpoint, st["open_until"] - now)
+            if st["probing"]:
+                # meio-aberto: já tem uma chamada de teste em andamento
+                raise CircuitOpenError(endpoint, self.reset_timeout)
+            st["probing"] = True
+
+    def success(self, endpoint: str):
+        with self._lock:
+            self._state.pop(endpoint, None)
+
+    def release(self, endpoint: str):
+        """A chamada terminou sem resultado (erro que não é do servidor): libera o teste do meio-aberto."""
+        with self._lock:
+            st = self._state.get(endpoint)
+            if st is not None:
+                st["probing"] = False
+
+    def failure(self, endpoint: str, retry_after: Optional[float] = None):
+        with self._lock:
+            st = self._state.setdefault(endpoint, {"failures": 0, "open_until": 0, "probing": False})
+            st["failures"] += 1
+            if st["probing"] or st["failures"] >= self.failure_threshold:
+                wait = max(self.reset_timeout, retry_after or 0)
+                st["open_until"] = self.clock() + wait
+                st["probing"] = False
+
+    def state(self) -> dict:
+        now = self.clock()
+        with self._lock:
+            return {
+                ep: {"failures": st["failures"], "open_for": max(0.0, st["open_until"] - now)}
+                for ep, st in self._state.items()
+            }
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Valor do header Retry-After (segundos ou data HTTP), se houver."""
+    value = (response.headers or {}).get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_ID_LIKE = re.compile(r"[0-9]|[,!{}]|^[A-Za-z0-9_-]{20,}$")
+
+
+def endpoint_key(method: str, url: str) -> str:
+    """
+    Agrupa URLs do mesmo tipo de chamada: ids e caminhos de arquivo viram '*'
+    (ex: 'GET graph.microsoft.com/v1.0/drives/*/items/*/content').
+    """
+    parts = urlsplit(url)
+    path = re.sub(r"root:/[^:]*:?", "root:*:", parts.path)
+    segs = ["*" if _ID_LIKE.search(s) and s != "v1.0" else s for s in path.split("/")]
+    return f"{method.upper()} {parts.hostname}{'/'.join(segs)}"
@@ -0,0 +1,152 @@
+# sp_verify.py
+"""
+Conferência de uploads sem baixar o arquivo de novo.
+
+O driveItem devolvido pelo PUT (ou pelo último fragmento da upload
+session) já descreve a versão gravada: verify_upload() compara tamanho e
+hash (quickXorHash no SharePoint/OneDrive for Business, sha1/sha256 no
+OneDrive pessoal) com o conteúdo enviado e confere que eTag e cTag mudaram.
+
+    item = sp.upload_small(path, payload, if_match=etag)
+    check = verify_upload(item, payload, previous_etag=etag)
+    if not check.ok:
+        logger.warning("Upload de %s não confere: %s", path, "; ".join(check.problems))
+
+Observação: o SharePoint pode reescrever arquivos do Office ao recebê-los
+(promoção de propriedades), e então tamanho e hash não batem mesmo com a
+gravação certa. Nesse caso check.rewritten é True e a conferência do
+conteúdo fica para o DeepVerifier, que numa amostra dos uploads baixa o
+arquivo em segundo plano e roda uma checagem (ex: os IDs estão lá?). Só
+check.size_mismatch (o tamanho gravado não é o enviado) justifica conferir
+fora da amostra: o hash muda com a promoção de propriedades a cada gravação.
+"""
+import base64, hashlib, logging, queue, random, threading
+from typing import NamedTuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_XOR_WIDTH = 160        # bits do quickXorHash
+_XOR_SHIFT = 11
+_XOR_MASK = (1 << _XOR_WIDTH) - 1
+
+
+def quick_xor_hash(data: bytes) -> str:
+    """quickXorHash (base64) do conteúdo, como o Graph devolve em file.hashes."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    # o byte i entra rotacionado de (i * 11) % 160 bits: a rotação se repete a cada 160
+    # bytes, então basta o XOR dos bytes de mesma posição módulo 160
+    pad = (-len(buf)) % _XOR_WIDTH
+    if pad:
+        buf = np.concatenate([buf, np.zeros(pad, dtype=np.uint8)])
+    folded = np.bitwise_xor.reduce(buf.reshape(-1, _XOR_WIDTH), axis=0).tolist() if len(buf) else []
+    h = 0
+    for k, b in enumerate(folded):
+        if b:
+            v = b << ((k * _XOR_SHIFT) % _XOR_WIDTH)
+            h ^= (v | (v >> _XOR_WIDTH)) & _XOR_MASK
+    out = bytearray(h.to_bytes(_XOR_WIDTH // 8, "little"))
+    for i, lb in enumerate(len(data).to_bytes(8, "little")):
+        out[_XOR_WIDTH // 8 - 8 + i] ^= lb
+    return base64.b64encode(bytes(out)).decode("ascii")
+
+
+class UploadCheck(NamedTuple):
+    ok: bool
+    problems: list
+    rewritten: bool = False     # tamanho/hash diferem: o servidor pode ter reescrito o arquivo
+    size_mismatch: bool = False # tamanho gravado != enviado
+
+
+def verify_upload(item: dict, content: bytes, previous_etag: str | None = None) -> UploadCheck:
+    """Confere o driveItem devolvido pelo upload contra o conteúdo enviado."""
+    problems, rewritten, size_mismatch = [], False, False
+    etag = item.get("eTag")
+    if not etag:
+        problems.append("resposta sem eTag")
+    elif previous_etag and etag == previous_etag:
+        problems.append("eTag não mudou")
+    if not item.get("cTag"):
+        problems.append("resposta sem cTag")
+
+    size = item.get("size")
+    if size is not None and size != len(content):
+        problems.append(f"tamanho {size} != {len(content)} enviados")
+        rewritten = size_mismatch = True
+    hashes = (item.get("file") or {}).get("hashes") or {}
+    if not rewritten:
+        if "quickXorHash" in hashes:
+            if hashes["quickXorHash"] != quick_xor_hash(content):
+                problems.append("quickXorHash diferente do enviado")
+                rewritten = True
+        elif "sha256Hash" in hashes:
+            if hashes["sha256Hash"].lower() != hashlib.sha256(content).hexdigest():
+                problems.append("sha256Hash diferente do enviado")
+                rewritten = True
+        elif "sha1Hash" in hashes:
+            if hashes["sha1Hash"].lower() != hashlib.sha1(content).hexdigest():
+                problems.append("sha1Hash diferente do enviado")
+                rewritten = True
+    return UploadCheck(not problems, problems, rewritten, size_mismatch)
+
+
+class DeepVerifier:
+    """
+    Conferência completa por amostragem, fora do caminho da gravação:
+    submit() sorteia (com probabilidade `rate`) se o upload será conferido;
+    os sorteados são baixados num thread e passados para check(bytes), que
+    levanta ou devolve False se o conteúdo não estiver certo. Com
+    force=True (ex: quando check.size_mismatch) o upload entra sempre.
+    """
+
+    def __init__(self, sp, rate: float = 0.05, max_pending: int = 20):
+        self._sp = sp
+        self.rate = rate
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self.checked = 0
+        self.failed = 0
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="sp-verify", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, path: str, etag: str | None, check, force: bool = False) -> bool:
+        """Agenda a conferência de `path` na versão `etag`; devolve se foi agendada."""
+        if not force and random.random() >= self.rate:
+            return False
+        try:
+            self._queue.put_nowait((path, etag, check))
+        except queue.Full:
+            return False                    # conferência é melhor-esforço: não acumula
+        return True
+
+    def _run(self):
+        while True:
+            path, etag, check = self._queue.get()
+            try:
+                self.verify(path, etag, check)
+            except Exception as e:          # a conferência nunca derruba o app
+                self.last_error = e
+                logger.warning("Falha ao conferir o upload de %s: %s", path, e)
+
+    def verify(self, path: str, etag: str | None, check) -> bool | None:
+        """Baixa e confere agora; None se o arquivo já mudou de versão (nada a conferir)."""
+        if etag and self._sp.stat(path, etag=etag) is not None:
+            return None                     # 200 = eTag diferente: outra gravação passou na frente
+        # sem cache: o cache guarda o que nós enviamos, não o que o servidor tem
+        data = self._sp.download(path, use_cache=False)
+        self.checked += 1
+        try:
+            ok, err = check(data) is not False, "check() devolveu False"
+        except Exception as e:
+            ok, err = False, e
+        if not ok:
+            self.failed += 1
+            self.last_error = err
+            logger.error("Conferência de %s (%s) falhou: %s", path, etag, err)
+        return ok
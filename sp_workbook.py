@@ -0,0 +1,318 @@
+# sp_workbook.py
+"""
+Sessões da API de pasta de trabalho do Excel (/workbook) no Graph.
+
+Altera uma tabela do .xlsx direto no servidor, sem baixar e reenviar o
+arquivo inteiro: adicionar linhas custa o tamanho das linhas, não o do
+histórico.
+
+    with sp.workbook("Pasta/arquivo.xlsx") as wb:
+        wb.add_rows("Apontamentos", [{"ID": "1AB23", "Status": "PENDENTE"}])
+
+Os dados precisam estar numa tabela do Excel (Inserir > Tabela): a API não
+adiciona linhas a um intervalo solto. to_xlsx_bytes(df, table_name=...)
+grava o DataFrame já como tabela, para que regravações completas do
+arquivo não a desfaçam.
+
+Para alterar células de linhas existentes, row_index() monta um índice
+chave -> linha da planilha (lendo só a coluna da chave) e patch_rows() grava
+só as células alteradas, todas as linhas num único /$batch, depois de
+conferir que cada linha ainda tem a chave esperada. RowIndexCache guarda
+esses índices entre sessões e threads (troca atômica sob lock).
+"""
+import io
+import math
+import re
+import threading
+from datetime import date, datetime
+from typing import NamedTuple
+from urllib.parse import quote
+
+import pandas as pd
+
+
+class WorkbookTableNotFound(LookupError):
+    """O arquivo não tem a tabela pedida (ou não é um .xlsx com tabelas)."""
+
+    def __init__(self, path: str, table: str):
+        super().__init__(f"Tabela '{table}' não encontrada em '{path}'")
+        self.path = path
+        self.table = table
+
+
+class StaleRowIndex(LookupError):
+    """O índice não confere com a planilha (linhas removidas, reordenadas ou inexistentes)."""
+
+
+class RowIndex(NamedTuple):
+    table: str
+    key_column: str
+    sheet: str
+    columns: list               # nomes das colunas, na ordem da tabela
+    first_col: int              # nº da primeira coluna da tabela (A = 1)
+    rows: dict                  # chave -> nº da linha na planilha
+
+    def covers(self, keys) -> bool:
+        return all(k in self.rows for k in keys)
+
+    def cell(self, key: str, column: str) -> str:
+        return f"{_col_letter(self.first_col + self.columns.index(column))}{self.rows[key]}"
+
+
+class RowIndexCache:
+    """
+    Índices (arquivo, tabela) -> RowIndex compartilhados entre threads/sessões.
+    Cada índice é imutável: get() troca o do cache inteiro, e discard() só
+    remove o índice que falhou (não o que outra sessão acabou de remontar).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indices: dict = {}
+
+    def get(self, wb: "WorkbookSession", table: str, key_column: str = "ID", keys=()) -> RowIndex:
+        """Índice em cache se cobre `keys`; senão remonta (fora do lock) e o publica."""
+        k = (wb.path, table)
+        with self._lock:
+            index = self._indices.get(k)
+        if index is None or index.key_column != key_column or not index.covers(keys):
+            index = wb.row_index(table, key_column)
+            with self._lock:
+                self._indices[k] = index
+        return index
+
+    def discard(self, path: str, table: str, index: RowIndex | None = None):
+        """Descarta o índice de (path, table); com `index`, só se ainda for esse."""
+        with self._lock:
+            if index is None or self._indices.get((path, table)) is index:
+                self._indices.pop((path, table), None)
+
+
+class WorkbookSession:
+    """
+    Sessão persistente (persistChanges) sobre um arquivo. Criada por
+    SPConnector.workbook(); close() (ou o fim do `with`) encerra a sessão no
+    servidor. Todas as chamadas passam pelo _request do conector (retry,
+    circuit breaker e métricas).
+    """
+
+    def __init__(self, sp, path: str, persist_changes: bool = True):
+        self._sp = sp
+        self.path = path
+        self.persist_changes = persist_changes
+        self.session_id = None
+        self._url = None
+        self._columns: dict[str, list] = {}
+
+    def open(self):
+        for _ in range(2):
+            url, by_id = self._sp._item_ref(self.path)
+            self._url = f"{url}/workbook"
+            r = self._call("POST", "createSession", json={"persistChanges": self.persist_changes})
+            if r.status_code == 404 and self._sp._stale_ref(self.path, by_id):
+                continue
+            break
+        if r.status_code == 404:
+            raise FileNotFoundError(self.path)
+        r.raise_for_status()
+        self.session_id = r.json().get("id")
+        return self
+
+    def close(self):
+        if self.session_id is None:
+            return
+        try:
+            self._call("POST", "closeSession")
+        except Exception:
+            pass  # a sessão expira sozinha no servidor
+        self.session_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -------- Tabelas --------
+    def table_names(self) -> list:
+        r = self._call("GET", "tables", params={"$select": "name"})
+        r.raise_for_status()
+        return [t["name"] for t in r.json().get("value", [])]
+
+    def columns(self, table: str) -> list:
+        """Nomes das colunas da tabela, na ordem da planilha."""
+        if table not in self._columns:
+            r = self._call("GET", f"tables/{quote(table)}/columns", params={"$select": "name"})
+            if r.status_code == 404:
+                raise WorkbookTableNotFound(self.path, table)
+            r.raise_for_status()
+            self._columns[table] = [c["name"] for c in r.json().get("value", [])]
+        return self._columns[table]
+
+    def add_rows(self, table: str, rows, index: int | None = None) -> dict:
+        """
+        Adiciona linhas (lista de dicts ou DataFrame) ao fim da tabela (ou na
+        posição `index`). As colunas são casadas pelo nome; as que faltam
+        ficam vazias e colunas desconhecidas levantam ValueError (a tabela
+        precisaria de coluna nova).
+        """
+        records = rows.to_dict("records") if isinstance(rows, pd.DataFrame) else list(rows)
+        if not records:
+            return {}
+        cols = self.columns(table)
+        unknown = sorted({k for rec in records for k in rec} - set(cols))
+        if unknown:
+            raise ValueError(f"Colunas ausentes na tabela '{table}': {', '.join(unknown)}")
+        values = [[_cell(rec.get(c)) for c in cols] for rec in records]
+        r = self._call("POST", f"tables/{quote(table)}/rows/add", json={"index": index, "values": values})
+        if r.status_code == 404:
+            raise WorkbookTableNotFound(self.path, table)
+        r.raise_for_status()
+        # o eTag do arquivo mudou: a próxima leitura revalida e baixa de novo
+        self._sp.mark_stale(self.path)
+        return r.json()
+
+    # -------- Células por chave --------
+    def row_index(self, table: str, key_column: str = "ID") -> RowIndex:
+        """Índice chave -> linha, lendo o endereço da tabela e só a coluna `key_column`."""
+        r = self._call("GET", f"tables/{quote(table)}/range", params={"$select": "address"})
+        if r.status_code == 404:
+            raise WorkbookTableNotFound(self.path, table)
+        r.raise_for_status()
+        sheet, first_col, header_row = _parse_address(r.json()["address"])
+        cols = self.columns(table)
+        if key_column not in cols:
+            raise ValueError(f"Coluna '{key_column}' ausente na tabela '{table}'")
+
+        r = self._call("GET", f"tables/{quote(table)}/columns/{quote(key_column)}/dataBodyRange",
+                       params={"$select": "values"})
+        r.raise_for_status()
+        rows = {}
+        for i, row in enumerate(r.json().get("values", [])):
+            k = _key(row[0] if row else None)
+            if k and k not in rows:                 # chave repetida: vale a primeira (como na mescla)
+                rows[k] = header_row + 1 + i
+        return RowIndex(table, key_column, sheet, cols, first_col, rows)
+
+    def patch_rows(self, index: RowIndex, updates: dict):
+        """
+        Grava {chave: {coluna: valor}} nas linhas do índice. Uma ida ao
+        /$batch confere a chave de cada linha; outra faz um PATCH por linha,
+        cobrindo só o trecho entre a primeira e a última coluna alterada
+        (null nas do meio deixa a célula como está). StaleRowIndex se alguma
+        chave não estiver mais onde o índice diz: nada é gravado.
+        """
+        if not updates:
+            return
+        if not index.covers(updates):
+            missing = [k for k in updates if k not in index.rows]
+            raise StaleRowIndex(f"Chaves fora do índice: {', '.join(missing)}")
+        unknown = sorted({c for vals in updates.values() for c in vals} - set(index.columns))
+        if unknown:
+            raise ValueError(f"Colunas ausentes na tabela '{index.table}': {', '.join(unknown)}")
+
+        ws = f"{self._url}/worksheets/{quote(index.sheet)}"
+        headers = {"workbook-session-id": self.session_id} if self.session_id else None
+
+        b = self._sp.batch()
+        checks = {k: b.add("GET", f"{ws}/range(address='{index.cell(k, index.key_column)}')?$select=values",
+                           headers=headers) for k in updates}
+        b.execute()
+        for k, fut in checks.items():
+            values = fut.result().body.get("values") or [[None]]
+            if _key(values[0][0]) != k:
+                raise StaleRowIndex(f"Linha {index.rows[k]} não tem mais a chave {k}")
+
+        b = self._sp.batch()
+        futures, prev = [], None
+        for n, (k, vals) in enumerate(updates.items()):
+            pos = {index.columns.index(c): v for c, v in vals.items()}
+            lo, hi = min(pos), max(pos)
+            row = [_cell(pos[i]) if i in pos else None for i in range(lo, hi + 1)]
+            addr = (f"{_col_letter(index.first_col + lo)}{index.rows[k]}:"
+                    f"{_col_letter(index.first_col + hi)}{index.rows[k]}")
+            # em cadeia (dependsOn): o Graph pede gravações sequenciais na mesma pasta de trabalho
+            deps = [prev] if prev is not None and n % 20 else []
+            prev = b.add("PATCH", f"{ws}/range(address='{addr}')", headers=headers,
+                         body={"values": [row]}, depends_on=deps)
+            futures.append(prev)
+        b.execute()
+        self._sp.mark_stale(self.path)
+        for fut in futures:
+            fut.result()                            # levanta GraphBatchError da primeira que falhou
+
+    # -------- HTTP --------
+    def _call(self, method: str, rel: str, **kw):
+        headers = self._sp._headers()
+        if self.session_id:
+            headers["workbook-session-id"] = self.session_id
+        return self._sp._request(method, f"{self._url}/{rel}", op="workbook", path=self.path,
+                                 headers=headers, timeout=60, **kw)
+
+
+def _key(v) -> str:
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return "" if v is None else str(v).strip()
+
+
+def _col_letter(n: int) -> str:
+    s = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+
+def _parse_address(address: str) -> tuple[str, int, int]:
+    """'Planilha 1'!B3:Y300 -> ('Planilha 1', 2, 3): planilha, 1ª coluna, 1ª linha."""
+    sheet, _, rng = address.rpartition("!")
+    if sheet.startswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    m = re.match(r"\$?([A-Z]+)\$?(\d+)", rng.upper())
+    col = 0
+    for ch in m.group(1):
+        col = col * 26 + ord(ch) - 64
+    return sheet, col, int(m.group(2))
+
+
+def _cell(v, empty=""):
+    """
+    Valor Python/pandas -> valor aceito em `values` da API do Excel (datas em
+    texto ISO; vazio vira `empty`). storage.py usa o mesmo com empty=None.
+    """
+    if v is None or v is pd.NaT or v is pd.NA:
+        return empty
+    if isinstance(v, float) and math.isnan(v):
+        return empty
+    if isinstance(v, datetime):         # inclui pd.Timestamp
+        # o Excel interpreta como quem digita na célula: vira data/hora
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.strftime("%Y-%m-%d")
+    if hasattr(v, "item") and not isinstance(v, (str, bytes)):
+        return v.item()                 # escalares numpy
+    return v
+
+
+def to_xlsx_bytes(df: pd.DataFrame, table_name: str | None = None, sheet_name: str = "Sheet1") -> bytes:
+    """
+    DataFrame -> .xlsx (como df.to_excel(index=False)). Com `table_name`, o
+    intervalo escrito vira uma tabela do Excel com esse nome.
+    """
+    bio = io.BytesIO()
+    if not table_name:
+        df.to_excel(bio, index=False, sheet_name=sheet_name)
+        return bio.getvalue()
+
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.table import Table, TableStyleInfo
+
+    with pd.ExcelWriter(bio, engine="openpyxl") as xw:
+        df.to_excel(xw, index=False, sheet_name=sheet_name)
+        if len(df.columns):
+            ref = f"A1:{get_column_letter(len(df.columns))}{max(len(df), 1) + 1}"
+            table = Table(displayName=table_name, ref=ref)
+            table.tableStyleInfo = TableStyleInfo(name="TableStyleMedium2", showRowStripes=True)
+            xw.sheets[sheet_name].add_table(table)
+    return bio.getvalue()
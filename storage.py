@@ -0,0 +1,340 @@
+# storage.py
+"""
+Armazenamento dos apontamentos com uma cópia local em SQLite.
+
+O app lê e grava no banco local (consultas por ID, estudo, status e prazo
+usam índice e não passam pelo Graph); WorkbookSync, num thread em segundo
+plano, leva as alterações pendentes para o .xlsx do SharePoint e traz as
+edições feitas direto no arquivo.
+
+    store = SQLiteStorage("apontamentos.db", COLUNAS)
+    sync = WorkbookSync(store, sp, "Pasta/apontamentos.xlsx", "Apontamentos").start()
+    store.add(novo_df)                                  # não espera o SharePoint
+    store.update({"1AB23": {"Status": "REALIZADO"}})
+    df = store.query({"Código do Estudo": "EST-001", "Status": "PENDENTE"})
+
+Cada célula gravada localmente fica pendente (tabela _pendentes) até entrar
+numa gravação do arquivo; na sincronização, a versão do SharePoint é a
+base e as células pendentes vão por cima (a mesma regra da mescla por ID
+do app). A gravação usa If-Match: se alguém alterou o arquivo no meio, a
+rodada é refeita sobre a versão nova.
+"""
+import io, logging, sqlite3, threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import pandas as pd
+
+from sp_errors import PreconditionFailed
+from sp_workbook import _cell, _key, to_xlsx_bytes
+
+logger = logging.getLogger(__name__)
+
+# Colunas com índice no banco (as usadas nos filtros do app)
+INDEXED = ["Código do Estudo", "Status", "Prazo Para Resolução"]
+
+
+class Storage(ABC):
+    """
+    Interface do armazenamento de apontamentos (registros identificados
+    pela coluna `key`). Implementações: SQLiteStorage.
+    """
+    key = "ID"
+
+    @abstractmethod
+    def load(self) -> pd.DataFrame:
+        """Todos os registros, nas colunas do armazenamento."""
+
+    @abstractmethod
+    def query(self, filter: dict | None = None) -> pd.DataFrame:
+        """Registros com coluna == valor (ou valor numa lista) para cada item de `filter`."""
+
+    @abstractmethod
+    def add(self, rows):
+        """Inclui registros (DataFrame ou lista de dicts); chave repetida sobrescreve."""
+
+    @abstractmethod
+    def update(self, updates: dict):
+        """{chave: {coluna: valor}}: altera só as colunas informadas."""
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path: str, columns, key: str = "ID", indexed=INDEXED):
+        self.path = path
+        self.key = key
+        self.columns = list(dict.fromkeys([key] + list(columns)))
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._create(indexed)
+        self._dates = {c for (c,) in self._db.execute("SELECT coluna FROM _tipos WHERE tipo = 'datetime'")}
+
+    def _create(self, indexed):
+        cols = ", ".join(f"{_q(c)}{' PRIMARY KEY' if c == self.key else ''}" for c in self.columns)
+        with self._lock:
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS apontamentos ({cols})")
+            have = {r[1] for r in self._db.execute("PRAGMA table_info(apontamentos)")}
+            for c in self.columns:
+                if c not in have:
+                    self._db.execute(f"ALTER TABLE apontamentos ADD COLUMN {_q(c)}")
+            for c in indexed:
+                if c in self.columns:
+                    self._db.execute(f"CREATE INDEX IF NOT EXISTS {_q('ix_' + c)} ON apontamentos ({_q(c)})")
+            # células alteradas localmente que ainda não foram para o SharePoint
+            self._db.execute("CREATE TABLE IF NOT EXISTS _pendentes ("
+                             "chave TEXT, coluna TEXT, seq INTEGER, PRIMARY KEY (chave, coluna))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS _tipos (coluna TEXT PRIMARY KEY, tipo TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS _meta (nome TEXT PRIMARY KEY, valor TEXT)")
+
+    # -------- Leitura --------
+    def load(self) -> pd.DataFrame:
+        return self.query()
+
+    def query(self, filter: dict | None = None) -> pd.DataFrame:
+        where, args = [], []
+        for col, value in (filter or {}).items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            where.append(f"{_q(col)} IN ({', '.join('?' * len(values))})")
+            args += [_sql(v) for v in values]
+        sql = f"SELECT {', '.join(map(_q, self.columns))} FROM apontamentos"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY rowid", args).fetchall()
+        return self._frame(rows)
+
+    def _frame(self, rows) -> pd.DataFrame:
+        df = pd.DataFrame(rows, columns=self.columns)
+        for c in self._dates & set(df.columns):
+            df[c] = pd.to_datetime(df[c], errors="coerce", format="ISO8601")
+        return df
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM apontamentos").fetchone()[0]
+
+    # -------- Escrita local --------
+    def add(self, rows):
+        records = rows.to_dict("records") if isinstance(rows, pd.DataFrame) else list(rows)
+        with self._lock, self._tx():
+            if isinstance(rows, pd.DataFrame):
+                self._note_types(rows)
+            for rec in records:
+                k = _key(rec.get(self.key))
+                vals = {c: rec.get(c) for c in self.columns if c != self.key}
+                self._upsert(k, vals)
+                self._pending(k, self.columns)
+
+    def update(self, updates: dict):
+        with self._lock, self._tx():
+            for k, vals in updates.items():
+                k = _key(k)
+                unknown = set(vals) - set(self.columns)
+                if unknown:
+                    raise ValueError(f"Colunas desconhecidas: {', '.join(sorted(unknown))}")
+                if not self._db.execute(f"SELECT 1 FROM apontamentos WHERE {_q(self.key)} = ?", (k,)).fetchone():
+                    raise KeyError(k)
+                self._upsert(k, vals)
+                self._pending(k, vals)
+
+    def _upsert(self, k: str, vals: dict):
+        cols = [self.key] + list(vals)
+        sets = ", ".join(f"{_q(c)} = excluded.{_q(c)}" for c in vals) or f"{_q(self.key)} = excluded.{_q(self.key)}"
+        self._db.execute(
+            f"INSERT INTO apontamentos ({', '.join(map(_q, cols))}) VALUES ({', '.join('?' * len(cols))}) "
+            f"ON CONFLICT({_q(self.key)}) DO UPDATE SET {sets}",
+            [k] + [_sql(v) for v in vals.values()])
+
+    def _pending(self, k: str, cols):
+        seq = self._next_seq()
+        self._db.executemany("INSERT OR REPLACE INTO _pendentes (chave, coluna, seq) VALUES (?, ?, ?)",
+                             [(k, c, seq) for c in cols])
+
+    def _next_seq(self) -> int:
+        seq = int(self.meta("seq") or 0) + 1
+        self._db.execute("INSERT OR REPLACE INTO _meta VALUES ('seq', ?)", (str(seq),))
+        return seq
+
+    def _note_types(self, df: pd.DataFrame):
+        dates = [c for c in df.columns if c in self.columns and pd.api.types.is_datetime64_any_dtype(df[c])]
+        new = set(dates) - self._dates
+        if new:
+            self._db.executemany("INSERT OR REPLACE INTO _tipos VALUES (?, 'datetime')", [(c,) for c in new])
+            self._dates |= new
+
+    def _tx(self):
+        return _Transaction(self._db)
+
+    # -------- Sincronização --------
+    def meta(self, name: str) -> str | None:
+        with self._lock:
+            row = self._db.execute("SELECT valor FROM _meta WHERE nome = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name: str, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO _meta VALUES (?, ?)", (name, None if value is None else str(value)))
+
+    def pending(self) -> tuple[dict, int]:
+        """({chave: {coluna: valor local}}, seq) das células ainda não enviadas."""
+        with self._lock:
+            rows = self._db.execute("SELECT chave, coluna, seq FROM _pendentes").fetchall()
+            if not rows:
+                return {}, 0
+            df = self.query({self.key: list({k for k, _, _ in rows})})
+        out, seq = {}, 0
+        recs = {r[self.key]: r for r in df.to_dict("records")}
+        for k, col, s in rows:
+            if k in recs and col in recs[k]:
+                out.setdefault(k, {})[col] = recs[k][col]
+                seq = max(seq, s)
+        return out, seq
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM _pendentes LIMIT 1").fetchone() is not None
+
+    def replace_all(self, df: pd.DataFrame, synced_seq: int = 0):
+        """
+        Troca o conteúdo pela versão `df` do arquivo, mantendo por cima as
+        células pendentes com seq > synced_seq (gravadas durante a sincronização).
+        """
+        with self._lock, self._tx():
+            self._note_types(df)
+            self._db.execute("DELETE FROM _pendentes WHERE seq <= ?", (synced_seq,))
+            keep = self._db.execute("SELECT COUNT(*) FROM _pendentes").fetchone()[0]
+            local = self.pending()[0] if keep else {}
+            self._db.execute("DELETE FROM apontamentos")
+            cols = [c for c in self.columns if c in df.columns]
+            recs = df[cols].to_dict("records") if cols else []
+            self._db.executemany(
+                f"INSERT OR IGNORE INTO apontamentos ({', '.join(map(_q, cols))}) VALUES ({', '.join('?' * len(cols))})",
+                [[_key(r[self.key]) if c == self.key else _sql(r[c]) for c in cols] for r in recs])
+            for k, vals in local.items():
+                self._upsert(k, vals)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class WorkbookSync:
+    """
+    Sincroniza um SQLiteStorage com o .xlsx em `path` a cada `interval`
+    segundos (ou logo após poke()). Cada rodada:
+      1. baixa o arquivo se o eTag mudou desde a última rodada;
+      2. se há células pendentes, grava o arquivo com elas por cima
+         (If-Match no eTag lido; PreconditionFailed refaz a rodada);
+      3. substitui o conteúdo local pela versão gravada/baixada.
+    """
+
+    def __init__(self, store: SQLiteStorage, sp, path: str, table_name: str | None = None,
+                 interval: float = 15.0, max_attempts: int = 5, on_change=None):
+        self.store = store
+        self.on_change = on_change            # on_change(), chamado quando o conteúdo local é trocado
+        self._sp = sp
+        self.path = path
+        self.table_name = table_name
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+        self.last_error = None
+        self.last_sync = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sp-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def poke(self):
+        """Antecipa a próxima rodada (ex: após gravar ou quando o delta avisa mudança)."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+                self.last_error = None
+            except Exception as e:          # a sincronização nunca derruba o app
+                self.last_error = e
+                logger.warning("Falha ao sincronizar '%s' com o SharePoint: %s", self.path, e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def sync(self) -> bool:
+        """Uma rodada completa; devolve se o conteúdo local mudou."""
+        with self._sync_lock:
+            for _ in range(self.max_attempts):
+                data, etag = self._sp.download_with_etag(self.path, max_age=0)
+                pending, seq = self.store.pending()
+                if etag == self.store.meta("etag") and not pending:
+                    return False
+                df = pd.read_excel(io.BytesIO(data))
+                if pending:
+                    df = _overlay(df, pending, self.store.key)
+                    try:
+                        item = self._sp.upload_small(self.path, to_xlsx_bytes(df, self.table_name),
+                                                     overwrite=True, if_match=etag)
+                    except PreconditionFailed:
+                        continue            # alguém gravou no meio: relê e refaz
+                    etag = item.get("eTag")
+                self.store.replace_all(df, seq)
+                self.store.set_meta("etag", etag)
+                self.last_sync = datetime.now()
+                if self.on_change:
+                    self.on_change()
+                return True
+            raise PreconditionFailed(self.path, None)
+
+
+def _overlay(df: pd.DataFrame, pending: dict, key: str) -> pd.DataFrame:
+    """Células pendentes por cima da versão do arquivo; chaves novas vão ao final."""
+    df = df.copy()
+    if key not in df.columns:
+        df[key] = pd.Series(dtype=object)
+    keys = df[key].map(_key)
+    pos = {k: i for i, k in reversed(list(enumerate(keys)))}
+    new = []
+    for k, vals in pending.items():
+        if k in pos:
+            for col, v in vals.items():
+                if col not in df.columns:
+                    df[col] = None
+                elif df[col].dtype == float and not isinstance(v, (int, float)):
+                    df[col] = df[col].astype(object)       # coluna vazia lida como float
+                df.iat[pos[k], df.columns.get_loc(col)] = None if pd.isna(v) else v
+        else:
+            new.append({key: k, **vals})
+    if new:
+        df = pd.concat([df, pd.DataFrame(new)], ignore_index=True)
+    return df
+
+
+class _Transaction:
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        self._db.execute("BEGIN")
+
+    def __exit__(self, exc_type, *exc):
+        self._db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql(v):
+    """Valor pandas -> valor do SQLite (datas em texto ISO, que ordena certo; vazio = NULL)."""
+    return _cell(v, empty=None)
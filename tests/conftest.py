@@ -0,0 +1,23 @@
+# Os módulos do app ficam na raiz do repositório (sem pacote)
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def fake_sp():
+    """fake_graph rodando e uma fábrica de SPConnector apontado para ele: srv, connect(**kw)."""
+    from fake_graph import FakeGraphServer
+    from sp_connector import SPConnector
+    from sp_retry import RetryPolicy
+
+    def connect(**kw):
+        kw.setdefault("cache_dir", None)
+        return SPConnector("t", "c", "s", hostname="fake.sharepoint.com", site_path="sites/fake",
+                           library_name="Documentos", base_url=srv.url,
+                           retry_policy=RetryPolicy(sleep=lambda s: None), **kw)
+
+    with FakeGraphServer() as srv:
+        yield srv, connect
@@ -0,0 +1,172 @@
+# Cópia compartilhada, índices, alocador de IDs e mescla tipada (apontamentos.py)
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from apontamentos import (IdAllocator, SessionRegistry, SharedSnapshot, SnapshotIndex, _ID_RE, _ID_SPACE,
+                          apply_schema, merge_by_id)
+
+
+def test_concurrent_updates_do_not_lose_rows():
+    snap = SharedSnapshot(lambda: (pd.DataFrame({"ID": ["A0"], "Status": ["PENDENTE"]}), None), index=SnapshotIndex)
+    barrier = threading.Barrier(8)
+
+    def session(n):
+        barrier.wait()
+        for i in range(10):
+            snap.update(lambda df: merge_by_id(df, pd.DataFrame({"ID": [f"S{n}-{i}"], "Status": ["PENDENTE"]})))
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cur = snap.current()
+    assert len(cur.df) == 81 and cur.df["ID"].is_unique
+    assert len(cur.index.search_id("S")) == 80
+
+
+def test_session_registry_concurrent_touch_and_snapshot():
+    reg, errors = SessionRegistry(ttl=3600), []
+
+    def session(n):
+        try:
+            for i in range(300):
+                reg.touch(f"s{n}-{i % 20}", {"Usuário": f"u{n}"})
+                reg.snapshot()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and len(reg) == 120
+
+
+def test_session_registry_forgets_idle_sessions():
+    reg = SessionRegistry(ttl=60)
+    reg.touch("a", {"Usuário": "x"}, now=1000)
+    reg.touch("b", {"Usuário": "y"}, now=1070)
+    assert [s["Usuário"] for s in reg.snapshot()] == ["y"]
+
+
+IDS = ["AP-001", "AP-002", "BX-010", "ação-7", "AÇÃO-8", "ap-0012", "ZZ"]
+
+
+def frame(ids, status):
+    return pd.DataFrame({"ID": ids, "Código do Estudo": [f"E{i % 3}" for i in range(len(ids))], "Status": status})
+
+
+def assert_same_index(a, b, queries):
+    assert len(a) == len(b) and a.columns == b.columns
+    for c in b.columns:
+        assert a.values(c) == b.values(c)
+        for v in b.values(c):
+            assert np.array_equal(a.positions(c, v), b.positions(c, v))
+    for q in queries:
+        assert np.array_equal(a.search_id(q), b.search_id(q)), q
+
+
+def test_updated_matches_fresh_build():
+    df = frame(IDS, ["PENDENTE"] * len(IDS))
+    nxt = frame(IDS + ["NOVO-1", "AP-003"], ["PENDENTE"] * (len(IDS) + 2))
+    nxt.loc[1, "ID"] = "QQ-002"                     # ID alterado
+    nxt.loc[[0, 3], "Status"] = "RESOLVIDO"         # valor novo na coluna
+    nxt.loc[2, "Código do Estudo"] = "E9"
+    queries = ["", "A", "AP", "AP-", "AP-00", "002", "QQ", "ÇÃO", "NOVO-1", "X"]
+    grams = {i[k:k + n] for i in nxt["ID"].str.upper() for n in (1, 2, 3) for k in range(len(i))}
+    grams |= {i[k:k + n] for i in df["ID"].str.upper() for n in (1, 2, 3) for k in range(len(i))}
+    assert_same_index(SnapshotIndex(df).updated(nxt), SnapshotIndex(nxt), queries + sorted(grams))
+
+
+@pytest.mark.parametrize("q", ["", "  ", "a", "P-", "ap-00", "AP-0012", "p-0012", "ção", "AÇÃO-", "ÇÃO-8", "-0", "nada", "AP-0010"])
+def test_search_id_matches_str_contains(q):
+    df = frame(IDS, ["PENDENTE"] * len(IDS))
+    expected = np.flatnonzero(df["ID"].str.contains(q.strip(), case=False, regex=False))
+    assert np.array_equal(SnapshotIndex(df).search_id(q), expected)
+
+
+def test_search_id_is_not_a_regex():
+    df = frame(["A.B", "AXB", "A+B"], ["PENDENTE"] * 3)
+    assert SnapshotIndex(df).search_id("a.b").tolist() == [0]
+    assert SnapshotIndex(df).search_id("+").tolist() == [2]
+
+
+def typed_base():
+    return apply_schema(pd.DataFrame({
+        "ID": ["A1", "A2"], "Status": ["PENDENTE", "PENDENTE"], "Verificador": ["x", None],
+        "Prazo Para Resolução": ["2025-01-10", "2025-02-10"], "Data Resolução": [None, None],
+    }))
+
+
+@pytest.mark.parametrize("prazo", [datetime(2025, 3, 1), date(2025, 3, 1), "2025-03-01", pd.Timestamp("2025-03-01")])
+def test_merge_keeps_column_dtypes(prazo):
+    base = typed_base()
+    out = merge_by_id(base, pd.DataFrame({"ID": ["A2", "A3"], "Status": ["RESOLVIDO", "PENDENTE"],
+                                          "Prazo Para Resolução": [prazo, prazo], "Data Resolução": [None, ""],
+                                          "Verificador": ["y", "z"]}))
+    assert out.dtypes.astype(str).to_dict() == base.dtypes.astype(str).to_dict()   # "category" p/ categóricas
+    assert out["Prazo Para Resolução"].tolist()[1:] == [pd.Timestamp("2025-03-01")] * 2
+    assert out["Data Resolução"].isna().all()
+    assert out["Status"].tolist() == ["PENDENTE", "RESOLVIDO", "PENDENTE"]
+    assert apply_schema(out) is out                  # nada a converter depois da mescla
+
+
+def test_merge_falls_back_to_object_for_non_dates():
+    out = merge_by_id(typed_base(), pd.DataFrame({"ID": ["A1"], "Prazo Para Resolução": ["a combinar"]}))
+    assert out["Prazo Para Resolução"].tolist()[0] == "a combinar"
+
+
+def test_id_lease_is_exclusive_until_committed_or_expired():
+    ids = IdAllocator(seed=1)
+    a = ids.lease("s1")
+    assert _ID_RE.match(a) and ids.free() == _ID_SPACE - 1
+    assert not ids.commit(a, "s2")                   # reservado para outra sessão
+    assert ids.commit(a, "s1")
+    assert not ids.commit(a, "s1")                   # já usado
+    assert ids.free() == _ID_SPACE - 1
+
+    expired = IdAllocator(ttl=0, seed=1)
+    b = expired.lease("s1")
+    assert expired.commit(b, "s2")                   # reserva vencida não bloqueia
+
+
+def test_id_new_lease_replaces_previous_and_release_frees():
+    ids = IdAllocator(seed=2)
+    a = ids.lease("s1")
+    b = ids.lease("s1")
+    assert a != b and ids.free() == _ID_SPACE - 1 and ids.commit(a, "s2")
+    ids.release(a)
+    assert ids.free() == _ID_SPACE - 1 and ids.commit(a, "s2")
+
+
+def test_id_draw_skips_observed_ids():
+    drawn = IdAllocator(seed=3).lease("s1")
+    ids = IdAllocator(seed=3)
+    ids.observe([f" {drawn} ", None, float("nan"), "manual-1"])
+    assert ids.lease("s1") != drawn and not ids.commit(drawn, "s1") and not ids.commit("manual-1", "s1")
+    assert ids.free() == _ID_SPACE - 2               # "manual-1" não é do espaço de IDs
+
+
+def test_id_concurrent_sessions_never_collide():
+    ids, got, barrier = IdAllocator(), [], threading.Barrier(8)
+
+    def session(n):
+        barrier.wait()
+        for _ in range(200):
+            i = ids.lease(f"s{n}")
+            assert ids.commit(i, f"s{n}")
+            got.append(i)
+        got.extend(ids.allocate(50))
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(got) == 8 * 250 == len(set(got)) and ids.free() == _ID_SPACE - len(got)
@@ -0,0 +1,76 @@
+# Pipeline de gravação completa (gravacao.save_merged) contra o fake_graph
+import io
+
+import pandas as pd
+import pytest
+
+from fake_graph import FakeGraphServer
+from gravacao import save_merged
+from sp_connector import PreconditionFailed, SPConnector
+from sp_retry import RetryPolicy
+
+PATH = "Apontamentos/apontamentos.xlsx"
+
+
+def xlsx(df):
+    bio = io.BytesIO()
+    df.to_excel(bio, index=False)
+    return bio.getvalue()
+
+
+@pytest.fixture
+def graph():
+    with FakeGraphServer() as srv:
+        srv.graph.put_file(PATH, xlsx(pd.DataFrame({"ID": ["A1", "A2"], "Status": ["PENDENTE"] * 2,
+                                                    "Apontamento": ["x", "y"]})))
+        sp = SPConnector("t", "c", "s", hostname="fake.sharepoint.com", site_path="sites/fake",
+                         library_name="Documentos", base_url=srv.url, cache_dir=None,
+                         retry_policy=RetryPolicy(sleep=lambda s: None))
+        yield srv, sp
+
+
+def saved(srv):
+    return pd.read_excel(io.BytesIO(srv.graph.get_file(PATH)))
+
+
+def test_merges_only_submitted_columns(graph):
+    srv, sp = graph
+    res = save_merged(sp, PATH, [pd.DataFrame({"ID": ["A2"], "Status": ["RESOLVIDO"]}),
+                                 pd.DataFrame({"ID": ["A3"], "Status": ["PENDENTE"], "Apontamento": ["z"]})],
+                      table_name="Apontamentos")
+    df = saved(srv)
+    assert df["ID"].tolist() == ["A1", "A2", "A3"]
+    assert df["Status"].tolist() == ["PENDENTE", "RESOLVIDO", "PENDENTE"]
+    assert df["Apontamento"].tolist() == ["x", "y", "z"]
+    assert res.attempts == 1 and res.check.ok and res.etag == sp.stat(PATH)["eTag"]
+
+
+def test_remerges_when_file_changes_mid_save(graph):
+    srv, sp = graph
+    download, other = sp.download_with_etag, [pd.DataFrame({"ID": ["B1"]})]
+
+    def concurrent_writer(path, max_age=None):
+        data, etag = download(path, max_age=max_age)
+        if other:                       # outra sessão grava entre a nossa leitura e o upload
+            srv.graph.put_file(PATH, xlsx(pd.concat([saved(srv), other.pop()], ignore_index=True)))
+        return data, etag
+
+    sp.download_with_etag = concurrent_writer
+    res = save_merged(sp, PATH, [pd.DataFrame({"ID": ["A1"], "Status": ["RESOLVIDO"]})])
+    assert res.attempts == 2
+    df = saved(srv)
+    assert df["ID"].tolist() == ["A1", "A2", "B1"] and df["Status"].iloc[0] == "RESOLVIDO"
+
+
+def test_gives_up_when_file_always_changes(graph):
+    srv, sp = graph
+    download = sp.download_with_etag
+
+    def always_changed(path, max_age=None):
+        data, etag = download(path, max_age=max_age)
+        srv.graph.put_file(PATH, data)
+        return data, etag
+
+    sp.download_with_etag = always_changed
+    with pytest.raises(PreconditionFailed):
+        save_merged(sp, PATH, [pd.DataFrame({"ID": ["A1"], "Status": ["RESOLVIDO"]})], max_attempts=3)
@@ -0,0 +1,145 @@
+# Fila de gravação com diário (journal.WriteBehindQueue): group commit, recuperação e novas tentativas
+import threading
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+import pandas as pd
+import pytest
+
+from journal import WriteBehindQueue, WriteJournal
+
+
+def df(i):
+    return pd.DataFrame({"ID": [f"A{i}"], "Status": ["PENDENTE"]})
+
+
+def test_idle_queue_flushes_immediately(tmp_path):
+    batches = []
+    q = WriteBehindQueue(WriteJournal(str(tmp_path / "j")), lambda dfs: batches.append(len(dfs)) or "ok").start()
+    assert q.submit(df(1)).result(timeout=1) == "ok"        # sem janela: não espera 2 s
+    assert batches == [1]
+    q.stop()
+
+
+def test_submits_during_flush_are_grouped(tmp_path):
+    batches, started, release = [], threading.Event(), threading.Event()
+
+    def flush(dfs):
+        batches.append([d["ID"].iloc[0] for d in dfs])
+        started.set()
+        release.wait(5)                                   # gravação lenta em andamento
+        return len(batches)
+
+    q = WriteBehindQueue(WriteJournal(str(tmp_path / "j")), flush).start()
+    first = q.submit(df(0))
+    assert started.wait(1)
+    rest = [q.submit(df(i)) for i in range(1, 4)]
+    release.set()
+    assert first.result(timeout=2) == 1
+    assert [f.result(timeout=2) for f in rest] == [2, 2, 2]
+    assert batches == [["A0"], ["A1", "A2", "A3"]]
+    q.stop()
+
+
+def test_pending_entries_are_replayed(tmp_path):
+    path = str(tmp_path / "j")
+    j = WriteJournal(path)
+    j.append(df(1))
+    seq = j.append(df(2))
+    j.done([seq - 1])
+    batches = []
+    q = WriteBehindQueue(WriteJournal(path), lambda dfs: batches.append([d["ID"].iloc[0] for d in dfs])).start()
+    q.submit(df(3)).result(timeout=2)
+    assert [i for b in batches for i in b] == ["A2", "A3"]
+    assert WriteJournal(path).pending() == []
+    q.stop()
+
+
+def test_parts_of_a_submit_stay_in_one_batch(tmp_path):
+    path, batches = str(tmp_path / "j"), []
+    j = WriteJournal(path)
+    j.append(pd.DataFrame({"ID": ["A1"], "Status": ["REALIZADO"]}),
+             pd.DataFrame({"ID": ["A2"], "Status": ["NÃO APLICÁVEL"], "Justificativa": ["n/a"]}))
+    [(_, dfs)] = WriteJournal(path).pending()           # relido do diário, partes separadas
+    assert [list(d.columns) for d in dfs] == [["ID", "Status"], ["ID", "Status", "Justificativa"]]
+
+    q = WriteBehindQueue(WriteJournal(path), lambda dfs: batches.append([list(d.columns) for d in dfs])).start()
+    q.submit(df(1), df(2)).result(timeout=2)
+    assert [len(b) for b in batches] in ([2, 2], [4])
+    q.stop()
+
+
+class Flaky:
+    """flush que falha `fails` vezes com `error` antes de gravar (as linhas vão para `written`)."""
+
+    def __init__(self, fails, error):
+        self.fails, self.error, self.written, self.calls = fails, error, [], 0
+
+    def __call__(self, dfs):
+        self.calls += 1
+        if self.calls <= self.fails:
+            raise self.error
+        self.written += [i for d in dfs for i in d["ID"]]
+        return "ok"
+
+
+def test_temporary_failure_is_retried_until_written(tmp_path):
+    path = str(tmp_path / "j")
+    flush = Flaky(2, ConnectionError("rede caiu"))
+    q = WriteBehindQueue(WriteJournal(path), flush, retry_base=0.01).start()
+    fut = q.submit(df(1), df(2))
+    assert fut.result(timeout=5) == "ok"
+    assert flush.calls == 3 and flush.written == ["A1", "A2"]
+    assert WriteJournal(path).pending() == []
+    q.stop()
+
+
+def test_wait_returns_early_while_retrying_and_envio_stays_in_journal(tmp_path):
+    path = str(tmp_path / "j")
+    q = WriteBehindQueue(WriteJournal(path), Flaky(10, ConnectionError("fora do ar")),
+                         retry_base=60).start()
+    fut = q.submit(df(1))
+    with pytest.raises(FuturesTimeout):
+        q.wait(fut, timeout=5)                       # não espera os 5 s: já está para repetir
+    assert not fut.done()
+    q.stop()
+    # o processo cai aqui: o envio continua no diário e é regravado na próxima execução
+    flush = Flaky(0, None)
+    q2 = WriteBehindQueue(WriteJournal(path), flush).start()
+    q2.submit(df(2)).result(timeout=5)
+    assert flush.written == ["A1", "A2"]
+    q2.stop()
+
+
+def test_permanent_error_drops_only_the_bad_envio(tmp_path):
+    path, started, release = str(tmp_path / "j"), threading.Event(), threading.Event()
+    written = []
+
+    def flush(dfs):
+        ids = [i for d in dfs for i in d["ID"]]
+        if not started.is_set():
+            started.set()
+            release.wait(5)
+        if "A2" in ids:
+            raise ValueError("linha inválida")
+        written.extend(ids)
+        return "ok"
+
+    q = WriteBehindQueue(WriteJournal(path), flush).start()
+    first = q.submit(df(0))
+    assert started.wait(1)
+    good, bad, other = q.submit(df(1)), q.submit(df(2)), q.submit(df(3))   # mesmo lote
+    release.set()
+    assert first.result(timeout=5) == good.result(timeout=5) == other.result(timeout=5) == "ok"
+    assert isinstance(bad.exception(timeout=5), ValueError)
+    assert written == ["A0", "A1", "A3"]
+    assert WriteJournal(path).pending() == []
+    q.stop()
+
+
+def test_gives_up_after_max_attempts(tmp_path):
+    path = str(tmp_path / "j")
+    flush = Flaky(100, ConnectionError("fora do ar"))
+    q = WriteBehindQueue(WriteJournal(path), flush, max_attempts=3, retry_base=0.01).start()
+    assert isinstance(q.submit(df(1)).exception(timeout=5), ConnectionError)
+    assert flush.calls == 3 and WriteJournal(path).pending() == []
+    q.stop()
@@ -0,0 +1,39 @@
+# Cache de conteúdo do SPConnector.download (memória + disco) contra o fake_graph
+PATH = "Pasta/dados.bin"
+
+
+def events(sp):
+    """(op, status, cache) dos eventos do conector, fora token e descoberta do site/drive."""
+    got = []
+    sp.add_hook(lambda ev: ev.op not in ("token", "batch") and got.append((ev.op, ev.status, ev.cache)))
+    return got
+
+
+def test_unchanged_file_is_revalidated_with_304(fake_sp):
+    srv, connect = fake_sp
+    srv.graph.put_file(PATH, b"v1")
+    sp = connect()
+    got = events(sp)
+
+    assert sp.download(PATH) == b"v1"
+    assert got == [("stat", 200, None), ("download", 200, None), ("download", None, "miss")]
+    got.clear()
+    assert sp.download(PATH, max_age=0) == b"v1"        # If-None-Match: 304, corpo do cache
+    assert got == [("stat", 304, None), ("download", None, "hit")]
+
+    srv.graph.put_file(PATH, b"v2")
+    got.clear()
+    assert sp.download(PATH, max_age=0) == b"v2"
+    assert got == [("stat", 200, None), ("download", 200, None), ("download", None, "miss")]
+    assert sp.cache_stats()["hits"] == 1
+
+
+def test_disk_tier_survives_a_new_connector(fake_sp, tmp_path):
+    srv, connect = fake_sp
+    srv.graph.put_file(PATH, b"x" * 1000)
+    assert connect(cache_dir=str(tmp_path)).download(PATH) == b"x" * 1000
+
+    sp = connect(cache_dir=str(tmp_path))               # outro processo: memória vazia, disco não
+    got = events(sp)
+    assert sp.download(PATH) == b"x" * 1000
+    assert got == [("stat", 304, None), ("download", None, "hit")]
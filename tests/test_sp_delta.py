@@ -0,0 +1,52 @@
+# Observador do delta do drive (sp_delta.DeltaWatcher) contra o fake_graph
+import json
+
+from fake_graph import DRIVE_ID
+from sp_delta import DeltaWatcher
+
+A, B, OTHER = "Pasta/a.xlsx", "Pasta/b.xlsx", "Outra/a.xlsx"
+
+
+def watcher(sp, token_file, seen):
+    return DeltaWatcher(sp, [A, B], seen.append, token_file=str(token_file))
+
+
+def test_reports_only_watched_files(fake_sp, tmp_path):
+    srv, connect = fake_sp
+    for p in (A, B, OTHER):
+        srv.graph.put_file(p, b"v1")
+    seen = []
+    w = watcher(connect(), tmp_path / "delta.json", seen)
+    assert w.poll() == set()                             # primeira consulta: só marca o ponto de partida
+    srv.graph.put_file(A, b"v2")
+    srv.graph.put_file(OTHER, b"v2")                     # mesmo nome, outra pasta
+    assert w.poll() == {A} and seen == [{A}]
+    assert w.poll() == set()
+
+
+def test_resumes_from_saved_token_after_restart(fake_sp, tmp_path):
+    srv, connect = fake_sp
+    srv.graph.put_file(A, b"v1")
+    srv.graph.put_file(B, b"v1")
+    token = tmp_path / "delta.json"
+    watcher(connect(), token, []).poll()
+    saved = json.loads(token.read_text())["deltaLink"]
+
+    srv.graph.put_file(B, b"v2")                         # muda com o processo parado
+    seen = []
+    w = watcher(connect(), token, seen)                  # "reinício": novo conector e watcher
+    assert w.poll() == {B} and seen == [{B}]
+    assert json.loads(token.read_text())["deltaLink"] != saved
+
+
+def test_expired_token_marks_everything_changed(fake_sp, tmp_path):
+    srv, connect = fake_sp
+    srv.graph.put_file(A, b"v1")
+    token = tmp_path / "delta.json"
+    token.write_text(json.dumps({"deltaLink": f"{srv.url}/v1.0/drives/{DRIVE_ID}/root/delta?token=999"}))
+    w = watcher(connect(), token, [])
+    assert w.poll() == {A, B}                            # 410: não dá para saber o que mudou
+    srv.graph.put_file(A, b"v2")
+    assert w.poll() == set()                             # recomeça do ponto atual
+    srv.graph.put_file(A, b"v3")
+    assert w.poll() == {A}
@@ -0,0 +1,23 @@
+# Conversão de valores para os campos da lista (sp_lists._field_value)
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+from sp_lists import _field_value
+
+SP = ZoneInfo("America/Sao_Paulo")
+
+
+def test_naive_dates_are_local_time_sent_as_utc():
+    assert _field_value(pd.Timestamp("2024-03-01 09:30"), "dateTime", SP) == "2024-03-01T12:30:00Z"
+    assert _field_value(datetime(2024, 3, 1, 9, 30), "dateTime", SP) == "2024-03-01T12:30:00Z"
+    assert _field_value("2024-03-01 09:30:00", "dateTime", SP) == "2024-03-01T12:30:00Z"
+    assert _field_value(datetime(2024, 3, 1, 9, 30, tzinfo=timezone.utc), "dateTime", SP) == "2024-03-01T09:30:00Z"
+
+
+def test_empty_and_other_fields():
+    assert _field_value(pd.NaT, "dateTime", SP) is None
+    assert _field_value("", "dateTime", SP) is None
+    assert _field_value("amanhã", "dateTime", SP) == "amanhã"
+    assert _field_value("x", "text") == "x"
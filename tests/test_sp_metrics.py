@@ -0,0 +1,54 @@
+# Tempos de conexão do TimedHTTPAdapter (sp_metrics)
+import inspect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+import requests
+from urllib3.connection import HTTPConnection
+
+from sp_metrics import TimedHTTPAdapter, _TimedHTTPPool, read_timing, reset_timing, urllib3_hooks_ok
+
+
+class Ok(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"            # keep-alive: a 2ª requisição reaproveita a conexão
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Ok)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://localhost:{srv.server_address[1]}/"
+    srv.shutdown()
+
+
+def test_urllib3_private_api_still_there():
+    # se falhar, o urllib3 mudou a API interna usada por _TimedConnection:
+    # ajuste sp_metrics antes de liberar a versão nova em requirements.txt
+    assert urllib3_hooks_ok()
+    assert list(inspect.signature(HTTPConnection._new_conn).parameters) == ["self"]
+
+
+def test_new_connection_records_dns_and_connect(server):
+    s = requests.Session()
+    adapter = TimedHTTPAdapter()
+    s.mount("http://", adapter)
+    assert adapter.poolmanager.pool_classes_by_scheme["http"] is _TimedHTTPPool
+
+    reset_timing()
+    assert s.get(server).text == "ok"
+    dns, connect = read_timing()
+    assert dns > 0 and connect > 0
+
+    reset_timing()                      # conexão reaproveitada do pool: sem dns/connect
+    assert s.get(server).text == "ok"
+    assert read_timing() == (0.0, 0.0)
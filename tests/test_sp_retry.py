@@ -0,0 +1,202 @@
+# Retry, Retry-After e circuit breaker do SPConnector com falhas injetadas
+# (sessão HTTP falsa ou fake_graph; sleep e relógio falsos: nada espera de verdade)
+import io
+
+import pytest
+import requests
+
+from fake_graph import FakeGraphServer
+from sp_batch import GraphBatch
+from sp_connector import SPConnector
+from sp_retry import CircuitBreaker, CircuitOpenError, RetryPolicy, endpoint_key
+
+URL = "https://graph.microsoft.com/v1.0/drives/b!abc/items/01ABC"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubSession:
+    """requests.Session falsa: devolve (ou levanta) os itens de `script` em ordem."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+
+    def request(self, method, url, **kw):
+        self.calls.append(method)
+        step = self.script.pop(0)
+        if isinstance(step, BaseException):
+            raise step
+        return step
+
+
+def resp(status, retry_after=None):
+    r = requests.Response()
+    r.status_code = status
+    r._content = b"{}"
+    r.raw = io.BytesIO(b"{}")               # _send fecha as respostas que vai repetir
+    if retry_after is not None:
+        r.headers["Retry-After"] = str(retry_after)
+    return r
+
+
+def connector(*script, max_attempts=5, threshold=100, reset=30.0, rand=0.0, max_retry_after=120.0):
+    sleeps, clock = [], Clock()
+    policy = RetryPolicy(max_attempts=max_attempts, backoff_base=0.5, backoff_max=30.0,
+                         max_retry_after=max_retry_after, sleep=sleeps.append, rand=lambda: rand)
+    sp = SPConnector("t", "c", "s", hostname="h", site_path="sites/x", library_name="D", cache_dir=None,
+                     retry_policy=policy, circuit_breaker=CircuitBreaker(threshold, reset, clock=clock))
+    sp._session = StubSession(*script)
+    return sp, sleeps, clock
+
+
+def send(sp, method="GET", url=URL):
+    return sp._send(method, url, endpoint_key(method, url), True, [0])
+
+
+# -------- Retry --------
+@pytest.mark.parametrize("status", [429, 503])
+def test_retry_after_is_respected(status):
+    sp, sleeps, _ = connector(resp(status, retry_after=7), resp(200))
+    assert send(sp).status_code == 200
+    assert sleeps == [7.0]
+    assert sp._session.calls == ["GET", "GET"]
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_backoff_without_retry_after(status):
+    sp, sleeps, _ = connector(resp(status), resp(status), resp(200), rand=1.0)
+    assert send(sp).status_code == 200
+    assert sleeps == [0.5, 1.0]             # base * 2**tentativa (jitter no máximo)
+
+
+def test_retry_after_is_capped():
+    sp, sleeps, _ = connector(resp(429, retry_after=3600), resp(200), max_retry_after=120.0)
+    assert send(sp).status_code == 200
+    assert sleeps == [120.0]
+
+
+def test_gives_up_after_max_attempts():
+    sp, sleeps, _ = connector(*[resp(503, retry_after=1)] * 3, max_attempts=3)
+    assert send(sp).status_code == 503
+    assert len(sp._session.calls) == 3 and sleeps == [1.0, 1.0]
+
+
+@pytest.mark.parametrize("method", ["POST", "PATCH"])
+def test_non_idempotent_not_retried_on_500(method):
+    sp, sleeps, _ = connector(resp(500), resp(200))
+    assert send(sp, method).status_code == 500
+    assert sp._session.calls == [method] and sleeps == []
+
+
+@pytest.mark.parametrize("method", ["POST", "PATCH"])
+def test_non_idempotent_retried_on_throttling(method):
+    sp, sleeps, _ = connector(resp(429, retry_after=2), resp(201))
+    assert send(sp, method).status_code == 201
+    assert sleeps == [2.0]
+
+
+def test_connection_error_retried_for_get():
+    sp, sleeps, _ = connector(requests.ConnectionError("reset"), requests.Timeout("lento"), resp(200), rand=1.0)
+    assert send(sp).status_code == 200
+    assert sleeps == [0.5, 1.0]
+
+
+def test_connection_error_not_retried_for_post():
+    sp, sleeps, _ = connector(requests.ConnectionError("reset"), resp(200))
+    with pytest.raises(requests.ConnectionError):
+        send(sp, "POST")
+    assert sleeps == []
+
+
+# -------- Circuit breaker --------
+def test_breaker_open_half_open_closed():
+    sp, _, clock = connector(resp(500), resp(500), resp(200), max_attempts=1, threshold=2, reset=30.0)
+    assert send(sp).status_code == 500
+    assert send(sp).status_code == 500
+    with pytest.raises(CircuitOpenError):   # aberto: nem chega a enviar
+        send(sp)
+    assert len(sp._session.calls) == 2
+
+    clock.now += 31                          # meio-aberto: uma chamada de teste passa
+    assert send(sp).status_code == 200
+    assert sp.circuit_breaker.state() == {}  # fechado
+    sp._session.script.append(resp(200))
+    assert send(sp).status_code == 200
+
+
+def test_failed_probe_reopens():
+    sp, _, clock = connector(resp(500), resp(503), resp(200), max_attempts=1, threshold=1, reset=30.0)
+    send(sp)
+    clock.now += 31
+    assert send(sp).status_code == 503       # o teste falhou: abre de novo
+    with pytest.raises(CircuitOpenError):
+        send(sp)
+    clock.now += 31
+    assert send(sp).status_code == 200
+
+
+def test_only_one_probe_while_half_open():
+    breaker = CircuitBreaker(1, 30.0, clock=Clock())
+    breaker.failure("ep")
+    breaker.clock.now += 31
+    breaker.before("ep")                     # a chamada de teste
+    with pytest.raises(CircuitOpenError):
+        breaker.before("ep")
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.ChunkedEncodingError("corpo cortado"),
+                                   RuntimeError("bug")])
+def test_probe_exception_does_not_stick(error):
+    sp, _, clock = connector(resp(500), error, resp(200), max_attempts=1, threshold=1, reset=30.0)
+    send(sp)
+    clock.now += 31
+    with pytest.raises(type(error)):
+        send(sp)
+    clock.now += 31                          # erro de rede reabriu por reset_timeout; outro só liberou
+    assert send(sp).status_code == 200
+
+
+# -------- $batch --------
+def test_batch_retries_throttled_requests_and_dependents():
+    sleeps, sent = [], []
+    replies = [
+        [{"id": "1", "status": 429, "headers": {"Retry-After": "4"}},
+         {"id": "2", "status": 424},
+         {"id": "3", "status": 200, "body": {"ok": 3}}],
+        [{"id": "1", "status": 200, "body": {"ok": 1}},
+         {"id": "2", "status": 200, "body": {"ok": 2}}],
+    ]
+
+    def send_batch(reqs):
+        sent.append([r["id"] for r in reqs])
+        return replies.pop(0)
+
+    b = GraphBatch(send_batch, "https://graph", RetryPolicy(sleep=sleeps.append, rand=lambda: 0.0))
+    f1 = b.add("GET", "/a")
+    f2 = b.add("GET", "/b", depends_on=[f1])
+    f3 = b.add("GET", "/c")
+    b.execute()
+    assert [f.result().body for f in (f1, f2, f3)] == [{"ok": 1}, {"ok": 2}, {"ok": 3}]
+    assert sent == [["1", "2", "3"], ["1", "2"]] and sleeps == [4.0]
+
+
+# -------- Contra o fake_graph --------
+def test_fake_graph_injected_faults():
+    with FakeGraphServer() as srv:
+        srv.graph.put_file("Pasta/a.csv", b"x\n1\n")
+        sleeps = []
+        sp = SPConnector("t", "c", "s", hostname="fake.sharepoint.com", site_path="sites/fake",
+                         library_name="Documentos", base_url=srv.url, cache_dir=None,
+                         retry_policy=RetryPolicy(sleep=sleeps.append, rand=lambda: 0.0))
+        sp.stat("Pasta/a.csv")                       # descoberta + token fora das falhas
+        srv.graph.inject(429, retry_after=3)
+        srv.graph.inject(503, retry_after=5)
+        assert sp.download("Pasta/a.csv", use_cache=False) == b"x\n1\n"
+        assert sleeps == [3.0, 5.0]
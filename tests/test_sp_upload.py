@@ -0,0 +1,65 @@
+# Upload em sessão (vários fragmentos) e download_many contra o fake_graph
+import pytest
+import requests
+
+from sp_connector import CHUNK_ALIGN, PreconditionFailed
+
+PATH = "Pasta/grande.xlsx"
+DATA = bytes(range(256)) * (CHUNK_ALIGN * 7 // 2 // 256)        # 3,5 fragmentos
+
+
+def fragments(sp):
+    got = []
+    sp.add_hook(lambda ev: ev.op.startswith("upload") and got.append((ev.op, ev.method, ev.status, ev.bytes_out)))
+    return got
+
+
+def test_upload_larger_than_one_fragment(fake_sp):
+    srv, connect = fake_sp
+    sp = connect()
+    got = fragments(sp)
+    item = sp.upload_large(PATH, DATA, chunk_size=CHUNK_ALIGN)
+    assert srv.graph.get_file(PATH) == DATA and item["eTag"] == sp.stat(PATH)["eTag"]
+    assert [(op, st) for op, _, st, _ in got] == [("upload_session", 200)] + [("upload_fragment", 202)] * 3 + [("upload_fragment", 201)]
+    assert [b for op, _, _, b in got if op == "upload_fragment"] == [CHUNK_ALIGN] * 3 + [CHUNK_ALIGN // 2]
+
+
+def test_upload_resumes_after_lost_fragment(fake_sp):
+    srv, connect = fake_sp
+    sp = connect()
+    request, lost = sp._request, []
+
+    def flaky(method, url, **kw):
+        if kw.get("op") == "upload_fragment" and kw["headers"]["Content-Range"].startswith(f"bytes {CHUNK_ALIGN}-") and not lost:
+            lost.append(request(method, url, **kw))      # chegou ao servidor, mas a resposta se perdeu
+            raise requests.ConnectionError("conexão caiu")
+        return request(method, url, **kw)
+
+    sp._request = flaky
+    got = fragments(sp)
+    sp.upload_large(PATH, DATA, chunk_size=CHUNK_ALIGN)
+    assert srv.graph.get_file(PATH) == DATA and lost
+    assert ("upload_session", "GET", 200) in [(op, m, st) for op, m, st, _ in got]     # nextExpectedRanges
+
+
+def test_upload_session_respects_if_match(fake_sp):
+    srv, connect = fake_sp
+    srv.graph.put_file(PATH, b"v1")
+    sp = connect()
+    etag = sp.stat(PATH)["eTag"]
+    srv.graph.put_file(PATH, b"v2")
+    with pytest.raises(PreconditionFailed):
+        sp.upload_large(PATH, DATA, if_match=etag, chunk_size=CHUNK_ALIGN)
+    assert srv.graph.get_file(PATH) == b"v2"
+
+
+def test_download_many_after_large_upload(fake_sp):
+    srv, connect = fake_sp
+    srv.graph.put_file("Pasta/a.bin", b"a")
+    sp = connect(cache_max_age=0)
+    sp.upload_large(PATH, DATA, chunk_size=CHUNK_ALIGN)
+    got = []
+    sp.add_hook(lambda ev: got.append((ev.op, ev.cache)))
+    assert sp.download_many([PATH, "Pasta/a.bin"]) == {PATH: DATA, "Pasta/a.bin": b"a"}
+    # o que foi enviado já está no cache: só a.bin tem o corpo baixado
+    assert got.count(("download", None)) == 1 and ("download", "hit") in got
@@ -0,0 +1,28 @@
+# Conferência do driveItem devolvido pelo upload (sp_verify.verify_upload)
+from sp_verify import quick_xor_hash, verify_upload
+
+CONTENT = b"conteudo do arquivo" * 50
+
+
+def item(size=len(CONTENT), xor=None, etag="e2"):
+    return {"eTag": etag, "cTag": "c2", "size": size,
+            "file": {"hashes": {"quickXorHash": xor or quick_xor_hash(CONTENT)}}}
+
+
+def test_matching_upload_is_ok():
+    check = verify_upload(item(), CONTENT, previous_etag="e1")
+    assert check.ok and not check.rewritten and not check.size_mismatch
+
+
+def test_hash_only_difference_is_rewrite_not_size_mismatch():
+    check = verify_upload(item(xor=quick_xor_hash(b"outro")), CONTENT, previous_etag="e1")
+    assert not check.ok and check.rewritten and not check.size_mismatch
+
+
+def test_size_difference_is_flagged():
+    check = verify_upload(item(size=len(CONTENT) + 10), CONTENT, previous_etag="e1")
+    assert check.rewritten and check.size_mismatch
+
+
+def test_unchanged_etag_is_a_problem():
+    assert verify_upload(item(etag="e1"), CONTENT, previous_etag="e1").problems == ["eTag não mudou"]
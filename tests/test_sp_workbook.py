@@ -0,0 +1,52 @@
+# Cache de índices ID -> linha compartilhado entre sessões (sp_workbook.RowIndexCache)
+import threading
+
+from sp_workbook import RowIndex, RowIndexCache
+
+
+class FakeWorkbook:
+    path = "Pasta/a.xlsx"
+
+    def __init__(self, rows):
+        self.rows, self.builds = rows, 0
+
+    def row_index(self, table, key_column="ID"):
+        self.builds += 1
+        return RowIndex(table, key_column, "Sheet1", ["ID", "Status"], 1, dict(self.rows))
+
+
+def test_reuses_index_until_it_misses_a_key():
+    wb, cache = FakeWorkbook({"A": 2, "B": 3}), RowIndexCache()
+    first = cache.get(wb, "T", keys=["A"])
+    assert cache.get(wb, "T", keys=["A", "B"]) is first and wb.builds == 1
+    wb.rows["C"] = 4
+    assert cache.get(wb, "T", keys=["C"]).rows["C"] == 4 and wb.builds == 2
+
+
+def test_discard_keeps_index_rebuilt_by_another_session():
+    wb, cache = FakeWorkbook({"A": 2}), RowIndexCache()
+    stale = cache.get(wb, "T")
+    cache.discard(wb.path, "T", stale)
+    fresh = cache.get(wb, "T")
+    cache.discard(wb.path, "T", stale)          # a falha de uma sessão com o índice velho chega depois
+    assert cache.get(wb, "T") is fresh and wb.builds == 2
+
+
+def test_concurrent_sessions():
+    wb, cache, errors = FakeWorkbook({f"K{i}": i + 2 for i in range(50)}), RowIndexCache(), []
+
+    def session(n):
+        try:
+            for i in range(200):
+                idx = cache.get(wb, "T", keys=[f"K{(n + i) % 50}"])
+                if i % 7 == 0:
+                    cache.discard(wb.path, "T", idx)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
@@ -0,0 +1,26 @@
+# Banco local dos apontamentos (storage.SQLiteStorage)
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from storage import SQLiteStorage, Storage
+
+COLS = ["ID", "Status", "Data Resolução"]
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_roundtrip_keys_dates_and_empty_cells(tmp_path):
+    store = SQLiteStorage(str(tmp_path / "a.db"), COLS)
+    store.add(pd.DataFrame({"ID": [" A1 ", 2.0], "Status": ["PENDENTE", None],
+                            "Data Resolução": pd.to_datetime(["2026-10-01", None])}))
+    store.update({"2": {"Status": "REALIZADO", "Data Resolução": date(2026, 10, 2)}})
+    df = store.load()
+    assert df["ID"].tolist() == ["A1", "2"]
+    assert df["Status"].tolist() == ["PENDENTE", "REALIZADO"]
+    assert df["Data Resolução"].tolist() == [pd.Timestamp("2026-10-01"), pd.Timestamp("2026-10-02")]
+    assert store.query({"Status": "REALIZADO"})["ID"].tolist() == ["2"]